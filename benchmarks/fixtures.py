@@ -0,0 +1,158 @@
+"""
+Offline fixtures for the proposal pipeline benchmarks.
+
+`build_workspace` creates a throw-away working directory with the layout the
+pipeline expects (`Proposta PPT/`, `Temp_ppt/`, `images/`, `DataBase.db`, `snapshots/`), with
+the database built from the snapshots in `DBases/` instead of the ANEEL API.
+`synthetic_customers` returns deterministic customer inputs covering every
+page variant of `generate_proposal`.
+"""
+
+import os
+import shutil
+import sqlite3
+from datetime import date
+
+import pandas as pd
+
+from modules.data_utils import preprocess_tarifas, write_tarifas
+from modules.snapshots import SNAPSHOT_DIR, SnapshotStore
+from modules.tariff_history import build_tariff_history
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DISTRIBUIDORA = "CEMIG-D"
+SUBGRUPO = "A4"
+MODALIDADE = "Verde"
+
+
+def build_workspace(path: str) -> str:
+    """
+    Create a benchmark workspace at `path` and return it.
+
+    Templates are symlinked (read-only for the pipeline); `images/` is copied
+    because the chart functions overwrite files there.
+    """
+    os.makedirs(path, exist_ok=True)
+    templates = os.path.join(path, "Proposta PPT")
+    if not os.path.exists(templates):
+        os.symlink(os.path.join(REPO_ROOT, "Proposta PPT"), templates)
+    shutil.copytree(os.path.join(REPO_ROOT, "images"), os.path.join(path, "images"), dirs_exist_ok=True)
+    os.makedirs(os.path.join(path, "Temp_ppt"), exist_ok=True)
+
+    db_path = os.path.join(path, "DataBase.db")
+    if not os.path.exists(db_path):
+        tarifas = preprocess_tarifas(pd.read_parquet(os.path.join(REPO_ROOT, "DBases", "tarifas.parquet")))
+        write_tarifas(tarifas, db_path)
+        build_tariff_history(tarifas, db_path)
+
+        conn = sqlite3.connect(db_path)
+        try:
+            contatos = pd.read_parquet(os.path.join(REPO_ROOT, "DBases", "Contatos_Agentes.parquet"))
+            contatos.to_sql("Contatos_Agentes", conn, if_exists="replace", index=False)
+            with sqlite3.connect(os.path.join(REPO_ROOT, "DBases", "aneel_database.db")) as flags_conn:
+                flags = pd.read_sql_query("SELECT * FROM tariff_flags", flags_conn)
+            flags.to_sql("tariff_flags", conn, if_exists="replace", index=False)
+        finally:
+            conn.close()
+        # Proposals pin the current snapshot; take it here rather than in the first timed run
+        SnapshotStore(root=os.path.join(path, SNAPSHOT_DIR), db_path=db_path).create()
+    return path
+
+
+def latest_resolution(db_path: str, distribuidora: str = DISTRIBUIDORA) -> str:
+    """Most recent `DscREH` of `distribuidora` in the workspace database."""
+    conn = sqlite3.connect(db_path)
+    try:
+        row = conn.execute(
+            "SELECT DscREH FROM ANEEL_DB WHERE SigAgente = ? ORDER BY DatInicioVigencia DESC LIMIT 1",
+            (distribuidora,),
+        ).fetchone()
+    finally:
+        conn.close()
+    return row[0]
+
+
+def first_agent(db_path: str) -> str:
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute("SELECT Agente FROM Contatos_Agentes ORDER BY Agente LIMIT 1").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def synthetic_customers(db_path: str) -> dict:
+    """
+    Deterministic customer inputs, one per page variant.
+
+    Returns:
+        dict: {variant name: keyword arguments for `generate_proposal` plus "yearly_data"}
+    """
+    resolucao = latest_resolution(db_path)
+    agente = first_agent(db_path)
+    years = [2026, 2027, 2028, 2029, 2030, 2031]
+    yearly_data = {year: {"Preço": 263.38 - 5 * i} for i, year in enumerate(years)}
+
+    grid_data = {
+        "Demanda - Ponta": 120.0,
+        "Demanda - Fora Ponta": 450.0,
+        "Demanda s/ ICMS - Ponta": 0.0,
+        "Demanda s/ ICMS - Fora Ponta": 30.0,
+        "Energia Ativa - Ponta": 18000.0,
+        "Energia Ativa - Fora Ponta": 160000.0,
+    }
+    base = dict(
+        IN="3014435811", produto="Curva de Preço", years=years, grid_data=grid_data, gd=False, irrigante=False,
+        icms=18.0, paseb=0.83, cofins=3.82, bandeira="Verde", icms_hr=0.0, desc_irrig=0.0,
+        distribuidora=DISTRIBUIDORA, subgrupo=SUBGRUPO, modalidade=MODALIDADE, resolucao=resolucao,
+        desconto=0.0, Razao_Social="Cliente Sintetico", Instalacao="3014435811", fat_ref=date(2025, 3, 1),
+        agente=agente, duracao_meses=60, yearly_data=yearly_data,
+    )
+
+    irrigante_grid = dict(grid_data, **{
+        "Demanda - Horário Reservado": 200.0,
+        "Demanda s/ ICMS - Horário Reservado": 0.0,
+        "Energia Ativa - Horário Reservado": 40000.0,
+    })
+    gd_grid = dict(grid_data, **{
+        "Energia Compensada - Ponta": 2000.0,
+        "Energia Compensada - Fora Ponta": 25000.0,
+    })
+    return {
+        "preco_fixo": base,
+        "desconto_garantido": dict(base, produto="Desconto Garantido", desconto=15.0),
+        "desconto_garantido_gd": dict(base, produto="Desconto Garantido", desconto=15.0, gd=True, grid_data=gd_grid),
+        "irrigante": dict(base, irrigante=True, icms_hr=0.0, desc_irrig=0.7, grid_data=irrigante_grid),
+    }
+
+
+def synthetic_history(months: int) -> dict:
+    """Synthetic consumption history for `create_historic_graph` with `months` entries."""
+    labels = [f"{(i % 12) + 1:02d}/{2020 + i // 12}" for i in range(months)]
+    actual = [90000 + 15000 * ((i * 7) % 5) for i in range(months)]
+    reference = [0.35 * value for value in actual]
+    new = [0.45 * value for value in actual]
+    return {"months": labels, "actual_values": actual, "new_values": new, "reference_values": reference}
+
+
+def synthetic_history_csv(installations: int, months: int) -> bytes:
+    """A distribuidora-style export (`;`, Brazilian numbers, Latin-1) for `import_history`."""
+    lines = ["Instalação;Mês Referência;Demanda Ponta (kW);Demanda Fora Ponta (kW);Consumo Ponta (MWh);Consumo Fora Ponta (kWh)"]
+    for n in range(installations):
+        for i in range(months):
+            lines.append(f"{3014400000 + n};{(i % 12) + 1:02d}/{2020 + i // 12};{100 + i % 7},5;{400 + i % 11};"
+                         f"{15 + i % 5},25;{150000 + 1000 * (i % 9)},00")
+    return ("\n".join(lines) + "\n").encode("latin-1")
+
+
+def synthetic_portfolio(customer: dict, installations: int) -> dict:
+    """A `generate_portfolio_proposal` portfolio: `customer`'s terms over `installations` scaled load profiles."""
+    portfolio = {name: value for name, value in customer.items() if name not in ("IN", "Instalacao", "grid_data")}
+    portfolio["installations"] = [
+        {
+            "Instalacao": str(3014500000 + n),
+            "grid_data": {name: value * (0.5 + (n % 7) / 6) for name, value in customer["grid_data"].items()},
+        }
+        for n in range(installations)
+    ]
+    return portfolio
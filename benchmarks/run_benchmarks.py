@@ -0,0 +1,482 @@
+"""
+Benchmarks for the proposal pipeline.
+
+Runs fully offline against a workspace built by `benchmarks.fixtures` and
+records wall time and peak Python memory (tracemalloc) for each stage. Results
+are written to `benchmarks/results/<commit>.json` and compared against the most
+recent earlier result file, so regressions show up across commits.
+
+Usage:
+    python -m benchmarks.run_benchmarks                  # all benchmarks
+    python -m benchmarks.run_benchmarks -k page -r 3     # names containing "page", 3 repeats
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.fixtures import build_workspace, synthetic_customers, synthetic_history, synthetic_history_csv, synthetic_portfolio, DISTRIBUIDORA, SUBGRUPO, MODALIDADE  # noqa: E402
+
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+BENCHMARKS = {}
+OUTPUTS = {}
+
+
+def benchmark(name: str, output: str = None):
+    """
+    Register `func(ctx)` as a benchmark. `func` may return a callable to time instead of being timed itself.
+
+    `output` names the file the benchmark writes (relative to the workspace); its size is recorded too.
+    """
+    def decorator(func):
+        BENCHMARKS[name] = func
+        if output:
+            OUTPUTS[name] = output
+        return func
+    return decorator
+
+
+def _uncached(func):
+    """Bypass the caching decorator so the benchmark measures the computation itself."""
+    return getattr(func, "__wrapped__", func)
+
+
+def _calc_inputs(ctx, variant="preco_fixo"):
+    from modules.calculations import prepare_quantidade, prepare_impostos_bandeira
+    from modules.data_utils import get_tariffs
+
+    customer = ctx["customers"][variant]
+    quantidade = prepare_quantidade(customer["grid_data"])
+    impostos = prepare_impostos_bandeira(customer["icms"], customer["paseb"], customer["cofins"], customer["bandeira"],
+                                         customer["icms_hr"], customer["desc_irrig"])
+    tarifa = get_tariffs(customer["distribuidora"], customer["subgrupo"], customer["modalidade"], customer["resolucao"])
+    preco = {
+        "preco": [customer["yearly_data"][year]["Preço"] for year in customer["years"]],
+        "produto": customer["produto"],
+        "anos": customer["years"],
+        "duracao_meses": customer["duracao_meses"],
+        "desconto": customer["desconto"] / 100,
+    }
+    return quantidade, impostos, tarifa, preco
+
+
+# --- Tariff lookup and calculations -------------------------------------------------------------
+
+@benchmark("get_tariffs")
+def bench_get_tariffs(ctx):
+    from modules.data_utils import get_tariffs
+    resolucao = ctx["customers"]["preco_fixo"]["resolucao"]
+    return lambda: get_tariffs(DISTRIBUIDORA, SUBGRUPO, MODALIDADE, resolucao)
+
+
+@benchmark("get_tariffs.snapshot")
+def bench_snapshot_tariffs(ctx):
+    from modules.snapshots import get_snapshot_store, snapshot_tariffs
+    resolucao = ctx["customers"]["preco_fixo"]["resolucao"]
+    snapshot = get_snapshot_store().current()
+    return lambda: _uncached(snapshot_tariffs)(snapshot, DISTRIBUIDORA, SUBGRUPO, MODALIDADE, resolucao)
+
+
+@benchmark("snapshots.current")
+def bench_snapshot_current(ctx):
+    from modules.snapshots import get_snapshot_store
+    return get_snapshot_store().current
+
+
+@benchmark("snapshots.create")
+def bench_snapshot_create(ctx):
+    import shutil
+    from modules.snapshots import SnapshotStore
+
+    store = SnapshotStore(root="snapshots_bench")
+
+    def run():
+        shutil.rmtree(store.root, ignore_errors=True)
+        return store.create()
+    return run
+
+
+@benchmark("calcular_fatura_cativa")
+def bench_fatura_cativa(ctx):
+    from modules.calculations import calcular_fatura_cativa
+    quantidade, impostos, tarifa, _ = _calc_inputs(ctx)
+    return lambda: _uncached(calcular_fatura_cativa)(quantidade, tarifa, dict(impostos))
+
+
+@benchmark("calcular_fatura_uso")
+def bench_fatura_uso(ctx):
+    from modules.calculations import calcular_fatura_uso
+    quantidade, impostos, tarifa, _ = _calc_inputs(ctx)
+    return lambda: _uncached(calcular_fatura_uso)(quantidade, tarifa, impostos)
+
+
+@benchmark("calcular_fatura_livre")
+def bench_fatura_livre(ctx):
+    from modules.calculations import calcular_fatura_livre
+    quantidade, impostos, _, preco = _calc_inputs(ctx)
+    return lambda: _uncached(calcular_fatura_livre)(quantidade, preco, impostos, 20000.0, 90000.0)
+
+
+# --- Charts ---------------------------------------------------------------------------------------
+
+@benchmark("bandeira_simulation.simulate_savings")
+def bench_simulate_savings(ctx):
+    from modules.bandeira_simulation import simulate_savings
+
+    probabilities = [[0.6, 0.2, 0.12, 0.08]] * 12
+    return lambda: simulate_savings([150000.0, 152500.0, 156000.0, 160000.0], 59000.0,
+                                    [57000.0, 56000.0, 55000.0, 54000.0, 53000.0], 60, probabilities)
+
+
+@benchmark("plot.flags_plot")
+def bench_flags_plot(ctx):
+    from modules.plot_generator import flags_plot
+    return lambda: flags_plot([22.0, 24.0, 27.0, 30.0])
+
+
+@benchmark("plot.yearly_economy_plot")
+def bench_yearly_economy_plot(ctx):
+    from modules.plot_generator import yearly_economy_plot
+    return lambda: yearly_economy_plot([2030, 2029, 2028, 2027, 2026], [35849.07, 42256.63, 36916.99, 31577.36, 4879],
+                                       [0.238, 0.281, 0.245, 0.21, 0.032])
+
+
+@benchmark("plot.price_curve_plot")
+def bench_price_curve_plot(ctx):
+    from modules.plot_generator import price_curve_plot
+    return lambda: price_curve_plot(["2026", "2027", "2028", "2029", "2030", "2031"], [395.0, 270.0, 245.0, 220.0, 250.0, 260.0])
+
+
+@benchmark("plot.historico_irrigante_plot")
+def bench_historico_irrigante_plot(ctx):
+    from modules.plot_generator import historico_irrigante_plot
+    months = [f"{m:02d}/24" for m in range(1, 13)]
+    cativo = [50000 + 1000 * i for i in range(12)]
+    livre = [38000 + 800 * i for i in range(12)]
+    return lambda: historico_irrigante_plot(months, cativo, livre, None)
+
+
+@benchmark("plot.flags_pie_plot")
+def bench_flags_pie_plot(ctx):
+    from modules.plot_generator import flags_pie_plot
+    return lambda: flags_pie_plot(["Verde", "Amarela", "Vermelha 1", "Vermelha 2"], [22.0, 24.0, 27.0, 30.0])
+
+
+@benchmark("plot.energy_cost_plot")
+def bench_energy_cost_plot(ctx):
+    from modules.plot_generator import energy_cost_plot
+    return lambda: energy_cost_plot(90000.0, 45000.0, 25000.0, 20000.0)
+
+
+def _register_historic_graph(months: int) -> None:
+    @benchmark(f"plot.create_historic_graph.{months}m", output="images/historic_graph.svg")
+    def bench_create_historic_graph(ctx):
+        from modules.plot_generator import create_historic_graph
+        history = synthetic_history(months)
+        return lambda: create_historic_graph(**history)
+
+
+# History lengths from one year up to a five-year contract
+for _months in (12, 24, 36, 60):
+    _register_historic_graph(_months)
+
+
+# --- Pages and PDF --------------------------------------------------------------------------------
+
+@benchmark("page.process_page1")
+def bench_page1(ctx):
+    from modules.pdf_builder import process_page1
+    customer = ctx["customers"]["preco_fixo"]
+    return lambda: _uncached(process_page1)(customer["Razao_Social"], customer["Instalacao"], customer["fat_ref"])
+
+
+@benchmark("page.process_page4")
+def bench_page4(ctx):
+    from modules.pdf_builder import process_page4
+    return lambda: _uncached(process_page4)("3014435811", 12345.67, 740740.2, 0.15)
+
+
+@benchmark("page.process_page5")
+def bench_page5(ctx):
+    from modules.pdf_builder import process_page5
+    return lambda: _uncached(process_page5)("3014435811", 12345.67, 740740.2, 0.15, 0.12)
+
+
+@benchmark("page.process_page6")
+def bench_page6(ctx):
+    from modules.pdf_builder import process_page6
+    return lambda: _uncached(process_page6)("3014435811", 12345.67, 740740.2, 0.22)
+
+
+@benchmark("page.process_page7")
+def bench_page7(ctx):
+    from modules.pdf_builder import process_page7
+    return lambda: _uncached(process_page7)("3014435811", 12345.67, 740740.2, 0.22, 148148.04)
+
+
+@benchmark("page.process_page10")
+def bench_page10(ctx):
+    from modules.pdf_builder import process_page10
+    agente = ctx["customers"]["preco_fixo"]["agente"]
+    return lambda: _uncached(process_page10)(agente)
+
+
+@benchmark("generate_pdf")
+def bench_generate_pdf(ctx):
+    from modules.pdf_builder import generate_pdf
+    svg_list = ["Proposta PPT/page 2.svg", "Proposta PPT/page 3.svg", "Proposta PPT/page 8.svg", "Proposta PPT/page 9.svg"]
+    from modules.output_sinks import MemorySink
+    return lambda: generate_pdf(svg_list, MemorySink(), dpi=300)
+
+
+def _proposal_runner(ctx, variant):
+    from modules.proposal_generator import generate_proposal
+
+    from modules.memoize import clear_caches
+
+    customer = dict(ctx["customers"][variant])
+
+    def run():
+        # Measure a cold pipeline, not a memoization hit from the previous repeat
+        clear_caches()
+        return generate_proposal(**customer, reuse_artifact=False)
+    return run
+
+
+@benchmark("generate_proposal.preco_fixo")
+def bench_proposal_preco_fixo(ctx):
+    return _proposal_runner(ctx, "preco_fixo")
+
+
+@benchmark("generate_proposal.desconto_garantido")
+def bench_proposal_desconto_garantido(ctx):
+    return _proposal_runner(ctx, "desconto_garantido")
+
+
+@benchmark("generate_proposal.irrigante")
+def bench_proposal_irrigante(ctx):
+    return _proposal_runner(ctx, "irrigante")
+
+
+@benchmark("generate_proposal.irrigante_history", output="images/historic_graph.svg")
+def bench_proposal_irrigante_history(ctx):
+    import io
+    from modules.consumption_history import import_history
+
+    import_history(io.BytesIO(synthetic_history_csv(1, 36)), "historico.csv")
+    customer = dict(ctx["customers"]["irrigante"], IN="3014400000", Instalacao="3014400000")
+    ctx["customers"]["irrigante_history"] = customer
+    return _proposal_runner(ctx, "irrigante_history")
+
+
+@benchmark("portfolio.price_portfolio.200")
+def bench_price_portfolio(ctx):
+    from modules.memoize import clear_caches
+    from modules.portfolio import normalize_portfolio, price_portfolio
+
+    installations = normalize_portfolio(synthetic_portfolio(ctx["customers"]["preco_fixo"], 200))
+
+    def run():
+        clear_caches()
+        return price_portfolio(installations)
+    return run
+
+
+@benchmark("portfolio.generate.20")
+def bench_generate_portfolio(ctx):
+    from modules.memoize import clear_caches
+    from modules.portfolio import generate_portfolio_proposal
+
+    portfolio = synthetic_portfolio(ctx["customers"]["preco_fixo"], 20)
+
+    def run():
+        clear_caches()
+        return generate_portfolio_proposal(portfolio, reuse_artifact=False)
+    return run
+
+
+@benchmark("comparison.compare_distribuidoras")
+def bench_compare_distribuidoras(ctx):
+    from modules.comparison import compare_inputs
+    from modules.memoize import clear_caches
+
+    customer = ctx["customers"]["preco_fixo"]
+
+    def run():
+        clear_caches()
+        return compare_inputs(customer)
+    return run
+
+
+@benchmark("tariff_history.compute")
+def bench_compute_tariff_history(ctx):
+    import sqlite3
+    import pandas as pd
+    from modules.tariff_history import compute_tariff_history
+
+    conn = sqlite3.connect("DataBase.db")
+    try:
+        tarifas = pd.read_sql_query("SELECT * FROM ANEEL_DB ORDER BY rowid", conn)
+    finally:
+        conn.close()
+    return lambda: compute_tariff_history(tarifas)
+
+
+@benchmark("tariff_history.last_adjustment")
+def bench_last_adjustment(ctx):
+    from modules.tariff_history import last_adjustment
+    from modules.memoize import clear_caches
+
+    def run():
+        clear_caches()
+        return last_adjustment(DISTRIBUIDORA, SUBGRUPO, MODALIDADE)
+    return run
+
+
+@benchmark("consumption_history.import_csv.12k")
+def bench_import_history(ctx):
+    import io
+    import sqlite3
+    from modules.consumption_history import import_history
+
+    sqlite3.connect("history_bench.db").close()  # `import_history` only writes into an existing database
+    data = synthetic_history_csv(200, 60)
+    return lambda: import_history(io.BytesIO(data), "historico.csv", db_path="history_bench.db")
+
+
+# --- Runner ---------------------------------------------------------------------------------------
+
+def _time(func, repeat: int) -> dict:
+    func()  # Warm-up: imports, font caches, first-parse costs
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        "status": "ok",
+        "repeat": repeat,
+        "min_s": min(durations),
+        "median_s": statistics.median(durations),
+        "throughput_per_s": 1 / statistics.median(durations) if statistics.median(durations) else None,
+        "peak_mem_kb": peak / 1024,
+    }
+
+
+def run(selected: list, repeat: int, workspace: str) -> dict:
+    build_workspace(workspace)
+    previous_cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        ctx = {"workspace": workspace, "customers": synthetic_customers(os.path.join(workspace, "DataBase.db"))}
+        results = {}
+        for name in selected:
+            try:
+                func = BENCHMARKS[name](ctx)
+                results[name] = _time(func, repeat)
+                if name in OUTPUTS:
+                    results[name]["output_kb"] = os.path.getsize(OUTPUTS[name]) / 1024
+            except (ImportError, OSError) as e:
+                # Missing optional native libraries (e.g. libcairo) should not abort the whole run
+                results[name] = {"status": "skipped", "reason": str(e).splitlines()[0]}
+            except Exception as e:
+                results[name] = {"status": "error", "reason": f"{type(e).__name__}: {e}"}
+            _print_result(name, results[name])
+        return results
+    finally:
+        os.chdir(previous_cwd)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _previous_results(commit: str) -> dict:
+    if not os.path.isdir(RESULTS_DIR):
+        return {}
+    files = [os.path.join(RESULTS_DIR, f) for f in os.listdir(RESULTS_DIR) if f.endswith(".json") and not f.startswith(commit)]
+    if not files:
+        return {}
+    with open(max(files, key=os.path.getmtime), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _print_result(name: str, result: dict) -> None:
+    if result["status"] != "ok":
+        print(f"{name:45s} {result['status']}: {result['reason']}")
+        return
+    output = f"   output {result['output_kb']:8.1f} KiB" if "output_kb" in result else ""
+    print(f"{name:45s} median {result['median_s'] * 1000:10.2f} ms   min {result['min_s'] * 1000:10.2f} ms   "
+          f"peak {result['peak_mem_kb']:10.1f} KiB{output}")
+
+
+def _print_comparison(results: dict, previous: dict) -> None:
+    if not previous:
+        return
+    print(f"\nChange vs {previous['commit']} (median wall time / peak memory):")
+    for name, result in results.items():
+        before = previous["results"].get(name)
+        if result["status"] != "ok" or not before or before.get("status") != "ok":
+            continue
+        time_delta = (result["median_s"] / before["median_s"] - 1) * 100
+        mem_delta = (result["peak_mem_kb"] / before["peak_mem_kb"] - 1) * 100 if before["peak_mem_kb"] else 0.0
+        print(f"{name:45s} {time_delta:+8.1f}%   {mem_delta:+8.1f}%")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for the proposal pipeline.")
+    parser.add_argument("-k", "--filter", default="", help="Only run benchmarks whose name contains this string.")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Timed repetitions per benchmark (default: 5).")
+    parser.add_argument("--workspace", default=None, help="Reuse a workspace directory instead of a temporary one.")
+    parser.add_argument("--no-save", action="store_true", help="Do not write the results file.")
+    args = parser.parse_args(argv)
+
+    selected = [name for name in BENCHMARKS if args.filter in name]
+    commit = _git_commit()
+    if args.workspace:
+        results = run(selected, args.repeat, os.path.abspath(args.workspace))
+    else:
+        with tempfile.TemporaryDirectory(prefix="proposal-bench-") as workspace:
+            results = run(selected, args.repeat, workspace)
+
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": results,
+    }
+    _print_comparison(results, _previous_results(commit))
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        with open(os.path.join(RESULTS_DIR, f"{commit}.json"), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
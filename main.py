@@ -1,44 +1,62 @@
 import streamlit as st
 import pandas as pd
-import threading
 from dateutil.relativedelta import relativedelta
 import streamlit.web.cli as stcli
 import sys
 from modules.data_utils import (
-    fetch_and_update_tarifas_background, update_event, fetch_distribuidoras, fetch_res_hom, fetch_contatos_agentes
-)                               
+    DB_PATH, fetch_distribuidoras, fetch_res_hom, fetch_contatos_agentes
+)
+from modules.update_service import get_update_service, RUNNING, RETRYING
 from modules.ui_components import (
     render_logos, render_header_inputs,  render_distribuidora_section, render_tax_inputs,
-    render_energy_grid, render_yearly_prices,  render_consumption_history, apply_css_spacing
+    render_energy_grid, render_yearly_prices,  render_consumption_history, apply_css_spacing,
+    render_proposal_job, render_preview_thumbnails, render_proposal_history, render_distribuidora_comparison,
+    render_tariff_adjustment, render_portfolio
 )
+from modules.comparison import compare_inputs
+from modules.jobs import get_job_manager
+from modules.memoize import canonical_key
 from modules.data_utils import setup_logger
-from modules.proposal_generator import generate_proposal
+from modules.worker_pool import get_worker_pool, render_in_pool, render_portfolio_in_pool
 import logging
+from concurrent.futures import TimeoutError as FutureTimeout
 
 st.set_page_config(layout="wide")
 
+PROPOSAL_WORKERS = 2
+PREVIEW_TIMEOUT = 15
+
 def main():
     print("Hello from apresentacao-energia-livre!")
 
     # Initialize logger
     logger = setup_logger("Proposal_Generator", level=logging.DEBUG)
     # Define file path
-    db_path = "DataBase.db"
+    db_path = DB_PATH
+
+    # Proposals render in warm worker processes; start them while the page loads.
+    # The job threads only wait on the workers, so they can match the pool size.
+    get_worker_pool(workers=PROPOSAL_WORKERS).start(wait=False)
+    get_job_manager(max_workers=PROPOSAL_WORKERS)
     
-    # Start background update if not already running
-    if 'update_thread' not in st.session_state:
-        st.session_state.update_thread = threading.Thread(target=fetch_and_update_tarifas_background)
-        st.session_state.update_thread.start()
+    # Start the shared background update (a no-op if another session already started it today,
+    # or while a failed run is cooling down)
+    update_service = get_update_service(db_path=db_path)
+    update_service.start()
+    update_status = update_service.status()
+    if update_status["state"] in (RUNNING, RETRYING):
         st.write("As tarifas estão sendo atualizadas em segundo plano no site da Aneel.")
+        st.progress(update_status["progress"])
 
-    print(f"update_event.is_set(): {update_event.is_set()}", flush=True)
+    update_done = update_service.is_done()
+    logger.debug(f"update_status: {update_status['state']}")
 
     # Check if update is complete and refresh data
-    if update_event.is_set():
-         st.session_state.Res_Hom = fetch_res_hom(db_path, st.session_state.Distribuidora[0], update_event.is_set())
+    if update_done and 'Distribuidora' in st.session_state:
+         st.session_state.Res_Hom = fetch_res_hom(db_path, st.session_state.Distribuidora[0], update_done)
 
     if 'Distribuidora' not in st.session_state:
-        st.session_state.Distribuidora = fetch_distribuidoras(db_path, update_event.is_set())
+        st.session_state.Distribuidora = fetch_distribuidoras(db_path, update_done)
 
     Agentes = fetch_contatos_agentes(db_path)
 
@@ -46,8 +64,8 @@ def main():
     if "consumption_history" not in st.session_state:
         st.session_state.consumption_history = pd.DataFrame(
             columns=["Month/Year", "Demanda Ponta", "Demanda Fora Ponta", "Demanda Horário Reservado", 
-                     "Energia Ponta", "Energia Fora Ponta"],
-            data=[["", 0.0, 0.0, 0.0, 0.0, 0.0]]  # Start with one empty row
+                     "Energia Ponta", "Energia Fora Ponta", "Energia Horário Reservado"],
+            data=[["", 0.0, 0.0, 0.0, 0.0, 0.0, 0.0]]  # Start with one empty row
         )
     
     if "yearly_data" not in st.session_state:
@@ -69,10 +87,11 @@ def main():
     
     # Fetch resolution homologatoria after distribuidora selection
     if distribuidora:
-        st.session_state.Res_Hom = fetch_res_hom(db_path, distribuidora, update_event.is_set())
+        st.session_state.Res_Hom = fetch_res_hom(db_path, distribuidora, update_done)
     
     # Render tax inputs
     resolucao, paseb, cofins, icms, icms_hr, desc_irrig = render_tax_inputs(irrigante)
+    render_tariff_adjustment(distribuidora, subgrupo, modalidade, resolucao)
 
     # Apply CSS for spacing
     apply_css_spacing()
@@ -81,6 +100,17 @@ def main():
     end_date = inicio_operacional + relativedelta(months=+duracao_meses)
     years = list(range(inicio_operacional.year, end_date.year + 1))
 
+    def proposal_inputs():
+        # The yearly prices are read when a button is clicked, once `render_yearly_prices` has filled them in
+        return dict(
+            IN=Instalacao, produto=produto, years=years, grid_data=grid_data, gd=gd, irrigante=irrigante,
+            icms=icms, paseb=paseb, cofins=cofins, bandeira=bandeira, icms_hr=icms_hr, desc_irrig=desc_irrig,
+            distribuidora=distribuidora, subgrupo=subgrupo, modalidade=modalidade, resolucao=resolucao,
+            desconto=desconto, Razao_Social=Razao_Social, Instalacao=Instalacao, fat_ref=fat_ref,
+            agente=agente, duracao_meses=duracao_meses, inicio_operacional=inicio_operacional,
+            yearly_data={year: dict(st.session_state.yearly_data[year]) for year in years},
+        )
+
     # Split layout into two side-by-side sections
     col1, col2 = st.columns([3, 1])  # 3/4 for energy inputs, 1/4 for yearly prices
 
@@ -88,20 +118,53 @@ def main():
     with col1:
         grid_data = render_energy_grid(irrigante, gd)
 
-        # Generate Proposal Button
-        if st.button("Gerar Proposta"):
-            generate_proposal(
-                Instalacao, produto, years, grid_data, gd, irrigante, icms, paseb, cofins, 
-                bandeira, icms_hr, desc_irrig, distribuidora, subgrupo, modalidade, 
-                resolucao, desconto, Razao_Social, Instalacao, fat_ref, agente, duracao_meses
+        # Draft preview: thumbnails of the client-specific pages, rendered right away at low resolution.
+        # Final proposal: the full PDF is rendered by a background job so the form stays responsive.
+        preview_col, final_col, compare_col = st.columns(3)
+        preview_clicked = preview_col.button("Pré-visualizar")
+        final_clicked = final_col.button("Gerar Proposta Final")
+        compare_clicked = compare_col.button("Comparar Distribuidoras")
+        if preview_clicked or final_clicked or compare_clicked:
+            inputs = proposal_inputs()
+        if preview_clicked:
+            with st.spinner("Gerando prévia..."):
+                try:
+                    st.session_state.proposal_preview = get_worker_pool().preview(inputs, timeout=PREVIEW_TIMEOUT)
+                except FutureTimeout:
+                    st.warning("A prévia demorou demais; tente novamente ou gere a proposta final.")
+                except Exception as e:
+                    st.error(f"Erro ao gerar a prévia: {e}")
+        if final_clicked:
+            st.session_state.proposal_job_id = get_job_manager().submit(
+                render_in_pool, inputs, key=canonical_key(inputs)
             )
+        if compare_clicked:
+            st.session_state.distribuidora_comparison = compare_inputs(inputs, db_path)
+
+        render_preview_thumbnails(st.session_state.get("proposal_preview"))
+        render_distribuidora_comparison(st.session_state.get("distribuidora_comparison"), distribuidora)
+        render_proposal_job()
 
     # Render yearly prices in right column
     with col2:
         render_yearly_prices(produto, years)
     
     # Render consumption history section
-    render_consumption_history()
+    render_consumption_history(Instalacao)
+
+    # Grupo econômico: the form's terms for many installations in one consolidated proposal
+    render_portfolio(
+        irrigante, gd, proposal_inputs,
+        submit_job=lambda portfolio, appendix: get_job_manager().submit(
+            render_portfolio_in_pool, portfolio, appendix=appendix, key=canonical_key(portfolio, appendix)
+        ),
+    )
+
+    # Recorded proposals: reopen or re-price without re-typing the inputs
+    render_proposal_history(
+        Agentes, st.session_state.Distribuidora,
+        submit_job=lambda inputs: get_job_manager().submit(render_in_pool, inputs, key=canonical_key(inputs)),
+    )
 
 
 if __name__ == "__main__":
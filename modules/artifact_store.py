@@ -0,0 +1,152 @@
+import os
+import logging
+import tempfile
+import threading
+from datetime import date
+from typing import Optional
+
+from modules.memoize import canonical_key, file_digest
+from modules.data_utils import DB_PATH, read_last_updated
+
+logger = logging.getLogger("Proposal_Generator")
+
+TEMPLATE_DIR = "Proposta PPT"
+
+def proposal_key(inputs: dict, template_dir: str = TEMPLATE_DIR, db_path: str = DB_PATH,
+                 day: Optional[date] = None) -> str:
+    """
+    Content address of a rendered proposal.
+
+    Combines the canonical hash of the `generate_proposal` inputs with the hashes
+    of every template page, the date of the last tariff update and the rendering
+    date (the validity date printed on the pages is today + 5 days). Inputs pinning a dataset snapshot already name the
+    data they are priced with, so the tariff update date is left out for them.
+
+    Args:
+        inputs (dict): Keyword arguments of `generate_proposal`, with `yearly_data` resolved.
+        template_dir (str): Directory holding the SVG templates.
+        db_path (str): Database the tariffs and contacts are read from.
+        day (date, optional): Rendering date; defaults to today.
+
+    Returns:
+        str: SHA-256 hex digest.
+    """
+    templates = {}
+    if os.path.isdir(template_dir):
+        for name in sorted(os.listdir(template_dir)):
+            if name.endswith(".svg"):
+                templates[name] = file_digest(os.path.join(template_dir, name))
+    return canonical_key(
+        inputs,
+        templates=templates,
+        tariffs_updated=None if inputs.get("snapshot") else read_last_updated(db_path),
+        day=day or date.today(),
+    )
+
+
+class ArtifactStore:
+    """
+    Content-addressed store of rendered PDFs on local disk.
+
+    Artifacts live at `<root>/<key[:2]>/<key>.pdf`. Reading an artifact touches
+    its modification time, and `put()` evicts the least recently used artifacts
+    once the store grows past `max_bytes`.
+
+    Args:
+        root (str): Store directory, created if missing.
+        max_bytes (int): Size bound of the store (default: 512 MiB).
+    """
+
+    def __init__(self, root: str = "artifacts", max_bytes: int = 512 * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key + ".pdf")
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Return the stored PDF for `key`, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        logger.info(f"Artifact cache hit {key[:12]} ({len(data) / 1024:.0f} KiB)")
+        return data
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store `data` under `key` (atomically) and evict old artifacts if the store is full."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.evict()
+
+    def _artifacts(self) -> list:
+        artifacts = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith(".pdf"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                artifacts.append((stat.st_mtime, stat.st_size, path))
+        return artifacts
+
+    def size(self) -> int:
+        """Total size of the stored artifacts in bytes."""
+        return sum(size for _, size, _ in self._artifacts())
+
+    def evict(self) -> int:
+        """
+        Remove least recently used artifacts until the store fits in `max_bytes`.
+
+        Returns:
+            int: Number of artifacts removed.
+        """
+        with self._lock:
+            artifacts = sorted(self._artifacts())
+            total = sum(size for _, size, _ in artifacts)
+            removed = 0
+            for _, size, path in artifacts:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+        if removed:
+            logger.info(f"Evicted {removed} artifacts, store now {total / 1024 / 1024:.1f} MiB")
+        return removed
+
+
+_store: Optional[ArtifactStore] = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store(**kwargs) -> ArtifactStore:
+    """
+    Return the process-wide artifact store, creating it on first use.
+
+    Keyword arguments are only applied when the store is created.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore(**kwargs)
+        return _store
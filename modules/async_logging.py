@@ -0,0 +1,158 @@
+"""
+Asynchronous, structured logging.
+
+`setup_logger` (in `modules.data_utils`) gives its logger a single
+`QueueHandler`. Records are put on an in-memory queue and written by a
+`QueueListener` thread that owns the file and console handlers, so the thread
+calling `logger.debug(...)` never touches the disk. It only renders the
+message, and only once the record passed the logger's level and the rate limit:
+the `%`-style arguments are rendered before the record is queued, so arguments
+mutated after the call do not change what is logged. Log with
+`logger.debug("quantidade: %s", quantidade)` rather than an f-string, which is
+formatted even when DEBUG is off.
+
+Files get one JSON object per line (`JsonFormatter`). Records below WARNING are
+rate-limited per call site (`RateLimitFilter`), so a loop logging on every
+iteration cannot flood the queue or the disk.
+"""
+
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from datetime import datetime
+
+# Attributes every LogRecord has; anything else was passed through `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime"}
+
+_exception_formatter = logging.Formatter()
+
+_listeners = []
+_listeners_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per record: "ts", "level", "logger", "message", "module", "line",
+    "process", "thread", the `extra=` fields, "suppressed" (see `RateLimitFilter`) and
+    "exc" when there is a traceback.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "module": record.module,
+            "line": record.lineno,
+            "process": record.process,
+            "thread": record.threadName,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith("_"):
+                entry[name] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per call site (logger, file, line) for records below `level`.
+
+    Each call site may log `burst` records at once and `rate` records per second
+    after that; the rest are dropped. The next record let through carries the
+    number dropped in its "suppressed" attribute. Records at `level` or above always pass.
+
+    Args:
+        rate (float): Records per second allowed per call site.
+        burst (int): Records allowed at once per call site.
+        level (int): Records at this level or above are never limited.
+    """
+
+    def __init__(self, rate: float = 10.0, burst: int = 50, level: int = logging.WARNING):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.level = level
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.level:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, suppressed = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    `QueueHandler` that renders the message and traceback before enqueueing, like the
+    stdlib one, but keeps them apart (and keeps the `extra=` fields) for `JsonFormatter`.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = _exception_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+def attach_queue(logger: logging.Logger, handlers: list, rate: float = 10.0, burst: int = 50) -> logging.Logger:
+    """
+    Route `logger` through a queue to `handlers`, which a listener thread writes to.
+
+    Args:
+        logger (logging.Logger): Logger receiving the `QueueHandler`.
+        handlers (list): Handlers owned by the listener (their own levels apply).
+        rate (float): See `RateLimitFilter`; 0 disables rate limiting.
+        burst (int): See `RateLimitFilter`.
+
+    Returns:
+        logging.Logger: `logger`.
+    """
+    records = queue.SimpleQueue()
+    handler = _QueueHandler(records)
+    if rate:
+        handler.addFilter(RateLimitFilter(rate, burst))
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    listener.start()
+    with _listeners_lock:
+        if not _listeners:
+            atexit.register(stop_logging)
+        _listeners.append(listener)
+    logger.addHandler(handler)
+    return logger
+
+
+def stop_logging() -> None:
+    """Write out the queued records and stop the listener threads (at exit, or before a process ends)."""
+    with _listeners_lock:
+        listeners = list(_listeners)
+        _listeners.clear()
+    for listener in listeners:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
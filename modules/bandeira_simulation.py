@@ -0,0 +1,201 @@
+"""
+Monte Carlo simulation of the tariff flags (bandeiras) over a contract.
+
+`gerar_graficos` prices the savings as if one flag held for the whole
+contract. This module draws monthly flag sequences instead. The draws use
+per-calendar-month probabilities calibrated from the flag history in the
+`bandeira_history` table, and the whole contract is evaluated across thousands
+of paths at once with NumPy. The result is the distribution of the contract
+savings and of the effective discount: percentile bands for the charts and
+the proposal record.
+"""
+
+import csv
+import io
+import logging
+import re
+import sqlite3
+from typing import Optional
+
+import numpy as np
+
+from modules.data_utils import DB_PATH, connect_db
+
+logger = logging.getLogger("Proposal_Generator")
+
+FLAGS = ("Verde", "Amarela", "Vermelha 1", "Vermelha 2")
+TABLE = "bandeira_history"
+
+PATHS = 10000
+PERCENTILES = (5, 25, 50, 75, 95)
+# Weight (in observations) of the all-months flag frequency in each calendar month's estimate
+PRIOR_WEIGHT = 2.0
+SEED = 0
+
+# `calibrate_probabilities` runs for every proposal; warn about missing history once per process
+_no_history_logged = False
+
+# Spellings found in ANEEL's published history -> flag. The 2021 "Escassez Hídrica"
+# flag has no column in `tariff_flags` and is priced as the highest one.
+_FLAG_ALIASES = {
+    "verde": "Verde", "amarela": "Amarela",
+    "vermelha 1": "Vermelha 1", "vermelha i": "Vermelha 1", "vermelha patamar 1": "Vermelha 1",
+    "vermelha 2": "Vermelha 2", "vermelha ii": "Vermelha 2", "vermelha patamar 2": "Vermelha 2",
+    "escassez hidrica": "Vermelha 2",
+}
+
+
+def _normalize_flag(value: str) -> Optional[str]:
+    text = str(value or "").strip().lower()
+    text = text.replace("í", "i").replace("-", " ")
+    text = re.sub(r"\s+", " ", re.sub(r"^bandeira ", "", text))
+    return _FLAG_ALIASES.get(text)
+
+
+def _normalize_month(value: str) -> Optional[str]:
+    """"2024-03" or "03/2024" -> "2024-03"."""
+    text = str(value or "").strip()
+    match = re.fullmatch(r"(\d{4})-(\d{1,2})(?:-\d{1,2})?", text) or re.fullmatch(r"(\d{1,2})/(\d{4})", text)
+    if not match:
+        return None
+    year, month = (match.group(1), match.group(2)) if len(match.group(1)) == 4 else (match.group(2), match.group(1))
+    if not 1 <= int(month) <= 12:
+        return None
+    return f"{int(year):04d}-{int(month):02d}"
+
+
+def _ensure_table(conn: sqlite3.Connection) -> None:
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {TABLE} (mes TEXT PRIMARY KEY, bandeira TEXT NOT NULL)")
+
+
+def store_bandeira_history(history: dict, db_path: str = DB_PATH) -> int:
+    """
+    Store flags by month, replacing months already stored.
+
+    Args:
+        history (dict): {"YYYY-MM" or "MM/YYYY": flag name}.
+        db_path (str): Path to the SQLite database.
+
+    Returns:
+        int: Number of months stored; unknown months or flags are skipped.
+    """
+    records = []
+    for month, flag in history.items():
+        mes, bandeira = _normalize_month(month), _normalize_flag(flag)
+        if mes is None or bandeira is None:
+            logger.warning(f"Skipping flag history entry {month!r}: {flag!r}")
+            continue
+        records.append((mes, bandeira))
+    conn = connect_db(db_path)
+    try:
+        with conn:
+            _ensure_table(conn)
+            conn.executemany(f"INSERT OR REPLACE INTO {TABLE} (mes, bandeira) VALUES (?, ?)", records)
+    finally:
+        conn.close()
+    return len(records)
+
+
+def import_bandeira_history(stream, db_path: str = DB_PATH) -> int:
+    """Import a `mes;bandeira` CSV (a header line is optional) into `bandeira_history`. Returns the months stored."""
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig") if not isinstance(stream, io.TextIOBase) else stream
+    rows = csv.reader(text, delimiter=";")
+    return store_bandeira_history({row[0]: row[1] for row in rows if len(row) >= 2 and _normalize_month(row[0])}, db_path)
+
+
+def calibrate_probabilities(db_path: str = DB_PATH, prior_weight: float = PRIOR_WEIGHT) -> Optional[list]:
+    """
+    Per-calendar-month flag probabilities from `bandeira_history`.
+
+    Each calendar month's observed frequencies are blended with the frequencies over
+    all months (weighted as `prior_weight` observations), so months with few years
+    of history are not dominated by one draw.
+
+    Args:
+        db_path (str): Database holding the history; proposals pass their dataset
+            snapshot (see `modules.snapshots.snapshot_probabilities`).
+        prior_weight (float): Weight, in observations, of the all-months frequencies.
+
+    Returns:
+        list: 12 rows (January first) of probabilities for `FLAGS`; None without any
+        history, in which case proposals are priced under the selected flag only.
+    """
+    global _no_history_logged
+    conn = connect_db(db_path)
+    try:
+        rows = conn.execute(f"SELECT mes, bandeira FROM {TABLE}").fetchall()
+    except sqlite3.OperationalError as e:
+        # Read-only dataset snapshots taken before the history was imported have no table
+        if "no such table" not in str(e):
+            raise
+        rows = []
+    finally:
+        conn.close()
+
+    counts = np.zeros((12, len(FLAGS)))
+    for mes, bandeira in rows:
+        if bandeira in FLAGS:
+            counts[int(mes[5:7]) - 1, FLAGS.index(bandeira)] += 1
+    if not counts.any():
+        if not _no_history_logged:
+            logger.warning(f"No flag history in {TABLE}, proposals are priced without the flag simulation")
+            _no_history_logged = True
+        return None
+    prior = counts.sum(axis=0) / counts.sum()
+    probabilities = (counts + prior_weight * prior) / (counts.sum(axis=1, keepdims=True) + prior_weight)
+    return probabilities.round(6).tolist()
+
+
+def simulate_savings(faturas_cativas: list, fatura_uso: float, faturas_livres: list, duracao_meses: int,
+                     probabilities: list, start_month: int = 1, paths: int = PATHS, seed: int = SEED) -> dict:
+    """
+    Distribution of the contract savings under simulated monthly flags.
+
+    Args:
+        faturas_cativas (list): Monthly captive invoice under each flag of `FLAGS`.
+        fatura_uso (float): Monthly distribution (TUSD) invoice.
+        faturas_livres (list): Monthly free-market invoice of each contract year.
+        duracao_meses (int): Contract length in months.
+        probabilities (list): 12 x len(FLAGS) per-calendar-month probabilities (see `calibrate_probabilities`).
+        start_month (int): Calendar month (1-12) of the first contract month.
+        paths (int): Number of simulated flag sequences.
+        seed (int): Random seed; the same inputs always give the same bands.
+
+    Returns:
+        dict: {
+            "percentis": `PERCENTILES`,
+            "economia_total": percentiles of the savings over the contract (R$),
+            "desconto": percentiles of the effective discount over the contract (%),
+            "economia_acumulada": percentiles of the cumulative savings at the end of each
+                contract year (years x percentiles),
+            "economia_media": mean savings over the contract (R$),
+            "prob_prejuizo": share of paths where the contract costs more than staying captive,
+        }
+    """
+    months = np.arange(duracao_meses)
+    calendar = (start_month - 1 + months) % 12
+    year = np.minimum(months // 12, len(faturas_livres) - 1)
+
+    cativa = np.asarray(faturas_cativas, dtype=float)                          # (flags,)
+    livre = np.asarray(faturas_livres, dtype=float)[year]                      # (months,)
+    savings = cativa[None, :] - fatura_uso - livre[:, None]                    # (months, flags)
+
+    cumulative = np.cumsum(np.asarray(probabilities, dtype=np.float32), axis=1)[calendar]  # (months, flags)
+    draws = np.random.default_rng(seed).random((paths, duracao_meses), dtype=np.float32)
+    flags = (draws[:, :, None] >= cumulative[None, :, :-1]).sum(axis=2)       # (paths, months)
+
+    monthly_savings = savings[months, flags]                                   # (paths, months)
+    accumulated = np.cumsum(monthly_savings, axis=1)
+    total = accumulated[:, -1]
+    captive_total = cativa[flags].sum(axis=1)
+    year_ends = np.minimum(np.arange(12, duracao_meses + 12, 12), duracao_meses) - 1
+    discount = 100 * total / np.where(captive_total != 0, captive_total, np.nan)
+
+    return {
+        "percentis": list(PERCENTILES),
+        "economia_total": np.percentile(total, PERCENTILES).tolist(),
+        "desconto": np.nanpercentile(discount, PERCENTILES).tolist(),
+        "economia_acumulada": np.percentile(accumulated[:, year_ends], PERCENTILES, axis=0).T.tolist(),
+        "economia_media": float(total.mean()),
+        "prob_prejuizo": float((total < 0).mean()),
+    }
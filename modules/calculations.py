@@ -1,19 +1,24 @@
 import pandas as pd
-import sqlite3
-import streamlit as st
-from modules.plot_generator import yearly_economy_plot, price_curve_plot, flags_plot, energy_cost_plot
+import shutil
+from modules.plot_generator import yearly_economy_plot, price_curve_plot, flags_plot, energy_cost_plot, create_historic_graph
+from modules.consumption_history import load_history, history_grid_data
 import logging
+from modules.tracing import span
+from modules.memoize import memoize, memoize_files
+from modules.bandeira_simulation import FLAGS, simulate_savings
+from modules.snapshots import snapshot_flag
+from modules.data_utils import connect_db
 
 logger = logging.getLogger("Proposal_Generator")
 
 
-@st.cache_data
+@memoize()
 def calcular_fatura_cativa(quantidade, tarifa, impostos_bandeira):
     """
     Calcula o valor a pagar por algum item/linha da fatura.
     :param quantidade: dict
     :param tarifa: dict
-    :param impostos_bandeira: dict containing icms, paseb, cofins, and bandeira
+    :param impostos_bandeira: dict containing icms, paseb, cofins, bandeira and the dataset snapshot
     :return: dict
 
     result_dict = {
@@ -53,13 +58,16 @@ def calcular_fatura_cativa(quantidade, tarifa, impostos_bandeira):
     icms = 1/(1- impostos_bandeira["icms"])
     icms_hr = 1/(1- impostos_bandeira["icms_hr"])
 
-    conn = sqlite3.connect("DataBase.db")
     flag = impostos_bandeira['bandeira']
-    query = f'SELECT "{flag}" FROM tariff_flags'
-    try:
-        bandeira = pd.read_sql_query(query, conn).iloc[0,0]
-    finally:
-        conn.close()
+    if impostos_bandeira.get("snapshot"):
+        bandeira = snapshot_flag(impostos_bandeira["snapshot"], flag)
+    else:
+        conn = connect_db()
+        query = f'SELECT "{flag}" FROM tariff_flags'
+        try:
+            bandeira = pd.read_sql_query(query, conn).iloc[0,0]
+        finally:
+            conn.close()
         
     result_dict["Demanda HFP"] = quantidade["Demanda HFP"] * tarifa["Demanda_HFP"] * icms * paseb_cofins
     result_dict["Demanda HFP sICMS"] = quantidade["Demanda HFP sICMS"] * tarifa["Demanda_HFP"] * paseb_cofins
@@ -95,7 +103,7 @@ def calcular_fatura_cativa(quantidade, tarifa, impostos_bandeira):
 
     return result_dict
 
-@st.cache_data
+@memoize()
 def calcular_fatura_uso(quantidade, tarifa, impostos_bandeira):
     """
     Calcula os valores relacionados à fatura de uso de energia elétrica com base nas quantidades, tarifas e impostos fornecidos.
@@ -185,7 +193,7 @@ def calcular_fatura_uso(quantidade, tarifa, impostos_bandeira):
     
     return result_dict
 
-@st.cache_data
+@memoize()
 def calcular_fatura_livre(quantidade, preco, impostos_bandeira, fatura_uso, fatura_cativa):
     """
     Calculates the "Fatura Livre" (Free Invoice) based on the provided parameters.
@@ -211,7 +219,7 @@ def calcular_fatura_livre(quantidade, preco, impostos_bandeira, fatura_uso, fatu
             - "Fatura Livre" (list): Calculated free invoice values for each year.
             - "anos" (list): List of years corresponding to the calculated values.
     Notes:
-        - The function uses the `@st.cache_data` decorator to cache the results for optimization.
+        - The results are memoized on the canonical hash of the inputs (see `modules.memoize`).
         - The calculation varies based on the pricing model specified in `preco["produto"]`:
             - "Desconto Garantido": Applies a discount to the captive invoice and subtracts the usage fee.
             - "Curva de Preço" and "PMT": Calculates based on energy quantities, tax rates, and prices.
@@ -239,20 +247,53 @@ def calcular_fatura_livre(quantidade, preco, impostos_bandeira, fatura_uso, fatu
         case "PMT":
                 result_dict["Fatura Livre"] = [preco["preco"][i]*(quantidade["Energia HP"] * icms + quantidade["Energia HFP"] * icms + quantidade["Energia HR"] * icms_hr)/1000 for i,_ in enumerate(preco["anos"])]
     
-    logger.debug(f"calcular_fatura_livre - fatura_cativa: {fatura_cativa}")
-    logger.debug(f"calcular_fatura_livre - fatura_uso: {fatura_uso}")
-    logger.debug(f"calcular_fatura_livre - len(preco['anos']): {len(preco['anos'])}")
-    logger.debug(f"calcular_fatura_livre - len(preco['preco']): {len(preco['preco'])}")
-    logger.debug(f"calcular_fatura_livre - quantidade: {quantidade}")
-    logger.debug(f"calcular_fatura_livre - result_dict: {result_dict}")
+    logger.debug("calcular_fatura_livre - fatura_cativa: %s", fatura_cativa)
+    logger.debug("calcular_fatura_livre - fatura_uso: %s", fatura_uso)
+    logger.debug("calcular_fatura_livre - len(preco['anos']): %d", len(preco['anos']))
+    logger.debug("calcular_fatura_livre - len(preco['preco']): %d", len(preco['preco']))
+    logger.debug("calcular_fatura_livre - quantidade: %s", quantidade)
+    logger.debug("calcular_fatura_livre - result_dict: %s", result_dict)
     return result_dict
 
-@st.cache_data
-def gerar_graficos(preco, quantidade, tarifa, impostos_bandeira,  fatura_uso, fatura_cativa, fatura_livre):
+CHART_FILES = (
+    "images/price_curve_plot.svg",
+    "images/yearly_economy_plot.svg",
+    "images/energy_cost_plot.svg",
+    "images/flags_plot.svg",
+)
+
+
+def calcular_faturas_bandeiras(quantidade, tarifa, impostos_bandeira):
+    """Monthly captive invoice (with compensation) under each flag of `FLAGS`."""
+    faturas_bandeiras = []
+    for bandeira in FLAGS:
+        new_dict = dict(impostos_bandeira)
+        new_dict["bandeira"] = bandeira
+        logger.debug("new_dict: %s", new_dict)
+        faturas_bandeiras.append(calcular_fatura_cativa(quantidade, tarifa, new_dict)["Fatura Cativa"])
+    return faturas_bandeiras
+
+
+@memoize_files(outputs=CHART_FILES)
+def gerar_graficos(preco, quantidade, tarifa, impostos_bandeira,  fatura_uso, fatura_cativa, fatura_livre,
+                   probabilidades_bandeira=None, faturas_bandeiras=None, start_month=1):
+    """
+    Draw the proposal charts into `CHART_FILES`.
+
+    With `probabilidades_bandeira` (see `calibrate_probabilities`) the flags chart also
+    shows the discount band over simulated monthly flags, starting in calendar month
+    `start_month`. `faturas_bandeiras` (see `calcular_faturas_bandeiras`) replaces pricing
+    `quantidade` at `tarifa` under each flag, e.g. with the invoices summed over a
+    portfolio of installations.
+
+    Returns:
+        dict: The `simulate_savings` result, or None without `probabilidades_bandeira`.
+    """
     months = [min(12, max(0, preco["duracao_meses"] - 12*i)) for i in range(len(preco["anos"]))]
 
     #price curve plot
-    price_curve_plot(preco["anos"], preco["preco"])
+    with span("chart.price_curve_plot"):
+        price_curve_plot(preco["anos"], preco["preco"])
     
     # Debugging output
     #logger.debug(f"len(preco['anos']): {len(preco['anos'])}")
@@ -262,28 +303,79 @@ def gerar_graficos(preco, quantidade, tarifa, impostos_bandeira,  fatura_uso, fa
     #logger.debug(f"preco['preco']: {preco['preco']}")
 
 
-    logger.debug(f"Impostos bandeira: {impostos_bandeira}")
+    logger.debug("Impostos bandeira: %s", impostos_bandeira)
 
     #yearly economy plot
     economy = [(fatura_cativa - fatura_uso - fatura_livre[i])*months[i] for i in range(len(months))]
     percentual_economy = [(fatura_cativa - fatura_uso - fatura_livre[i])/fatura_cativa for i in range(len(fatura_livre))]
-    yearly_economy_plot(preco["anos"], economy, percentual_economy)
+    with span("chart.yearly_economy_plot"):
+        yearly_economy_plot(preco["anos"], economy, percentual_economy)
     
     #flags plot
     descontos_bandeiras = []
-    for bandeira in ['Verde', 'Amarela', 'Vermelha I', 'Vermelha II']:
-        new_dict = impostos_bandeira
-        new_dict["bandeira"] = bandeira
-        logger.debug(f"new_dict: {new_dict}")
-        fatura_cativa_bandeira = calcular_fatura_cativa(quantidade, tarifa, new_dict)["Fatura Cativa"]
+    if faturas_bandeiras is None:
+        faturas_bandeiras = calcular_faturas_bandeiras(quantidade, tarifa, impostos_bandeira)
+    for fatura_cativa_bandeira in faturas_bandeiras:
         #descontos_bandeiras.append((fatura_cativa - fatura_uso - fatura_livre))
         mean_economy = sum((fatura_cativa_bandeira - fatura_uso - fatura_livre[i])*months[i] for i in range(len(months)))/preco["duracao_meses"]
         descontos_bandeiras.append(100*mean_economy/fatura_cativa_bandeira)
-    logger.debug(f"descontos_bandeiras: {descontos_bandeiras}")
+    logger.debug("descontos_bandeiras: %s", descontos_bandeiras)
+
+    simulacao = None
+    expected = None
+    if probabilidades_bandeira is not None:
+        with span("simulate_savings"):
+            simulacao = simulate_savings(faturas_bandeiras, fatura_uso, fatura_livre, preco["duracao_meses"],
+                                         probabilidades_bandeira, start_month=start_month)
+        # 5th, 50th and 95th percentiles of the discount
+        expected = (simulacao["desconto"][0], simulacao["desconto"][2], simulacao["desconto"][4])
+        logger.debug("simulacao bandeiras: %s", expected)
     #energy cost plot
     #energy_cost_plot(total_cost, energia_livre, servicos_distribuicao,economia, output_path='images/', filename='energy_cost_plot.svg')
-    energy_cost_plot(fatura_cativa,fatura_livre[0], fatura_uso, economy[0]/12)
-    flags_plot(descontos_bandeiras)
+    with span("chart.energy_cost_plot"):
+        energy_cost_plot(fatura_cativa,fatura_livre[0], fatura_uso, economy[0]/12)
+    with span("chart.flags_plot"):
+        flags_plot(descontos_bandeiras, expected=expected)
+    return simulacao
+
+
+# Months of imported consumption history shown on the irrigante page
+HISTORY_MONTHS = 36
+HISTORIC_GRAPH = "images/historic_graph.svg"
+# Sample chart shown on page 10 when an installation has no imported history
+HISTORIC_GRAPH_DEFAULT = "images/historic_graph_default.svg"
+
+
+def gerar_grafico_historico(instalacao, preco, tarifa, impostos_bandeira, months=HISTORY_MONTHS):
+    """
+    Draw `HISTORIC_GRAPH` from the consumption history imported for `instalacao`.
+
+    Each month is priced like the proposal itself: captive invoice, distribution
+    (TUSD) invoice and free-market invoice at the first year's price.
+
+    Returns:
+        bool: False when no history was imported for the installation; the chart is then
+            reset to `HISTORIC_GRAPH_DEFAULT`, so no other installation's chart is left in place.
+    """
+    history = load_history(instalacao, months=months)
+    if history.empty:
+        logger.debug(f"No consumption history for installation {instalacao}")
+        shutil.copyfile(HISTORIC_GRAPH_DEFAULT, HISTORIC_GRAPH)
+        return False
+
+    actual_values, reference_values, new_values = [], [], []
+    for _, row in history.iterrows():
+        quantidade = prepare_quantidade(history_grid_data(row))
+        fatura_cativa = calcular_fatura_cativa(quantidade, tarifa, impostos_bandeira)["Fatura Cativa s Compensação"]
+        fatura_uso = calcular_fatura_uso(quantidade, tarifa, impostos_bandeira)["Fatura de Uso"]
+        fatura_livre = calcular_fatura_livre(quantidade, preco, impostos_bandeira, fatura_uso, fatura_cativa)["Fatura Livre"]
+        actual_values.append(fatura_cativa)
+        reference_values.append(fatura_uso)
+        new_values.append(fatura_livre[0])
+    with span("chart.create_historic_graph"):
+        create_historic_graph(list(history["Month/Year"]), actual_values, new_values, reference_values,
+                              output_path=HISTORIC_GRAPH)
+    return True
 
 
 def prepare_quantidade(grid_data):
@@ -302,14 +394,16 @@ def prepare_quantidade(grid_data):
     }
 
 
-def prepare_impostos_bandeira(icms, paseb, cofins, bandeira, icms_hr, desc_irrig):
+def prepare_impostos_bandeira(icms, paseb, cofins, bandeira, icms_hr, desc_irrig, snapshot=None):
     return {
         "icms": icms / 100,
         "paseb": paseb / 100,
         "cofins": cofins / 100,
         "bandeira": bandeira,
         "icms_hr": icms_hr,  
-        "desc_irr": desc_irrig
+        "desc_irr": desc_irrig,
+        # Dataset snapshot the flag values are read from (see `modules.snapshots`); None reads DataBase.db
+        "snapshot": snapshot,
     }
 
 
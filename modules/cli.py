@@ -0,0 +1,369 @@
+"""
+Command line interface for proposal generation.
+
+Usage:
+    proposal render --input customer.json --out proposta.pdf
+    proposal preview --input customer.json --out-dir previa/
+    proposal batch customers.jsonl more/*.json --out-dir propostas/
+    proposal serve --port 8080 --workers 4
+    proposal compile-templates
+    proposal import-history faturas.csv historico.xlsx
+    proposal import-bandeiras bandeiras.csv
+    proposal compare --input customer.json --top 10
+    proposal list --agente "Agente" --since 2026-01-01 --page 2
+    proposal reprice 42 --price 2026=250.5 --price 2027=245 --out proposta.pdf
+    proposal reprice 42 --latest-data --out proposta_atualizada.pdf
+    proposal portfolio --input grupo.json --out proposta_grupo.pdf --no-appendix
+    proposal snapshots --create --gc
+
+`python -m modules.cli ...` works the same without installing the script.
+Input files hold the keyword arguments of `generate_proposal` (see
+`modules.proposal_api.normalize_inputs`); portfolio files add an
+"installations" list (see `modules.portfolio.normalize_portfolio`). Paths such as `Proposta PPT/` and
+`DataBase.db` are resolved against `--workdir`.
+"""
+
+import argparse
+import logging
+import os
+import sys
+import time
+from datetime import date
+
+from modules.data_utils import setup_logger
+from modules.output_sinks import DirectorySink
+from modules.proposal_api import PREVIEW_DPI, load_inputs, normalize_inputs, render_preview, render_proposal
+
+# Each worker keeps its own warm caches and renders at full resolution, so do not scale with the core count
+DEFAULT_WORKERS = min(4, os.cpu_count() or 2)
+
+
+def _render(args) -> int:
+    inputs = load_inputs(args.input)
+    if len(inputs) != 1:
+        print(f"{args.input} holds {len(inputs)} proposals; use 'proposal batch' instead", file=sys.stderr)
+        return 2
+    rendered = render_proposal(inputs[0], reuse_artifact=not args.no_cache)
+    if not rendered.size:
+        print("Proposal generation failed, see the log for details", file=sys.stderr)
+        return 1
+    out = args.out
+    with DirectorySink(os.path.dirname(out)).open(os.path.basename(out)) as f:
+        f.write(rendered.getvalue())
+    print(out)
+    return 0
+
+
+def _preview(args) -> int:
+    inputs = load_inputs(args.input)
+    if len(inputs) != 1:
+        print(f"{args.input} holds {len(inputs)} proposals; previews take one", file=sys.stderr)
+        return 2
+    sink = DirectorySink(args.out_dir)
+    for name, png in render_preview(inputs[0], dpi=args.dpi):
+        with sink.open(f"{name}.png") as f:
+            f.write(png)
+        print(sink.location)
+    return 0
+
+
+def _batch(args) -> int:
+    sink = DirectorySink(os.path.abspath(args.out_dir))
+    start = time.perf_counter()
+    pool = None
+    if args.workers > 0:
+        from modules.worker_pool import ProposalWorkerPool
+        pool = ProposalWorkerPool(workers=args.workers, base_dir=".").start()
+
+    # Queue everything first so the workers stay busy, then collect in input order
+    jobs = []
+    for path in args.inputs:
+        for i, inputs in enumerate(load_inputs(path)):
+            label = f"{path}[{i}]"
+            try:
+                inputs = normalize_inputs(inputs)
+            except ValueError as e:
+                jobs.append((label, e))
+                continue
+            if pool is not None:
+                jobs.append((label, pool.submit(inputs, reuse_artifact=not args.no_cache)))
+            else:
+                jobs.append((label, inputs))
+
+    written = set()
+    failed = 0
+    for total, (label, job) in enumerate(jobs, start=1):
+        try:
+            if isinstance(job, Exception):
+                raise job
+            if pool is not None:
+                filename, data = job.result()
+            else:
+                rendered = render_proposal(job, reuse_artifact=not args.no_cache)
+                if not rendered.size:
+                    raise RuntimeError("no PDF was written, see the log for details")
+                filename, data = rendered.filename, rendered.getvalue()
+        except Exception as e:
+            failed += 1
+            print(f"FAILED {label}: {e}", file=sys.stderr)
+            continue
+        if filename in written:
+            # Same client, installation and product: keep both instead of overwriting
+            stem, ext = os.path.splitext(filename)
+            filename = f"{stem}_{total}{ext}"
+        written.add(filename)
+        with sink.open(filename) as f:
+            f.write(data)
+        print(f"{label} -> {sink.location}")
+
+    if pool is not None:
+        pool.shutdown()
+    print(f"{len(jobs) - failed}/{len(jobs)} proposals rendered in {time.perf_counter() - start:.1f}s")
+    return 1 if failed else 0
+
+
+def _serve(args) -> int:
+    from modules.service import ProposalService
+
+    service = ProposalService(host=args.host, port=args.port, workers=args.workers, max_queue=args.max_queue,
+                              timeout=args.timeout)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _compile_templates(args) -> int:
+    from modules.template_compiler import TemplateError, compile_templates, format_report
+
+    try:
+        reports = compile_templates(image_dpi=args.image_dpi, image_quality=args.image_quality)
+    except TemplateError as e:
+        print(f"Template compilation failed: {e}", file=sys.stderr)
+        return 1
+    print(format_report(reports))
+    for name, report in reports.items():
+        if report["absent_placeholders"]:
+            print(f"warning: {name} has no element {', '.join(report['absent_placeholders'])}", file=sys.stderr)
+    return 0
+
+
+def _import_history(args) -> int:
+    from modules.consumption_history import import_history
+
+    failed = 0
+    for path in args.files:
+        try:
+            with open(path, "rb") as f:
+                report = import_history(f, os.path.basename(path))
+        except (OSError, ValueError) as e:
+            failed += 1
+            print(f"FAILED {path}: {e}", file=sys.stderr)
+            continue
+        print(f"{path}: {report['rows_imported']} months for {report['installations']} installations, "
+              f"{report['rows_rejected']} rows rejected")
+        for error in report["errors"]:
+            print(f"  {error}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+def _import_bandeiras(args) -> int:
+    from modules.bandeira_simulation import calibrate_probabilities, import_bandeira_history
+
+    with open(args.file, "rb") as f:
+        stored = import_bandeira_history(f)
+    print(f"{args.file}: {stored} months stored")
+    for month, probabilities in enumerate(calibrate_probabilities() or [], start=1):
+        print(f"  {month:02d}: " + "  ".join(f"{p:.0%}" for p in probabilities))
+    return 0
+
+
+def _compare(args) -> int:
+    from modules.comparison import compare_inputs
+
+    inputs = load_inputs(args.input)
+    if len(inputs) != 1:
+        print(f"{args.input} holds {len(inputs)} proposals; comparisons take one", file=sys.stderr)
+        return 2
+    ranking = compare_inputs(normalize_inputs(inputs[0]))
+    if args.top:
+        ranking = ranking.head(args.top)
+    print(ranking.to_string(index=False, float_format=lambda value: f"{value:,.2f}"))
+    return 0
+
+
+def _list(args) -> int:
+    from modules.proposal_store import list_proposals
+
+    df, total = list_proposals(agente=args.agente, distribuidora=args.distribuidora, since=args.since,
+                               until=args.until, page=args.page - 1, page_size=args.page_size)
+    if df.empty:
+        print("No proposals found")
+        return 0
+    print(df.to_string(index=False))
+    print(f"page {args.page} of {max(1, -(-total // args.page_size))} ({total} proposals)")
+    return 0
+
+
+def _reprice(args) -> int:
+    from modules.proposal_store import get_proposal, reprice_inputs
+
+    proposal = get_proposal(args.id)
+    if proposal is None:
+        print(f"No proposal {args.id}", file=sys.stderr)
+        return 2
+    try:
+        prices = dict(price.split("=", 1) for price in args.price)
+    except ValueError:
+        print("Prices are given as YEAR=PRICE", file=sys.stderr)
+        return 2
+    # Recorded proposals are priced with the dataset snapshot they pinned, unless asked otherwise
+    overrides = {"snapshot": None} if args.latest_data else {}
+    try:
+        rendered = render_proposal(reprice_inputs(proposal, prices, **overrides), reuse_artifact=not args.no_cache)
+    except ValueError as e:
+        print(f"{e}; use --latest-data to price with the current data", file=sys.stderr)
+        return 2
+    if not rendered.size:
+        print("Proposal generation failed, see the log for details", file=sys.stderr)
+        return 1
+    with DirectorySink(os.path.dirname(args.out)).open(os.path.basename(args.out)) as f:
+        f.write(rendered.getvalue())
+    print(args.out)
+    return 0
+
+
+def _portfolio(args) -> int:
+    from modules.portfolio import generate_portfolio_proposal
+
+    portfolios = load_inputs(args.input)
+    if len(portfolios) != 1:
+        print(f"{args.input} holds {len(portfolios)} portfolios; give one per file", file=sys.stderr)
+        return 2
+    try:
+        rendered = generate_portfolio_proposal(portfolios[0], appendix=not args.no_appendix,
+                                               max_workers=args.threads, reuse_artifact=not args.no_cache)
+    except ValueError as e:
+        print(f"Invalid portfolio: {e}", file=sys.stderr)
+        return 2
+    if not rendered.size:
+        print("Proposal generation failed, see the log for details", file=sys.stderr)
+        return 1
+    with DirectorySink(os.path.dirname(args.out)).open(os.path.basename(args.out)) as f:
+        f.write(rendered.getvalue())
+    print(args.out)
+    return 0
+
+
+def _snapshots(args) -> int:
+    from modules.snapshots import get_snapshot_store
+
+    store = get_snapshot_store()
+    if args.create:
+        print(f"current snapshot: {store.create()}")
+    if args.gc:
+        print(f"{store.gc()} snapshots removed")
+    print(store.list().to_string(index=False))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="proposal", description="Render energy proposals without the web UI.")
+    parser.add_argument("--workdir", default=".", help="Directory holding 'Proposta PPT/', 'images/' and DataBase.db")
+    parser.add_argument("--no-cache", action="store_true", help="Always render, ignoring stored artifacts")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Log debug messages")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    render = commands.add_parser("render", help="Render one proposal")
+    render.add_argument("--input", required=True, help="JSON file with the proposal inputs")
+    render.add_argument("--out", required=True, help="Output PDF path")
+    render.set_defaults(handler=_render)
+
+    preview = commands.add_parser("preview", help="Render low-resolution PNG thumbnails of the client-specific pages")
+    preview.add_argument("--input", required=True, help="JSON file with the proposal inputs")
+    preview.add_argument("--out-dir", required=True, help="Directory receiving the PNGs")
+    preview.add_argument("--dpi", type=int, default=PREVIEW_DPI, help="Thumbnail resolution")
+    preview.set_defaults(handler=_preview)
+
+    batch = commands.add_parser("batch", help="Render every proposal in one or more input files")
+    batch.add_argument("inputs", nargs="+", help="JSON / JSON Lines files with proposal inputs")
+    batch.add_argument("--out-dir", required=True, help="Directory receiving the PDFs")
+    batch.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                       help="Warm worker processes (default: %(default)s); 0 renders in this process")
+    batch.set_defaults(handler=_batch)
+
+    serve = commands.add_parser("serve", help="Serve proposals over HTTP (POST /proposals)")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8080)
+    serve.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                       help="Worker processes (default: %(default)s)")
+    serve.add_argument("--max-queue", type=int, default=8, help="Requests waiting for a worker before answering 503")
+    serve.add_argument("--timeout", type=float, default=120.0, help="Seconds before a request answers 504")
+    serve.set_defaults(handler=_serve)
+
+    compile_ = commands.add_parser("compile-templates", help="Build compact production templates from 'Proposta PPT/'")
+    compile_.add_argument("--image-dpi", type=int, default=200, help="Resolution of embedded rasters over the page width")
+    compile_.add_argument("--image-quality", type=int, default=85, help="JPEG quality of re-encoded rasters")
+    compile_.set_defaults(handler=_compile_templates)
+
+    history = commands.add_parser("import-history", help="Import consumption history exports into the database")
+    history.add_argument("files", nargs="+", help="CSV or XLSX invoice exports")
+    history.set_defaults(handler=_import_history)
+
+    bandeiras = commands.add_parser("import-bandeiras", help="Import the monthly flag history (mes;bandeira CSV)")
+    bandeiras.add_argument("file", help="CSV with one 'YYYY-MM;Bandeira' line per month")
+    bandeiras.set_defaults(handler=_import_bandeiras)
+
+    compare = commands.add_parser("compare", help="Rank every distribuidora by the savings for one load profile")
+    compare.add_argument("--input", required=True, help="JSON file with the proposal inputs")
+    compare.add_argument("--top", type=int, help="Only the best N distribuidoras")
+    compare.set_defaults(handler=_compare)
+
+    list_ = commands.add_parser("list", help="List recorded proposals, newest first")
+    list_.add_argument("--agente", help="Only proposals of this agent")
+    list_.add_argument("--distribuidora", help="Only proposals for this distribuidora")
+    list_.add_argument("--since", type=date.fromisoformat, help="Created on or after YYYY-MM-DD")
+    list_.add_argument("--until", type=date.fromisoformat, help="Created on or before YYYY-MM-DD")
+    list_.add_argument("--page", type=int, default=1)
+    list_.add_argument("--page-size", type=int, default=25)
+    list_.set_defaults(handler=_list)
+
+    reprice = commands.add_parser("reprice", help="Render a recorded proposal again with new yearly prices")
+    reprice.add_argument("id", type=int, help="Proposal id (see 'proposal list')")
+    reprice.add_argument("--price", action="append", default=[], help="New price of a year, as YEAR=PRICE")
+    reprice.add_argument("--out", required=True, help="Output PDF path")
+    reprice.add_argument("--latest-data", action="store_true",
+                         help="Price with the current tariffs and contacts instead of the proposal's snapshot")
+    reprice.set_defaults(handler=_reprice)
+
+    portfolio = commands.add_parser("portfolio", help="Render one consolidated proposal for many installations")
+    portfolio.add_argument("--input", required=True, help="JSON file with the shared inputs and an 'installations' list")
+    portfolio.add_argument("--out", required=True, help="Output PDF path")
+    portfolio.add_argument("--no-appendix", action="store_true", help="Leave out the page of each installation")
+    portfolio.add_argument("--threads", type=int, default=8, help="Threads pricing the installations")
+    portfolio.set_defaults(handler=_portfolio)
+
+    snapshots = commands.add_parser("snapshots", help="List the dataset snapshots proposals are priced with")
+    snapshots.add_argument("--create", action="store_true", help="Snapshot the current tariffs and contacts")
+    snapshots.add_argument("--gc", action="store_true", help="Remove snapshots outside the retention policy")
+    snapshots.set_defaults(handler=_snapshots)
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    # Input and output paths are resolved before changing into the working directory
+    for name in ("input", "out", "out_dir", "file"):
+        if getattr(args, name, None):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    for name in ("inputs", "files"):
+        if getattr(args, name, None):
+            setattr(args, name, [os.path.abspath(path) for path in getattr(args, name)])
+    os.chdir(args.workdir)
+    setup_logger("Proposal_Generator", level=logging.DEBUG if args.verbose else logging.INFO)
+    return args.handler(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
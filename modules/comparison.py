@@ -0,0 +1,156 @@
+"""
+Cross-distribuidora comparison.
+
+Prices one load profile against the latest resolution of every distribuidora
+for a subgroup and modality. The tariffs of all distribuidoras are read in one
+query and laid out as columns (one row per distribuidora). The invoice
+formulas of `modules.calculations` then run once over those columns instead of
+once per distribuidora.
+"""
+
+import logging
+from datetime import date
+from typing import Optional
+
+import pandas as pd
+
+from modules.calculations import (
+    calcular_fatura_cativa, calcular_fatura_uso, calcular_fatura_livre, prepare_quantidade, prepare_impostos_bandeira
+)
+from modules.data_utils import DB_PATH, connect_db
+from modules.tracing import span
+
+logger = logging.getLogger("Proposal_Generator")
+
+# (tariff component, DscUnidadeTerciaria, NomPostoTarifario, value column, divisor), as in `get_tariffs`
+TARIFF_COMPONENTS = (
+    ("Demanda_HFP", "kW", "Fora ponta", "VlrTUSD", 1),
+    ("Demanda_HP", "kW", "Ponta", "VlrTUSD", 1),
+    ("Consumo_HFP_TE", "MWh", "Fora ponta", "VlrTE", 1000),
+    ("Consumo_HFP_TUSD", "MWh", "Fora ponta", "VlrTUSD", 1000),
+    ("Consumo_HP_TE", "MWh", "Ponta", "VlrTE", 1000),
+    ("Consumo_HP_TUSD", "MWh", "Ponta", "VlrTUSD", 1000),
+)
+
+
+def latest_tariffs(subgrupo: str, modalidade: str, db_path: str = DB_PATH,
+                   as_of: Optional[date] = None) -> pd.DataFrame:
+    """
+    Tariff components of every distribuidora's latest resolution for `subgrupo`/`modalidade`.
+
+    Args:
+        subgrupo (str): Subgroup, e.g. "A4".
+        modalidade (str): Tariff modality, e.g. "Verde".
+        db_path (str): Path to the SQLite database.
+        as_of (date, optional): Only resolutions in force on or before this day; None takes the latest published.
+
+    Returns:
+        pd.DataFrame: Indexed by distribuidora, with "resolucao", "inicio_vigencia" and the
+        `get_tariffs` keys as columns (missing components are 0, as in `get_tariffs`).
+    """
+    vigencia = "AND DatInicioVigencia <= ?" if as_of else ""
+    query = f"""
+        WITH latest AS (
+            SELECT SigAgente, DscREH, MAX(DatInicioVigencia) AS DatInicioVigencia
+            FROM ANEEL_DB
+            WHERE DscSubGrupo = ? AND DscModalidadeTarifaria = ? {vigencia}
+            GROUP BY SigAgente
+        )
+        SELECT t.SigAgente, t.DscREH, latest.DatInicioVigencia, t.DscUnidadeTerciaria, t.NomPostoTarifario,
+               t.VlrTUSD, t.VlrTE
+        FROM ANEEL_DB t
+        JOIN latest ON t.SigAgente = latest.SigAgente AND t.DscREH = latest.DscREH
+        WHERE t.DscSubGrupo = ? AND t.DscModalidadeTarifaria = ?
+        ORDER BY t.rowid
+    """
+    params = [subgrupo, modalidade] + ([as_of.isoformat()] if as_of else []) + [subgrupo, modalidade]
+    conn = connect_db(db_path)
+    try:
+        rows = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+
+    # `get_tariffs` takes the first matching row of each component
+    rows = rows.drop_duplicates(["SigAgente", "DscUnidadeTerciaria", "NomPostoTarifario"])
+    tariffs = rows.groupby("SigAgente")[["DscREH", "DatInicioVigencia"]].first()
+    tariffs.columns = ["resolucao", "inicio_vigencia"]
+    for name, unit, posto, column, divisor in TARIFF_COMPONENTS:
+        component = rows[(rows["DscUnidadeTerciaria"] == unit) & (rows["NomPostoTarifario"] == posto)]
+        tariffs[name] = component.set_index("SigAgente")[column].reindex(tariffs.index).fillna(0) / divisor
+    tariffs["Consumo_HFP"] = tariffs["Consumo_HFP_TE"] + tariffs["Consumo_HFP_TUSD"]
+    tariffs["Consumo_HP"] = tariffs["Consumo_HP_TE"] + tariffs["Consumo_HP_TUSD"]
+    tariffs.index.name = "distribuidora"
+
+    # Resolutions published without values for this modality cannot be priced
+    empty = (tariffs["Demanda_HFP"] == 0) & (tariffs["Consumo_HFP"] == 0)
+    if empty.any():
+        logger.debug(f"No tariff values for {subgrupo} {modalidade}: {', '.join(tariffs.index[empty])}")
+    return tariffs[~empty]
+
+
+def compare_distribuidoras(quantidade: dict, preco: dict, impostos_bandeira: dict, subgrupo: str, modalidade: str,
+                           db_path: str = DB_PATH, as_of: Optional[date] = None) -> pd.DataFrame:
+    """
+    Rank every distribuidora by the savings achievable for one load profile.
+
+    Args:
+        quantidade (dict): As returned by `prepare_quantidade`.
+        preco (dict): As built by `_render_pages` (product, yearly prices, discount).
+        impostos_bandeira (dict): As returned by `prepare_impostos_bandeira`.
+        subgrupo (str): Subgroup, e.g. "A4".
+        modalidade (str): Tariff modality, e.g. "Verde".
+        db_path (str): Path to the SQLite database.
+        as_of (date, optional): See `latest_tariffs`.
+
+    Returns:
+        pd.DataFrame: One row per distribuidora, best savings first, with the resolution,
+        the first year's invoices and the monthly savings in R$ and as a share of the captive invoice.
+    """
+    with span("comparison.latest_tariffs"):
+        tariffs = latest_tariffs(subgrupo, modalidade, db_path, as_of)
+    if tariffs.empty:
+        logger.warning(f"No tariffs for {subgrupo} {modalidade}")
+
+    # The formulas only use arithmetic, so columns go through them like scalars
+    with span("comparison.faturas"):
+        tarifa = {name: tariffs[name] for name in tariffs.columns if name not in ("resolucao", "inicio_vigencia")}
+        fatura_cativa = calcular_fatura_cativa(quantidade, tarifa, impostos_bandeira)["Fatura Cativa s Compensação"]
+        fatura_uso = calcular_fatura_uso(quantidade, tarifa, impostos_bandeira)["Fatura de Uso"]
+        fatura_livre = calcular_fatura_livre(quantidade, preco, impostos_bandeira, fatura_uso, fatura_cativa)["Fatura Livre"][0]
+
+    economia_mensal = fatura_cativa - fatura_uso - fatura_livre
+    ranking = pd.DataFrame({
+        "Resolução": tariffs["resolucao"],
+        "Início Vigência": pd.to_datetime(tariffs["inicio_vigencia"]).dt.date,
+        "Fatura Cativa": fatura_cativa,
+        "Fatura de Uso": fatura_uso,
+        "Fatura Livre": fatura_livre,
+        "Economia Mensal": economia_mensal,
+        "Economia (%)": (economia_mensal / fatura_cativa.where(fatura_cativa != 0)) * 100,
+    }, index=tariffs.index)
+    ranking = ranking.sort_values("Economia Mensal", ascending=False, na_position="last")
+    ranking.index.name = "Distribuidora"
+    return ranking.reset_index()
+
+
+def compare_inputs(inputs: dict, db_path: str = DB_PATH, as_of: Optional[date] = None) -> pd.DataFrame:
+    """
+    `compare_distribuidoras` for proposal inputs (the keyword arguments of `generate_proposal`).
+
+    The inputs' own `distribuidora` and `resolucao` are ignored; every distribuidora's
+    latest resolution for the inputs' subgroup and modality is priced instead.
+    """
+    years = inputs["years"]
+    preco = {
+        "preco": [inputs["yearly_data"][year]["Preço"] for year in years],
+        "produto": inputs["produto"],
+        "anos": years,
+        "duracao_meses": inputs["duracao_meses"],
+        "desconto": inputs.get("desconto", 0.0) / 100,
+    }
+    impostos_bandeira = prepare_impostos_bandeira(
+        inputs["icms"], inputs["paseb"], inputs["cofins"], inputs.get("bandeira", "Verde"),
+        inputs.get("icms_hr", 0.0), inputs.get("desc_irrig", 0.0),
+    )
+    return compare_distribuidoras(prepare_quantidade(inputs["grid_data"]), preco, impostos_bandeira,
+                                  inputs["subgrupo"], inputs["modalidade"], db_path, as_of)
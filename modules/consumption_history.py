@@ -0,0 +1,363 @@
+"""
+Consumption history per installation, imported from distribuidora invoice exports.
+
+`import_history` streams CSV or XLSX exports (any number of installations per
+file) into the `consumption_history` table, one row per `Instalação` and month.
+Headers are matched by name (see `COLUMN_ALIASES`), energy is normalised to kWh
+and demand to kW, and invalid rows are reported instead of aborting the import.
+`load_history` is what the proposal engine and the history chart read.
+"""
+
+import csv
+import io
+import itertools
+import logging
+import re
+import sqlite3
+import unicodedata
+from datetime import datetime
+from typing import Iterator, Optional
+
+import pandas as pd
+
+from modules.data_utils import DB_PATH, connect_db
+
+logger = logging.getLogger("Proposal_Generator")
+
+TABLE = "consumption_history"
+
+# Stored measures and the UI/grid column each one corresponds to
+MEASURES = {
+    "demanda_ponta": "Demanda Ponta",
+    "demanda_fora_ponta": "Demanda Fora Ponta",
+    "demanda_hr": "Demanda Horário Reservado",
+    "energia_ponta": "Energia Ponta",
+    "energia_fora_ponta": "Energia Fora Ponta",
+    "energia_hr": "Energia Horário Reservado",
+}
+
+# Normalised header (see `_normalize_header`) -> field
+COLUMN_ALIASES = {
+    "instalacao": "instalacao", "n instalacao": "instalacao", "numero instalacao": "instalacao",
+    "instalacao numero": "instalacao", "uc": "instalacao", "unidade consumidora": "instalacao",
+    "mes": "mes", "mes ano": "mes", "month year": "mes", "mes referencia": "mes", "referencia": "mes",
+    "mes de referencia": "mes", "competencia": "mes", "data leitura": "mes", "periodo": "mes",
+    "demanda ponta": "demanda_ponta", "demanda hp": "demanda_ponta", "demanda medida ponta": "demanda_ponta",
+    "demanda fora ponta": "demanda_fora_ponta", "demanda hfp": "demanda_fora_ponta",
+    "demanda medida fora ponta": "demanda_fora_ponta",
+    "demanda horario reservado": "demanda_hr", "demanda hr": "demanda_hr",
+    "energia ponta": "energia_ponta", "consumo ponta": "energia_ponta", "energia ativa ponta": "energia_ponta",
+    "energia hp": "energia_ponta", "consumo hp": "energia_ponta",
+    "energia fora ponta": "energia_fora_ponta", "consumo fora ponta": "energia_fora_ponta",
+    "energia ativa fora ponta": "energia_fora_ponta", "energia hfp": "energia_fora_ponta",
+    "consumo hfp": "energia_fora_ponta",
+    "energia horario reservado": "energia_hr", "consumo horario reservado": "energia_hr",
+    "energia ativa horario reservado": "energia_hr", "energia hr": "energia_hr", "consumo hr": "energia_hr",
+}
+
+# Unit given in a header, e.g. "Consumo Ponta (MWh)" -> factor to kWh / kW
+_UNIT_FACTORS = {"kwh": 1.0, "mwh": 1000.0, "wh": 0.001, "kw": 1.0, "mw": 1000.0, "w": 0.001}
+_UNIT_PATTERN = re.compile(r"\s*[\(\[]\s*(k?m?wh?)\s*[\)\]]\s*$", re.I)
+
+_THOUSANDS_PATTERN = re.compile(r"[-+]?[1-9]\d{0,2}(\.\d{3})+")
+
+_MONTHS_PT = {"jan": 1, "fev": 2, "mar": 3, "abr": 4, "mai": 5, "jun": 6,
+              "jul": 7, "ago": 8, "set": 9, "out": 10, "nov": 11, "dez": 12}
+
+BATCH_SIZE = 500
+MAX_REPORTED_ERRORS = 20
+
+
+def _strip_accents(text: str) -> str:
+    return "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+
+
+def _normalize_header(header: str) -> tuple:
+    """Split a header into its normalised name and unit factor, e.g. "Consumo Ponta (MWh)" -> ("consumo ponta", 1000.0)."""
+    header = str(header or "").strip()
+    factor = 1.0
+    unit = _UNIT_PATTERN.search(header)
+    if unit:
+        factor = _UNIT_FACTORS.get(unit.group(1).lower(), 1.0)
+        header = header[:unit.start()]
+    name = re.sub(r"[^a-z0-9]+", " ", _strip_accents(header).lower()).strip()
+    name = re.sub(r"^(n|no|num) (?=instalacao)", "n ", name)
+    return name, factor
+
+
+def _parse_number(value) -> Optional[float]:
+    """
+    Parse "1.234,56", "1234.56", "150.000" or a number; blank means 0.
+
+    Without a decimal comma, dots each followed by exactly three digits are
+    thousands separators ("1.234.567" is 1234567), otherwise the dot is decimal.
+    """
+    if value is None:
+        return 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace(" ", "")
+    if not text or text == "-":
+        return 0.0
+    if "," in text:
+        text = text.replace(".", "").replace(",", ".")
+    elif _THOUSANDS_PATTERN.fullmatch(text):
+        text = text.replace(".", "")
+    try:
+        return float(text)
+    except ValueError:
+        return None
+
+
+def _parse_month(value) -> Optional[str]:
+    """Parse a reference month ("03/2024", "2024-03", "mar/24", a date...) into "YYYY-MM"."""
+    if isinstance(value, datetime):
+        return f"{value.year:04d}-{value.month:02d}"
+    text = _strip_accents(str(value or "")).strip().lower()
+    match = re.fullmatch(r"(\d{1,2})[/\-.](\d{2}|\d{4})", text)
+    if match:
+        month, year = int(match.group(1)), int(match.group(2))
+    else:
+        match = re.fullmatch(r"(\d{4})[/\-.](\d{1,2})(?:[/\-.]\d{1,2})?(?:[ t].*)?", text)
+        if match:
+            year, month = int(match.group(1)), int(match.group(2))
+        else:
+            match = re.fullmatch(r"\d{1,2}[/\-.](\d{1,2})[/\-.](\d{4})", text)
+            if match:
+                month, year = int(match.group(1)), int(match.group(2))
+            else:
+                match = re.fullmatch(r"([a-z]{3})[a-z]*[/\-. ]?(\d{2}|\d{4})", text)
+                if not match or match.group(1) not in _MONTHS_PT:
+                    return None
+                month, year = _MONTHS_PT[match.group(1)], int(match.group(2))
+    if year < 100:
+        year += 2000
+    if not 1 <= month <= 12:
+        return None
+    return f"{year:04d}-{month:02d}"
+
+
+def _csv_rows(stream) -> Iterator[list]:
+    """Yield the rows of a CSV export, sniffing `;` or `,` and decoding UTF-8 (with BOM) or Latin-1."""
+    if isinstance(stream, io.TextIOBase):
+        text = stream
+    else:
+        raw = stream if hasattr(stream, "peek") else io.BufferedReader(stream)
+        head = raw.peek(4096)[:4096]
+        try:
+            head.decode("utf-8")
+            encoding = "utf-8-sig"
+        except UnicodeDecodeError:
+            encoding = "latin-1"
+        text = io.TextIOWrapper(raw, encoding=encoding, newline="")
+    # Sniff the delimiter on the first lines, then keep reading the file line by line
+    head = list(itertools.islice(text, 20))
+    try:
+        dialect = csv.Sniffer().sniff("".join(head), delimiters=";,\t")
+    except csv.Error:
+        dialect = csv.excel
+    yield from csv.reader(itertools.chain(head, text), dialect)
+
+
+def _xlsx_rows(stream) -> Iterator[list]:
+    """Yield the rows of the first sheet of an XLSX export, in read-only (streaming) mode."""
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise ImportError("Importing .xlsx files requires openpyxl") from e
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+def _records(rows: Iterator[list], report: dict) -> Iterator[tuple]:
+    """Map raw rows to `(instalacao, mes, *MEASURES)` tuples, counting and recording rejected rows."""
+    columns = None
+    for line, row in enumerate(rows, start=1):
+        if columns is None:
+            columns = {}
+            for i, header in enumerate(row):
+                name, factor = _normalize_header(header)
+                field = COLUMN_ALIASES.get(name)
+                if field and field not in columns:
+                    columns[field] = (i, factor)
+            missing = [field for field in ("instalacao", "mes") if field not in columns]
+            if missing:
+                raise ValueError(f"Header has no column for {', '.join(missing)}: {row}")
+            if not any(field in columns for field in MEASURES):
+                raise ValueError(f"Header has no demand or energy column: {row}")
+            continue
+        if not any(cell not in (None, "") for cell in row):
+            continue
+
+        report["rows_read"] += 1
+        cell = lambda field: row[columns[field][0]] if columns[field][0] < len(row) else None
+        instalacao = str(cell("instalacao") or "").strip()
+        if instalacao.endswith(".0"):
+            instalacao = instalacao[:-2]  # Numeric installation ids read from Excel
+        mes = _parse_month(cell("mes"))
+        values = []
+        error = None
+        if not instalacao:
+            error = "no installation"
+        elif mes is None:
+            error = f"invalid month {cell('mes')!r}"
+        else:
+            for field in MEASURES:
+                if field not in columns:
+                    values.append(0.0)
+                    continue
+                value = _parse_number(cell(field))
+                if value is None or value < 0:
+                    error = f"invalid {MEASURES[field]} {cell(field)!r}"
+                    break
+                values.append(value * columns[field][1])
+        if error:
+            report["rows_rejected"] += 1
+            if len(report["errors"]) < MAX_REPORTED_ERRORS:
+                report["errors"].append(f"line {line}: {error}")
+            continue
+        yield (instalacao, mes, *values)
+
+
+def _ensure_table(conn: sqlite3.Connection) -> None:
+    columns = ", ".join(f"{field} REAL NOT NULL DEFAULT 0" for field in MEASURES)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLE} (
+            instalacao TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            {columns},
+            source TEXT,
+            imported_at TEXT,
+            PRIMARY KEY (instalacao, mes)
+        )
+    """)
+
+
+def _write(conn: sqlite3.Connection, records, source: str) -> int:
+    """Upsert `records` in batches of `BATCH_SIZE`. Returns the number of rows written."""
+    fields = ("instalacao", "mes", *MEASURES, "source", "imported_at")
+    statement = (f"INSERT OR REPLACE INTO {TABLE} ({', '.join(fields)}) "
+                 f"VALUES ({', '.join('?' * len(fields))})")
+    imported_at = datetime.now().isoformat(timespec="seconds")
+    written = 0
+    batch = []
+    for record in records:
+        batch.append((*record, source, imported_at))
+        if len(batch) >= BATCH_SIZE:
+            conn.executemany(statement, batch)
+            written += len(batch)
+            batch = []
+    if batch:
+        conn.executemany(statement, batch)
+        written += len(batch)
+    return written
+
+
+def import_history(stream, filename: str, db_path: str = DB_PATH) -> dict:
+    """
+    Import an invoice export into the `consumption_history` table.
+
+    The file is read row by row and written in batches inside one transaction;
+    a month imported again for the same installation replaces the old values.
+
+    Args:
+        stream: Binary file object (e.g. `open(path, "rb")` or a Streamlit upload).
+        filename (str): Name of the file; `.xlsx` selects the Excel reader, anything else is CSV.
+        db_path (str): Path to the SQLite database.
+
+    Returns:
+        dict: {"rows_read", "rows_imported", "rows_rejected", "installations", "errors"}
+
+    Raises:
+        ValueError: If the header lacks the installation, month or every measure column.
+    """
+    report = {"rows_read": 0, "rows_imported": 0, "rows_rejected": 0, "installations": 0, "errors": []}
+    rows = _xlsx_rows(stream) if filename.lower().endswith((".xlsx", ".xlsm")) else _csv_rows(stream)
+    installations = set()
+
+    def tracked(records):
+        for record in records:
+            installations.add(record[0])
+            yield record
+
+    conn = connect_db(db_path)
+    try:
+        with conn:
+            _ensure_table(conn)
+            report["rows_imported"] = _write(conn, tracked(_records(rows, report)), filename)
+    finally:
+        conn.close()
+    report["installations"] = len(installations)
+    logger.info(f"Imported {report['rows_imported']} months for {report['installations']} installations from "
+                f"'{filename}' ({report['rows_rejected']} rows rejected)")
+    return report
+
+
+def store_history(instalacao: str, history: pd.DataFrame, db_path: str = DB_PATH) -> int:
+    """
+    Store a history edited by hand (columns as in `MEASURES`, plus "Month/Year") for one installation.
+
+    Returns:
+        int: Number of months stored; rows without a valid month are skipped.
+    """
+    records = []
+    for _, row in history.iterrows():
+        mes = _parse_month(row.get("Month/Year"))
+        if mes is None:
+            continue
+        values = [_parse_number(row.get(column)) or 0.0 for column in MEASURES.values()]
+        records.append((str(instalacao), mes, *values))
+    conn = connect_db(db_path)
+    try:
+        with conn:
+            _ensure_table(conn)
+            return _write(conn, records, "manual")
+    finally:
+        conn.close()
+
+
+def load_history(instalacao: str, db_path: str = DB_PATH, months: Optional[int] = None) -> pd.DataFrame:
+    """
+    Read an installation's consumption history, oldest month first.
+
+    Args:
+        instalacao (str): Installation number.
+        db_path (str): Path to the SQLite database.
+        months (int, optional): Only the most recent `months` months.
+
+    Returns:
+        pd.DataFrame: Columns "Month/Year" ("MM/YYYY") and the `MEASURES` display names;
+        empty if nothing was imported for the installation.
+    """
+    conn = connect_db(db_path)
+    try:
+        _ensure_table(conn)
+        query = f"SELECT mes, {', '.join(MEASURES)} FROM {TABLE} WHERE instalacao = ? ORDER BY mes DESC"
+        params = [str(instalacao)]
+        if months:
+            query += " LIMIT ?"
+            params.append(months)
+        df = pd.read_sql_query(query, conn, params=params)
+    finally:
+        conn.close()
+    df = df.iloc[::-1].reset_index(drop=True)
+    df.insert(0, "Month/Year", df.pop("mes").map(lambda mes: f"{mes[5:7]}/{mes[:4]}"))
+    return df.rename(columns=MEASURES)
+
+
+def history_grid_data(row) -> dict:
+    """`grid_data` (as built by the UI) for one month of `load_history`."""
+    return {
+        "Demanda - Ponta": row["Demanda Ponta"],
+        "Demanda - Fora Ponta": row["Demanda Fora Ponta"],
+        "Demanda - Horário Reservado": row["Demanda Horário Reservado"],
+        "Demanda s/ ICMS - Ponta": 0.0,
+        "Demanda s/ ICMS - Fora Ponta": 0.0,
+        "Energia Ativa - Ponta": row["Energia Ponta"],
+        "Energia Ativa - Fora Ponta": row["Energia Fora Ponta"],
+        "Energia Ativa - Horário Reservado": row["Energia Horário Reservado"],
+    }
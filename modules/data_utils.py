@@ -1,116 +1,160 @@
 import pandas as pd
-import requests
 import os
 from datetime import datetime, date
-import threading
-import tempfile
-import shutil
-from io import StringIO
 import sqlite3
-import streamlit as st
 import logging
 import logging.handlers
 from pathlib import Path
 from typing import Optional
+from urllib.request import pathname2url
+from modules.memoize import memoize
+from modules.async_logging import JsonFormatter, attach_queue
 
-update_event = threading.Event()  # Initially unset (False)
+# The app's SQLite database; relative, like `Proposta PPT/` and `images/`, to the
+# directory the app runs from (`proposal --workdir`)
+DB_PATH = "DataBase.db"
 
-def fetch_and_update_tarifas_background() -> None:
+
+def connect_db(db_path: str = DB_PATH, **kwargs) -> sqlite3.Connection:
     """
-    Fetches and updates electricity tariff data from the ANEEL API and stores it in a local SQLite database.
-    This function performs the following steps:
-    1. Checks the last update date stored in the SQLite database.
-    2. If the data is outdated or missing, fetches the latest tariff data from the ANEEL API.
-    3. Preprocesses the fetched data and updates the local SQLite database.
-    4. Updates the last update date in the database.
-    Logging:
-        - Logs the start and completion of the update process.
-        - Logs errors encountered during the update process.
-    Database:
-        - Creates a table `last_updated_date` if it does not exist.
-        - Updates the `ANEEL_DB` table with the latest tariff data.
-        - Updates the `last_updated_date` table with the current date.
-    Exceptions:
-        - Logs and raises exceptions encountered during the data fetching or database update process.
-    Notes:
-        - The function uses a thread-safe event (`update_event`) to signal the completion of the update process.
-        - The fetched data is expected to be in CSV format and encoded in "windows-1252".
+    Open an existing SQLite database.
+
+    `sqlite3.connect` creates an empty database for a missing path, which would turn
+    running from the wrong directory into silently missing data; this raises instead.
+    Only the tariff update (`write_tarifas`) creates the database.
+
+    Args:
+        db_path (str): Path to the SQLite database.
+        **kwargs: Passed on to `sqlite3.connect` (e.g. `timeout`).
+
     Raises:
-        Exception: If there is an error during data fetching or database operations.
-    Returns:
-        None
+        sqlite3.OperationalError: If `db_path` does not exist.
     """
+    uri = "file:" + pathname2url(os.path.abspath(db_path)) + "?mode=rw"
+    try:
+        return sqlite3.connect(uri, uri=True, **kwargs)
+    except sqlite3.OperationalError as e:
+        raise sqlite3.OperationalError(f"Cannot open database '{db_path}': {e}") from e
 
 
-    logger = logging.getLogger("Proposal_Generator")
+def read_last_updated(db_path: str = DB_PATH) -> Optional[date]:
+    """
+    Read the date of the last successful tariff update.
 
-    logger.info("Thread started...")
-    
-    # Define file paths
-    #tarifas_csv = r"DBases/tarifas.csv"
-    tarifas_parquet = r"DBases/tarifas.parquet"
-    last_updated_file = r"DBases/last_updated.txt"
-    db_path = r"DataBase.db"
-
-    # Check if last updated date exists
-    last_updated = None
+    Args:
+        db_path (str): Path to the SQLite database.
+
+    Returns:
+        date: The last update date, or None if the tariffs were never updated.
+    """
     conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    cursor.execute("""
-                    CREATE TABLE IF NOT EXISTS last_updated_date (
-                    key TEXT PRIMARY KEY,
-                    value TEXT
+    try:
+        cursor = conn.cursor()
+        cursor.execute("""
+                        CREATE TABLE IF NOT EXISTS last_updated_date (
+                        key TEXT PRIMARY KEY,
+                        value TEXT
+                        )
+                       """
                     )
-                   """
-                )    
+        cursor.execute("SELECT value FROM last_updated_date WHERE key = 'last_updated'")
+        result = cursor.fetchone()
+    finally:
+        conn.close()
 
-    # Check for the last update date
-    cursor.execute("SELECT value FROM last_updated_date WHERE key = 'last_updated'")
-    result = cursor.fetchone()
     if result:
-        last_updated = datetime.strptime(result[0], "%d-%m-%Y").date()
-        logger.info(f"Last updated date found: {last_updated}")
-    conn.close()
-
-    # Update only if last_updated is None or older than today
-    if last_updated is None or last_updated < date.today():
-        try:
-            # Fetch the CSV from the ANEEL API
-            url = "https://dadosabertos.aneel.gov.br/dataset/5a583f3e-1646-4f67-bf0f-69db4203e89e/resource/fcf2906c-7c32-4b9b-a637-054e7a5234f4/download/tarifas-homologadas-distribuidoras-energia-eletrica.csv"
-            response = requests.get(url, stream=True)
-            response.raise_for_status()
-            df_tarifas = pd.read_csv(StringIO(response.content.decode("windows-1252")), delimiter=";")
-            df_tarifas = preprocess_tarifas(df_tarifas)
-
-            # Connect to the database and update the ANEEL_DB table
-            conn = sqlite3.connect(db_path)
-            try:
-                # Replace the existing data in ANEEL_DB (drop and recreate for simplicity)
-                df_tarifas.to_sql('ANEEL_DB', conn, if_exists='replace', index=False)
-            except Exception as e:
-                logger.error(f"Database write failed: {e}")
-                raise  # Re-raise to trigger cleanup in the except block
-            finally:
-                conn.close()
-
-            # Update the last_updated value in the metadata table
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT OR REPLACE INTO last_updated_date (key, value)
-                VALUES ('last_updated', ?)
-            """, (date.today().strftime("%d-%m-%Y"),))
-            conn.commit()
-            conn.close()
-
-        except Exception as e:
-            logger.error(f"Update failed: {e}")
-            update_event.set()  # Still signal completion on failure
-            return
-
-        update_event.set()  # Signal completion
-        logger.info("Thread finished, UPDATE_COMPLETE set to True")
-    logger.info("Update ran")
+        return datetime.strptime(result[0], "%d-%m-%Y").date()
+    return None
+
+def write_last_updated(db_path: str, updated: date) -> None:
+    """Store `updated` as the date of the last successful tariff update."""
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("""
+            INSERT OR REPLACE INTO last_updated_date (key, value)
+            VALUES ('last_updated', ?)
+        """, (updated.strftime("%d-%m-%Y"),))
+        conn.commit()
+    finally:
+        conn.close()
+
+# SQLite column types used when bulk loading tariffs (mirrors what `to_sql` produced)
+_SQLITE_TYPES = {
+    "datetime64[ns]": "TIMESTAMP",
+    "Int64": "INTEGER",
+    "int64": "INTEGER",
+    "float64": "REAL",
+}
+
+# Indexes built on the staging table before it is swapped in
+_ANEEL_DB_INDEXES = {
+    "lookup": ("SigAgente", "DscSubGrupo", "DscModalidadeTarifaria", "DscREH"),
+    "reh": ("SigAgente", "DscREH"),
+}
+
+def _to_sql_rows(df: pd.DataFrame) -> list:
+    """Convert a DataFrame into a list of tuples sqlite3 can bind, column by column."""
+    columns = []
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_datetime64_any_dtype(column):
+            column = column.dt.strftime("%Y-%m-%d %H:%M:%S")
+        columns.append(column.astype(object).where(column.notna(), None).tolist())
+    return list(zip(*columns))
+
+def write_tarifas(df_tarifas: pd.DataFrame, db_path: str = DB_PATH, table: str = "ANEEL_DB") -> None:
+    """
+    Replace the tariff table atomically through a shadow (staging) table.
+
+    The rows are bulk loaded into a staging table in a single transaction with
+    `executemany`, the lookup indexes are built there, and only then the staging
+    table is renamed over `table` in one short transaction. The database runs in
+    WAL mode, so readers keep seeing the previous table until the swap commits
+    and never observe a missing or half-filled table.
+
+    Args:
+        df_tarifas (pd.DataFrame): Output of `preprocess_tarifas`.
+        db_path (str): Path to the SQLite database.
+        table (str): Name of the table to replace.
+    """
+    logger = logging.getLogger("Proposal_Generator")
+    staging = f"{table}_staging"
+    # Index names are global in SQLite, so each load gets its own suffix; the old ones go with the old table
+    suffix = datetime.now().strftime("%Y%m%d%H%M%S%f")
+
+    columns = list(df_tarifas.columns)
+    column_defs = ", ".join(f'"{c}" {_SQLITE_TYPES.get(str(df_tarifas[c].dtype), "TEXT")}' for c in columns)
+    placeholders = ", ".join("?" for _ in columns)
+    rows = _to_sql_rows(df_tarifas)
+
+    conn = sqlite3.connect(db_path, isolation_level=None)
+    try:
+        conn.execute("PRAGMA journal_mode=WAL")
+
+        # Bulk load the staging table
+        conn.execute("BEGIN")
+        conn.execute(f'DROP TABLE IF EXISTS "{staging}"')
+        conn.execute(f'CREATE TABLE "{staging}" ({column_defs})')
+        conn.executemany(f'INSERT INTO "{staging}" VALUES ({placeholders})', rows)
+        for name, index_columns in _ANEEL_DB_INDEXES.items():
+            if set(index_columns) <= set(columns):
+                cols = ", ".join(f'"{c}"' for c in index_columns)
+                conn.execute(f'CREATE INDEX "idx_{table}_{name}_{suffix}" ON "{staging}" ({cols})')
+        conn.execute("COMMIT")
+
+        # Swap the staging table in
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(f'DROP TABLE IF EXISTS "{table}"')
+        conn.execute(f'ALTER TABLE "{staging}" RENAME TO "{table}"')
+        conn.execute("COMMIT")
+        logger.info(f"{table} replaced with {len(df_tarifas)} rows")
+    except Exception as e:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        logger.error(f"Database write failed: {e}")
+        raise
+    finally:
+        conn.close()
 
 def preprocess_tarifas(df: pd.DataFrame) -> pd.DataFrame:
     """
@@ -184,7 +228,7 @@ def preprocess_tarifas(df: pd.DataFrame) -> pd.DataFrame:
     
     return df
 
-def get_tariffs(distribuidora, subgrupo, modalidade, resolucao):
+def get_tariffs(distribuidora, subgrupo, modalidade, resolucao, db_path=DB_PATH):
     """
     Get the tariffs for a given combination of filters.
     
@@ -193,16 +237,17 @@ def get_tariffs(distribuidora, subgrupo, modalidade, resolucao):
         subgrupo (str): The subgroup filter.
         modalidade (str): The tariff modality filter.
         resolucao (str): The resolution filter.
+        db_path (str): Path to the SQLite database (or a dataset snapshot, see `modules.snapshots`).
     
     Returns:
         dict: A dictionary containing the computed tariff components.
     """
     # Filter the data based on the provided criteria
 
-    conn = sqlite3.connect("DataBase.db")
-    query = f"SELECT * FROM ANEEL_DB WHERE SigAgente = '{distribuidora}' AND DscSubGrupo = '{subgrupo}' AND DscModalidadeTarifaria = '{modalidade}' AND DscREH = '{resolucao}'"
+    conn = sqlite3.connect(db_path)
+    query = "SELECT * FROM ANEEL_DB WHERE SigAgente = ? AND DscSubGrupo = ? AND DscModalidadeTarifaria = ? AND DscREH = ?"
     try:
-        filtered_df = pd.read_sql_query(query, conn)
+        filtered_df = pd.read_sql_query(query, conn, params=(distribuidora, subgrupo, modalidade, resolucao))
     finally: conn.close()
 
     # Initialize the tariffs dictionary with default values
@@ -288,7 +333,7 @@ def get_flags():
         conn.close()
     return flags
     """
-    conn = sqlite3.connect("DataBase.db")
+    conn = sqlite3.connect(DB_PATH)
     query = f"SELECT * FROM tariff_flags"
     try:
         flags = pd.read_sql_query(query, conn).to_dict(orient='records')[0]
@@ -296,7 +341,7 @@ def get_flags():
         conn.close()
     return flags
 
-@st.cache_data
+@memoize()
 def load_tarifas(db_path):
     """Load tariffs from the database."""
     conn = sqlite3.connect(db_path)
@@ -307,7 +352,7 @@ def load_tarifas(db_path):
         conn.close()
         return None  # Return None if table doesn't exist or is empty
     
-@st.cache_data
+@memoize()
 def fetch_distribuidoras(db_path, update_event_status):
     """Fetch list of distribuidoras from the database."""
     conn = sqlite3.connect(db_path)
@@ -317,7 +362,7 @@ def fetch_distribuidoras(db_path, update_event_status):
     finally:
         conn.close()
 
-@st.cache_data
+@memoize()
 def fetch_res_hom(db_path, distribuidora, update_event_status):
     """Fetch resolution homologatoria options for a given distribuidora."""
     conn = sqlite3.connect(db_path)
@@ -328,7 +373,7 @@ def fetch_res_hom(db_path, distribuidora, update_event_status):
     finally:
         conn.close()
 
-@st.cache_data
+@memoize()
 def fetch_contatos_agentes(db_path):
     """Fetch agent contacts from the database."""
     conn = sqlite3.connect(db_path)
@@ -339,8 +384,8 @@ def fetch_contatos_agentes(db_path):
     finally:
         conn.close()
 
-@st.cache_data
-def fetch_agent_contact_info(agente: str, db_path:str ="DataBase.db") -> Optional[dict]:
+@memoize()
+def fetch_agent_contact_info(agente: str, db_path:str =DB_PATH) -> Optional[dict]:
     """
     Fetch the email and phone number of an agent from the database.
 
@@ -384,11 +429,16 @@ def setup_logger(
     log_file: str = "Proposal_generator.log",
     level: int = logging.INFO,
     max_bytes: int = 5 * 1024 * 1024,
-    backup_count: int = 5
+    backup_count: int = 5,
+    rate: float = 10.0,
+    burst: int = 50
     ) -> logging.Logger:
     """
     Configure a logger with file and console handlers, using UTF-8 encoding for files.
 
+    The handlers are written to from a background thread (see `modules.async_logging`):
+    the file gets one JSON object per record, the console warnings and above as text.
+
     Args:
         name (str): Logger name (default: "DataPipeline").
         log_dir (str): Directory for log files (default: "logs").
@@ -396,6 +446,8 @@ def setup_logger(
         level (int): Logging level (default: logging.INFO).
         max_bytes (int): Max size per log file before rotation (default: 5MB).
         backup_count (int): Number of backup log files (default: 5).
+        rate (float): Records below WARNING allowed per second from one call site; 0 logs all of them.
+        burst (int): Records below WARNING allowed at once from one call site.
 
     Returns:
         logging.Logger: Configured logger instance.
@@ -420,16 +472,15 @@ def setup_logger(
         encoding="utf-8"  # Ensure UTF-8 for special characters
     )
     file_handler.setLevel(level)
-    file_handler.setFormatter(formatter)
+    file_handler.setFormatter(JsonFormatter())
 
     # Console handler for warnings and above
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.WARNING)
     console_handler.setFormatter(formatter)
 
-    # Add handlers to logger
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    # Hand the handlers to the queue listener thread
+    attach_queue(logger, [file_handler, console_handler], rate=rate, burst=burst)
     logger.setLevel(level)
 
     return logger
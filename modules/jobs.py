@@ -0,0 +1,163 @@
+import uuid
+import time
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+logger = logging.getLogger("Proposal_Generator")
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+
+class JobCancelled(Exception):
+    """Raised inside a job when its cancellation was requested."""
+
+
+class JobManager:
+    """
+    Process-wide executor for long-running proposal jobs.
+
+    Jobs run off the Streamlit script thread; the UI keeps only the job id and
+    polls `get()`. Submitting a job with the `key` of a job that is still queued
+    or running returns the existing id, so reruns of the script do not redo work.
+
+    The submitted function receives a `progress(stage, fraction)` keyword
+    argument. Calling it updates the job status and raises `JobCancelled` once
+    `cancel()` was requested, which is how running jobs stop early.
+
+    Args:
+        max_workers (int): Concurrent jobs. Defaults to 1 because matplotlib's pyplot
+            state and the shared chart/page output files are not safe to use from
+            several threads at once.
+        max_finished (int): Finished jobs kept for polling before the oldest are dropped.
+        result_ttl (float, optional): Seconds a finished job keeps its `result` (e.g. the PDF
+            bytes); afterwards the result is dropped and `result_expired` is set. None keeps it.
+    """
+
+    def __init__(self, max_workers: int = 1, max_finished: int = 200, result_ttl: Optional[float] = 1800.0):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="proposal-job")
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._max_finished = max_finished
+        self._result_ttl = result_ttl
+
+    def submit(self, func: Callable, *args, key: Optional[str] = None, **kwargs) -> str:
+        """
+        Queue `func(*args, progress=..., **kwargs)` and return the job id.
+
+        Args:
+            func (Callable): The job function.
+            key (str, optional): Deduplication key, e.g. a hash of the job inputs.
+        """
+        with self._lock:
+            if key is not None:
+                for job_id, job in self._jobs.items():
+                    if job["key"] == key and job["state"] in ACTIVE_STATES:
+                        return job_id
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                "id": job_id,
+                "key": key,
+                "state": QUEUED,
+                "stage": "Na fila",
+                "progress": 0.0,
+                "result": None,
+                "result_expired": False,
+                "error": None,
+                "submitted_at": time.time(),
+                "finished_at": None,
+                "cancel_event": threading.Event(),
+            }
+            self._prune()
+
+        self._executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Return a snapshot of the job, or None if the id is unknown (or was pruned)."""
+        with self._lock:
+            self._expire_results()
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            return {k: v for k, v in job.items() if k != "cancel_event"}
+
+    def cancel(self, job_id: str) -> None:
+        """Request cancellation. Queued jobs never start; running jobs stop at their next progress call."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["state"] not in ACTIVE_STATES:
+                return
+            job["cancel_event"].set()
+            if job["state"] == QUEUED:
+                job.update(state=CANCELLED, stage="Cancelado", finished_at=time.time())
+
+    def _update(self, job_id: str, **values) -> None:
+        with self._lock:
+            self._jobs[job_id].update(values)
+
+    def _run(self, job_id: str, func: Callable, args: tuple, kwargs: dict) -> None:
+        with self._lock:
+            job = self._jobs[job_id]
+            if job["state"] == CANCELLED:
+                return
+            cancel_event = job["cancel_event"]
+            job["state"] = RUNNING
+
+        def progress(stage: str, fraction: float) -> None:
+            if cancel_event.is_set():
+                raise JobCancelled(stage)
+            self._update(job_id, stage=stage, progress=max(0.0, min(1.0, fraction)))
+
+        try:
+            result = func(*args, progress=progress, **kwargs)
+            self._update(job_id, state=DONE, stage="Concluído", progress=1.0, result=result, finished_at=time.time())
+        except JobCancelled:
+            logger.info(f"Job {job_id} cancelled")
+            self._update(job_id, state=CANCELLED, stage="Cancelado", finished_at=time.time())
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            self._update(job_id, state=FAILED, stage="Erro", error=str(e), finished_at=time.time())
+
+    def _expire_results(self) -> None:
+        # Caller must hold self._lock
+        if self._result_ttl is None:
+            return
+        cutoff = time.time() - self._result_ttl
+        for job in self._jobs.values():
+            if job["result"] is not None and job["finished_at"] is not None and job["finished_at"] < cutoff:
+                job.update(result=None, result_expired=True)
+
+    def _prune(self) -> None:
+        # Caller must hold self._lock
+        self._expire_results()
+        finished = [job_id for job_id, job in self._jobs.items() if job["state"] not in ACTIVE_STATES]
+        for job_id in finished[:max(0, len(finished) - self._max_finished)]:
+            del self._jobs[job_id]
+
+
+_manager: Optional[JobManager] = None
+_manager_lock = threading.Lock()
+
+
+def get_job_manager(**kwargs) -> JobManager:
+    """
+    Return the process-wide job manager, creating it on first use.
+
+    Keyword arguments are only applied when the manager is created.
+    """
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = JobManager(**kwargs)
+        return _manager
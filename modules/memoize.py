@@ -0,0 +1,285 @@
+import copy
+import hashlib
+import inspect
+import json
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+from datetime import date, datetime
+from functools import wraps
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger("Proposal_Generator")
+
+_registry = {}
+_registry_lock = threading.Lock()
+
+
+def _canonical(value):
+    """Convert `value` into plain JSON types so equal inputs always serialise identically."""
+    if isinstance(value, dict):
+        return {str(k): _canonical(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_canonical(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted((_canonical(v) for v in value), key=repr)
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, bool) or value is None or isinstance(value, str):
+        return value
+    if isinstance(value, (int, float)):
+        # 100 and 100.0 are the same quantity; -0.0 and 0.0 the same price
+        value = float(value)
+        return int(value) if value.is_integer() else value
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return {"pandas": hashlib.sha256(pd.util.hash_pandas_object(value, index=True).values.tobytes()).hexdigest()}
+    if isinstance(value, np.ndarray):
+        return _canonical(value.tolist())
+    return repr(value)
+
+
+def canonical_key(*args, **kwargs) -> str:
+    """
+    Return a stable SHA-256 hex digest of the given values.
+
+    Dict key order, int/float spelling, NumPy scalars and tuple-vs-list do not
+    change the key, so inputs built differently by the UI, the CLI or a batch
+    job hit the same cache entry.
+    """
+    payload = json.dumps(_canonical([list(args), kwargs]), sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoCache:
+    """
+    Thread-safe LRU cache with a per-entry time to live and hit/miss counters.
+
+    Args:
+        name (str): Name reported in the metrics.
+        maxsize (int): Entries kept before the least recently used is evicted.
+        ttl (float, optional): Seconds an entry stays valid; None keeps entries until evicted.
+    """
+
+    def __init__(self, name: str, maxsize: int = 256, ttl: Optional[float] = 3600.0):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0}
+
+    def get(self, key: str):
+        """Return `(True, value)` for a live entry, `(False, None)` otherwise."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, stored_at = entry
+                if self.ttl is None or time.monotonic() - stored_at < self.ttl:
+                    self._entries.move_to_end(key)
+                    self._counters["hits"] += 1
+                    return True, value
+                del self._entries[key]
+                self._counters["expirations"] += 1
+            self._counters["misses"] += 1
+            return False, None
+
+    def put(self, key: str, value) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._counters, size=len(self._entries), maxsize=self.maxsize)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def _register(cache: MemoCache) -> MemoCache:
+    with _registry_lock:
+        _registry[cache.name] = cache
+    return cache
+
+
+def memoize(maxsize: int = 256, ttl: Optional[float] = 3600.0, name: Optional[str] = None):
+    """
+    Memoize a pure function on the canonical hash of its arguments.
+
+    Positional and keyword spellings of the same call share an entry (arguments
+    are bound to the signature with defaults applied). Callers receive a deep
+    copy, so mutating a result never alters the cached value. The undecorated
+    function stays reachable as `__wrapped__` and the cache as `.cache`.
+
+    Args:
+        maxsize (int): LRU size.
+        ttl (float, optional): Entry lifetime in seconds.
+        name (str, optional): Cache name in the metrics; defaults to the function name.
+    """
+    def decorator(func):
+        cache = _register(MemoCache(name or func.__name__, maxsize, ttl))
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = canonical_key(bound.arguments)
+            found, value = cache.get(key)
+            if not found:
+                value = func(*args, **kwargs)
+                cache.put(key, value)
+            return copy.deepcopy(value)
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def file_digest(path: str) -> Optional[str]:
+    """SHA-256 of a file's contents, recomputed only when its size or mtime changes."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    marker = (stat.st_mtime_ns, stat.st_size)
+    with _fingerprints_lock:
+        cached = _fingerprints.get(path)
+        if cached is not None and cached[0] == marker:
+            return cached[1]
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()
+    with _fingerprints_lock:
+        _fingerprints[path] = (marker, digest)
+    return digest
+
+
+def _stat_marker(path: str) -> Optional[tuple]:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def memoize_files(outputs: tuple, depends_on: tuple = (), daily: bool = False,
+                  maxsize: int = 128, ttl: Optional[float] = 3600.0, name: Optional[str] = None):
+    """
+    Memoize a function whose product is the files it writes.
+
+    On a miss the function runs and the bytes of its `outputs` are cached with its
+    return value; on a hit the cached bytes are written back to the same paths
+    instead of calling the function. The files are therefore always (re)written,
+    even when another session overwrote them since they were cached. A call that
+    leaves any output missing or untouched (same mtime and size as before it ran)
+    is treated as failed and not cached.
+
+    Entries in `outputs` and `depends_on` are argument names of the decorated
+    function (whose bound value is the path) or literal paths.
+
+    Args:
+        outputs (tuple): Files produced by the function.
+        depends_on (tuple): Files read by the function; their content hashes join the key.
+        daily (bool): Include today's date in the key, for artifacts that print a date.
+        maxsize (int): LRU size.
+        ttl (float, optional): Entry lifetime in seconds.
+        name (str, optional): Cache name in the metrics; defaults to the function name.
+    """
+    def decorator(func):
+        cache = _register(MemoCache(name or func.__name__, maxsize, ttl))
+        signature = inspect.signature(func)
+
+        def resolve(bound, entries):
+            return [str(bound.arguments[entry]) if entry in bound.arguments else entry for entry in entries]
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            output_paths = resolve(bound, outputs)
+            key = canonical_key(
+                bound.arguments,
+                depends_on={path: file_digest(path) for path in resolve(bound, depends_on)},
+                day=date.today() if daily else None,
+            )
+            found, entry = cache.get(key)
+            if found:
+                result, artifacts = entry
+                for path, data in artifacts.items():
+                    with open(path, "wb") as f:
+                        f.write(data)
+                return copy.deepcopy(result)
+
+            before = {path: _stat_marker(path) for path in output_paths}
+            result = func(*args, **kwargs)
+            artifacts = {}
+            for path in output_paths:
+                marker = _stat_marker(path)
+                if marker is None or marker == before[path]:
+                    # The function failed before (re)writing its output, and the file on disk
+                    # (if any) belongs to an earlier call; do not cache the failure
+                    logger.warning(f"{cache.name}: expected output '{path}' was not written, not caching")
+                    return result
+                with open(path, "rb") as f:
+                    artifacts[path] = f.read()
+            cache.put(key, (copy.deepcopy(result), artifacts))
+            return result
+
+        wrapper.cache = cache
+        return wrapper
+    return decorator
+
+
+def cache_stats() -> dict:
+    """
+    Return hit/miss counters for every registered cache.
+
+    Returns:
+        dict: {cache name: {"hits", "misses", "evictions", "expirations", "size", "maxsize", "hit_ratio"}}
+    """
+    with _registry_lock:
+        caches = list(_registry.values())
+    return {cache.name: cache.stats() for cache in caches}
+
+
+def clear_caches() -> None:
+    """Drop every cached entry, e.g. after the tariff tables were refreshed."""
+    with _registry_lock:
+        caches = list(_registry.values())
+    for cache in caches:
+        cache.clear()
+    logger.info("Memoization caches cleared")
+
+
+def render_prometheus() -> str:
+    """Render the cache counters in the Prometheus text exposition format."""
+    stats = cache_stats()
+    lines = []
+    for metric in ("hits", "misses", "evictions", "expirations"):
+        lines.append(f"# HELP proposal_cache_{metric}_total Memoization cache {metric}.")
+        lines.append(f"# TYPE proposal_cache_{metric}_total counter")
+        for name in sorted(stats):
+            lines.append(f'proposal_cache_{metric}_total{{cache="{name}"}} {stats[name][metric]}')
+    lines.append("# HELP proposal_cache_entries Entries currently held by a memoization cache.")
+    lines.append("# TYPE proposal_cache_entries gauge")
+    for name in sorted(stats):
+        lines.append(f'proposal_cache_entries{{cache="{name}"}} {stats[name]["size"]}')
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,163 @@
+import os
+import re
+import json
+import hashlib
+import logging
+import tempfile
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from io import BytesIO
+from typing import Optional
+
+logger = logging.getLogger("Proposal_Generator")
+
+
+def safe_filename(name: str) -> str:
+    """
+    Reduce `name` to a basename that is safe to use as a file or object name.
+
+    Client fields such as the razão social end up in the PDF filename; any run of
+    characters other than letters, digits, "_", "." and "-" (path separators included,
+    e.g. "S/A") becomes "_".
+    """
+    name = os.path.basename(re.sub(r"[^\w.-]+", "_", name))
+    return name.lstrip(".") or "_"
+
+
+class OutputSink(ABC):
+    """
+    Destination for a rendered proposal PDF.
+
+    `generate_pdf` writes the merged document straight into the stream returned
+    by `open()`; after the block exits, `filename`, `size` and `location`
+    describe what was written, and `missing_pages` lists the pages `generate_pdf`
+    had to leave out (a non-empty list means the PDF is incomplete).
+    """
+
+    def __init__(self):
+        self.filename: Optional[str] = None
+        self.size: int = 0
+        self.location: Optional[str] = None
+        self.missing_pages: list = []
+
+    @abstractmethod
+    def open(self, filename: str):
+        """Context manager yielding a writable binary stream for `filename`."""
+
+
+class MemorySink(OutputSink):
+    """Keep the PDF in memory, e.g. for `st.download_button` or an HTTP response."""
+
+    def __init__(self):
+        super().__init__()
+        self._buffer = BytesIO()
+
+    @contextmanager
+    def open(self, filename: str):
+        self.filename = filename
+        self.size = 0
+        self._buffer = BytesIO()
+        yield self._buffer
+        self.size = self._buffer.tell()
+        self.location = f"memory://{filename}"
+
+    def getvalue(self) -> bytes:
+        """Return the PDF bytes."""
+        return self._buffer.getvalue()
+
+
+class DirectorySink(OutputSink):
+    """
+    Write the PDF into a configurable directory.
+
+    The file is written under a temporary name and renamed when complete, so
+    readers never see a partial PDF.
+
+    Args:
+        directory (str): Target directory, created if missing.
+    """
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+
+    @contextmanager
+    def open(self, filename: str):
+        self.size = 0
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, filename)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield f
+                self.size = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self.filename = filename
+        self.location = path
+        logger.info(f"PDF saved as {path}")
+
+
+class LocalObjectStoreSink(OutputSink):
+    """
+    Local stand-in for an object store (S3/GCS-like bucket/key layout).
+
+    Objects are stored as `<root>/<bucket>/<prefix><filename>` with a
+    `.meta.json` sidecar holding the content type, size and SHA-256, mirroring
+    the metadata an object store would return.
+
+    Args:
+        root (str): Root directory standing in for the object store.
+        bucket (str): Bucket name.
+        prefix (str, optional): Key prefix, e.g. "propostas/2025/".
+    """
+
+    def __init__(self, root: str, bucket: str, prefix: str = ""):
+        super().__init__()
+        self.root = root
+        self.bucket = bucket
+        self.prefix = prefix
+        self.key: Optional[str] = None
+
+    @contextmanager
+    def open(self, filename: str):
+        self.size = 0
+        key = self.prefix + filename
+        path = os.path.join(self.root, self.bucket, *key.split("/"))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+        digest = hashlib.sha256()
+        try:
+            with os.fdopen(fd, "wb") as f:
+                yield _HashingWriter(f, digest)
+                self.size = f.tell()
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        with open(path + ".meta.json", "w", encoding="utf-8") as meta:
+            json.dump({"content_type": "application/pdf", "size": self.size, "sha256": digest.hexdigest()}, meta)
+        self.filename = filename
+        self.key = key
+        self.location = f"local://{self.bucket}/{key}"
+        logger.info(f"PDF stored as {self.location}")
+
+
+class _HashingWriter:
+    """File wrapper that hashes everything written through it."""
+
+    def __init__(self, f, digest):
+        self._f = f
+        self._digest = digest
+
+    def write(self, data) -> int:
+        self._digest.update(data)
+        return self._f.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
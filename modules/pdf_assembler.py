@@ -0,0 +1,71 @@
+import logging
+from typing import Optional
+
+from pypdf import PdfReader, PdfWriter
+
+from modules.pdf_optimizer import optimize_writer, size_report
+from modules.tracing import span
+
+logger = logging.getLogger("Proposal_Generator")
+
+
+class PdfAssembler:
+    """
+    Incremental PDF assembler on `pypdf`.
+
+    Each rendered page PDF is appended as soon as it exists: its pages are copied
+    into one `PdfWriter` and the source buffer is closed right away, so only the
+    assembled document stays in memory instead of every page's buffer plus a
+    merger's object graph.
+    """
+
+    def __init__(self):
+        self.writer = PdfWriter()
+        self.pages = 0
+        self.source_bytes = 0
+
+    def append(self, stream) -> int:
+        """
+        Copy every page of the PDF in `stream`, then close `stream`.
+
+        Returns:
+            int: Number of pages appended.
+        """
+        try:
+            stream.seek(0, 2)
+            self.source_bytes += stream.tell()
+            stream.seek(0)
+            reader = PdfReader(stream)
+            for page in reader.pages:
+                self.writer.add_page(page)
+            appended = len(reader.pages)
+        finally:
+            stream.close()
+        self.pages += appended
+        return appended
+
+    def write(self, target, optimize: bool = False, image_dpi: Optional[int] = None) -> Optional[dict]:
+        """
+        Write the assembled document into `target`.
+
+        Args:
+            target: Writable binary stream.
+            optimize (bool): Run `optimize_writer` on the document first.
+            image_dpi (int, optional): Raster resolution passed to `optimize_writer`.
+
+        Returns:
+            dict: The `optimize_pdf` style size report when `optimize` is set, otherwise None.
+        """
+        images_downsampled = 0
+        if optimize:
+            with span("optimize_pdf"):
+                images_downsampled = optimize_writer(self.writer, image_dpi)
+        start = target.tell()
+        with span("merge"):
+            self.writer.write(target)
+        if optimize:
+            return size_report(self.source_bytes, target.tell() - start, images_downsampled)
+        return None
+
+    def close(self) -> None:
+        self.writer.close()
@@ -3,12 +3,22 @@ import base64
 import sqlite3
 import pandas as pd
 import cairosvg
-from PyPDF2 import PdfMerger
 from datetime import datetime, timedelta
 from io import BytesIO
 import os
+import copy
+import mmap
+import re
+import threading
 from modules.data_utils import fetch_agent_contact_info
 import logging
+from modules.tracing import span
+from modules.output_sinks import DirectorySink
+from modules.pdf_assembler import PdfAssembler
+from modules.pdf_optimizer import optimize_pdf
+from modules.memoize import memoize_files
+from modules.template_compiler import resolve_template
+from typing import Optional
 
 logger = logging.getLogger("Proposal_Generator")
 
@@ -20,10 +30,36 @@ NSMAP = {
     "sodipodi": "http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd"
 }
 
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+def _parse_template(path: str):
+    """
+    Parse an SVG file once per version (size and mtime) and keep the tree.
+
+    Callers must deep-copy the returned tree before modifying it; copying the
+    large template pages is several times faster than parsing them again.
+    """
+    stat = os.stat(path)
+    marker = (stat.st_mtime_ns, stat.st_size)
+    with _templates_lock:
+        cached = _templates.get(path)
+        if cached is not None and cached[0] == marker:
+            return cached[1]
+    tree = etree.parse(path)
+    with _templates_lock:
+        _templates[path] = (marker, tree)
+    return tree
+
+
 def load_svg(input_svg_path: str) -> tuple:
     """
     Load and parse an SVG file.
 
+    Templates are read from their compiled counterpart when it is up to date
+    (see `modules.template_compiler`).
+
     Args:
         input_svg_path (str): Path to the input SVG file.
 
@@ -32,7 +68,7 @@ def load_svg(input_svg_path: str) -> tuple:
     """
     logger = logging.getLogger("Proposal_Generator")
     try:
-        tree = etree.parse(input_svg_path)
+        tree = copy.deepcopy(_parse_template(resolve_template(input_svg_path)))
         root = tree.getroot()
         return tree, root
     except FileNotFoundError:
@@ -80,13 +116,17 @@ def replace_text(root, element_id: str, old_text: str, new_text: str, namespaces
             if parent_y is not None:
                 parent.set("y", parent_y)
         #logger.debug(f"Stabilized <tspan> at x={tspan_x}, y={tspan_y}")
-        logger.debug(f"{element_id} text replaced: '{old_text}' -> '{new_text}'")
+        logger.debug("%s text replaced: '%s' -> '%s'", element_id, old_text, new_text)
 
 
 def embed_svg(root, base_svg_path, embed_svg_path: str, x: int = 0, y: int = 0, scale: int = 1.0) -> None:
     """
     Embed an SVG file into another SVG file at a specified position and scale, modifying the base SVG in-place.
-    
+
+    The embedded file is not parsed: a placeholder comment is appended to the base
+    SVG and `write_svg` splices the file's serialized content into the output at
+    that point, straight from a memory map of the file.
+
     Args:
         root: The root element of the base SVG tree to modify
         base_svg_path: Path to the base SVG file
@@ -94,44 +134,92 @@ def embed_svg(root, base_svg_path, embed_svg_path: str, x: int = 0, y: int = 0,
         x: X-coordinate for the embedded SVG's top-left corner (default: 0)
         y: Y-coordinate for the embedded SVG's top-left corner (default: 0)
         scale: Scaling factor for the embedded SVG (default: 1.0)
-    
+
     Returns:
         The modified SVG tree
     """
     logger = logging.getLogger("Proposal_Generator")
-    logging.info(f"Embedding SVG '{embed_svg_path}' into '{base_svg_path}' at ({x}, {y}) with scale {scale}")
+    logger.info("Embedding SVG '%s' into '%s' at (%s, %s) with scale %s", embed_svg_path, base_svg_path, x, y, scale)
     try:
-        # Parse the base SVG
-        base_tree = root.getroottree()
+        _svg_fragment(embed_svg_path)
+    except FileNotFoundError as e:
+        logger.error(f"Error: Embedded SVG file not found - {e}")
+        return None
+    except ValueError as e:
+        logger.error(f"Error parsing embedded SVG: {e}")
+        return None
 
-        # Parse the SVG to embed
-        embed_tree = etree.parse(embed_svg_path)
-        embed_root = embed_tree.getroot()
+    root.append(etree.Comment(f"{_EMBED_MARKER}translate({x}, {y}) scale({scale})|{embed_svg_path}"))
+    logger.debug("SVG %s embedded successfully", base_svg_path)
+    return root.getroottree()
 
-        # Create a <g> element to group the embedded SVG content
-        group = etree.Element("g", nsmap=NSMAP)
-        transform = f"translate({x}, {y}) scale({scale})"
-        group.set("transform", transform)
 
-        # Move all children from the embed SVG's root to the group
-        for child in embed_root:
-            group.append(child)
+_EMBED_MARKER = "svg-embed|"
+_EMBED_PATTERN = re.compile(rb"<!--svg-embed\|([^|]*)\|(.*?)-->")
+_XMLNS_PATTERN = re.compile(rb"""\sxmlns(?::[\w.-]+)?=(?:"[^"]*"|'[^']*')""")
 
-        # Append the group to the base SVG's root
-        root.append(group)
+_fragments = {}
+_fragments_lock = threading.Lock()
 
-        # Save the modified SVG
-        logger.debug(f"SVG {base_svg_path} embedded successfully")
-        return base_tree
 
-    except etree.XMLSyntaxError as e:
-        logger.error(f"Error parsing embedded SVG: {e}")
-    except FileNotFoundError as e:
-        logger.error(f"Error: Embedded SVG file not found - {e}")
-    except Exception as e:
-        logger.error(f"Unexpected error: {e}")
-        return None
+def _svg_fragment(path: str) -> tuple:
+    """
+    Locate the content of an SVG file's root element.
 
+    Returns:
+        tuple: (namespace declarations of the root tag, start offset, end offset), cached per size and mtime.
+
+    Raises:
+        ValueError: If the file has no `<svg>` root element.
+    """
+    stat = os.stat(path)
+    marker = (stat.st_mtime_ns, stat.st_size)
+    with _fragments_lock:
+        cached = _fragments.get(path)
+        if cached is not None and cached[0] == marker:
+            return cached[1]
+
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        root_start = mm.find(b"<svg")
+        root_end = mm.find(b">", root_start)
+        close = mm.rfind(b"</svg>")
+        if root_start < 0 or root_end < 0 or close < root_end:
+            raise ValueError(f"'{path}' has no <svg> root element")
+        namespaces = b"".join(_XMLNS_PATTERN.findall(mm[root_start:root_end]))
+    fragment = (namespaces, root_end + 1, close)
+    with _fragments_lock:
+        _fragments[path] = (marker, fragment)
+    return fragment
+
+
+def write_svg(tree, output_svg_path: str) -> None:
+    """
+    Serialize a page tree to `output_svg_path`, splicing in the SVGs placed by `embed_svg`.
+
+    Each embedded file is written inside a `<g transform>` carrying its root's
+    namespace declarations, directly from a memory map, so chart XML is never
+    parsed or re-serialized.
+    """
+    page = etree.tostring(tree, pretty_print=True, xml_declaration=True, encoding="utf-8")
+    with open(output_svg_path, "wb") as out:
+        position = 0
+        for match in _EMBED_PATTERN.finditer(page):
+            out.write(memoryview(page)[position:match.start()])
+            transform, path = match.group(1), match.group(2).decode("utf-8")
+            namespaces, start, end = _svg_fragment(path)
+            out.write(b'<g transform="' + transform + b'"' + namespaces + b">")
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    out.write(view[start:end])
+                finally:
+                    view.release()
+            out.write(b"</g>")
+            position = match.end()
+        out.write(memoryview(page)[position:])
+
+
+@memoize_files(outputs=("output_svg_path",), depends_on=("input_svg_path",))
 def process_page1(cliente, instalacao, fat_ref,  input_svg_path="Proposta PPT/page 1.svg", output_svg_path="Temp_ppt/page 1.svg", db_path="DataBase.db"):
     """
     Process an SVG file by replacing text fields with data from a database.
@@ -162,7 +250,7 @@ def process_page1(cliente, instalacao, fat_ref,  input_svg_path="Proposta PPT/pa
             
     # Save the modified SVG file
     try:
-        tree.write(output_svg_path, pretty_print=True, xml_declaration=True, encoding="utf-8")
+        write_svg(tree, output_svg_path)
         logger.info(f"Modified SVG saved to '{output_svg_path}'")
 
     except IOError as e:
@@ -172,6 +260,7 @@ def process_page1(cliente, instalacao, fat_ref,  input_svg_path="Proposta PPT/pa
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
 
+@memoize_files(outputs=("output_svg_path",), depends_on=("input_svg_path", "images/energy_cost_plot.svg"), daily=True)
 def process_page4(IN: str, media_mensal: float, total_contrato: float, economia_contratual: float, input_svg_path="Proposta PPT/page 4.svg", output_svg_path="Temp_ppt/page 4.svg", db_path="DataBase.db"):
     """
     Processes and modifies an SVG file for page 4 of a presentation by replacing text elements 
@@ -212,7 +301,7 @@ def process_page4(IN: str, media_mensal: float, total_contrato: float, economia_
     embed_svg(root, input_svg_path,"images/energy_cost_plot.svg" ,x=80,y=95, scale= 0.25)
     # Save the modified SVG file
     try:
-        tree.write(output_svg_path, pretty_print=True, xml_declaration=True, encoding="utf-8")
+        write_svg(tree, output_svg_path)
         logger.info(f"Modified SVG saved to '{output_svg_path}'")
 
 
@@ -222,6 +311,7 @@ def process_page4(IN: str, media_mensal: float, total_contrato: float, economia_
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
 
+@memoize_files(outputs=("output_svg_path",), depends_on=("input_svg_path", "images/energy_cost_plot.svg"), daily=True)
 def process_page5(IN: str, media_mensal: float, total_contrato: float, economia_contratual: float, economia_efetiva: float, input_svg_path="Proposta PPT/page 5.svg", output_svg_path="Temp_ppt/page 5.svg", db_path="DataBase.db"):
     """
     Processes and modifies an SVG file to update specific text elements and embed an image.
@@ -262,7 +352,7 @@ def process_page5(IN: str, media_mensal: float, total_contrato: float, economia_
     embed_svg(root, input_svg_path,"images/energy_cost_plot.svg" ,x=95,y=120, scale= 0.2)
     # Save the modified SVG file
     try:
-        tree.write(output_svg_path, pretty_print=True, xml_declaration=True, encoding="utf-8")
+        write_svg(tree, output_svg_path)
         logger.info(f"Modified SVG saved to '{output_svg_path}'")
 
     except IOError as e:
@@ -271,6 +361,7 @@ def process_page5(IN: str, media_mensal: float, total_contrato: float, economia_
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
 
+@memoize_files(outputs=("output_svg_path",), depends_on=("input_svg_path", "images/energy_cost_plot.svg", "images/flags_plot.svg", "images/price_curve_plot.svg"), daily=True)
 def process_page6(IN, media_mensal, total_contrato, economia_contratual, input_svg_path="Proposta PPT/page 6.svg", output_svg_path="Temp_ppt/page 6.svg", db_path="DataBase.db"):
     """
     Processes and modifies an SVG file for page 6 of a presentation by replacing text elements 
@@ -315,7 +406,7 @@ def process_page6(IN, media_mensal, total_contrato, economia_contratual, input_s
     embed_svg(root, input_svg_path,"images/price_curve_plot.svg" ,x=-35,y=190, scale= 0.1)
     # Save the modified SVG file
     try:
-        tree.write(output_svg_path, pretty_print=True, xml_declaration=True, encoding="utf-8")
+        write_svg(tree, output_svg_path)
         logger.info(f"Modified SVG saved to '{output_svg_path}'")
 
     except IOError as e:
@@ -324,6 +415,7 @@ def process_page6(IN, media_mensal, total_contrato, economia_contratual, input_s
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
 
+@memoize_files(outputs=("output_svg_path",), depends_on=("input_svg_path", "images/energy_cost_plot.svg", "images/historic_graph.svg"), daily=True)
 def process_page7(IN, media_mensal, total_contrato, economia_contratual, economia_anual, input_svg_path="Proposta PPT/page 7.svg", output_svg_path="Temp_ppt/page 7.svg", db_path="DataBase.db"):
     """
     Processes and modifies an SVG file for page 7 of a presentation by embedding data and replacing placeholders.
@@ -366,7 +458,7 @@ def process_page7(IN, media_mensal, total_contrato, economia_contratual, economi
 
     # Save the modified SVG file
     try:
-        tree.write(output_svg_path, pretty_print=True, xml_declaration=True, encoding="utf-8")
+        write_svg(tree, output_svg_path)
         logger.info(f"Modified SVG saved to '{output_svg_path}'")
 
     except IOError as e:
@@ -375,6 +467,7 @@ def process_page7(IN, media_mensal, total_contrato, economia_contratual, economi
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
 
+@memoize_files(outputs=("output_svg_path",), depends_on=("input_svg_path",))
 def process_page10(agente, input_svg_path="Proposta PPT/page 10.svg", output_svg_path="Temp_ppt/page 10.svg", db_path="DataBase.db"):
     """
     Process an SVG file by replacing text fields with data from a database.
@@ -412,7 +505,7 @@ def process_page10(agente, input_svg_path="Proposta PPT/page 10.svg", output_svg
 
     # Save the modified SVG file
     try:
-        tree.write(output_svg_path, pretty_print=True, xml_declaration=True, encoding="utf-8")
+        write_svg(tree, output_svg_path)
         logger.info(f"Modified SVG saved to '{output_svg_path}'")
     except IOError as e:
         logger.error(f"Error saving modified SVG: {e}")
@@ -430,7 +523,8 @@ def svg_to_pdf_stream(svg_path: str, dpi: int = 500) -> None:
     """
     try:
         pdf_stream = BytesIO()
-        cairosvg.svg2pdf(url=svg_path, write_to=pdf_stream, dpi=dpi)
+        with span("svg_to_pdf_stream", page=os.path.basename(svg_path)):
+            cairosvg.svg2pdf(url=svg_path, write_to=pdf_stream, dpi=dpi)
         pdf_stream.seek(0)
         logger.info(f"Converted {svg_path} to PDF stream")
         return pdf_stream
@@ -438,57 +532,133 @@ def svg_to_pdf_stream(svg_path: str, dpi: int = 500) -> None:
         logger.error(f"Error converting {svg_path} to PDF: {e}")
         return None
 
-def generate_pdf(svg_files: list, output_pdf: str, dpi: int = 500) -> None:
+def svg_to_png(svg_path: str, dpi: int = 30) -> bytes:
     """
-    Merge multiple SVG files into a single PDF without saving temporary files.
-    
+    Rasterize an SVG file to PNG, e.g. for low-resolution previews.
+
     Args:
-        svg_files: List of paths to SVG files
-        output_pdf: Path where the final merged PDF will be saved
-        dpi: Resolution in dots per inch (default: 500)
-    """
-    merger = PdfMerger()
+        svg_path: Path to the input SVG file
+        dpi: Resolution in dots per inch (default: 30)
 
-    # Convert each SVG to PDF stream and append to merger
-    for svg_file in svg_files:
-        if not os.path.exists(svg_file):
-            logger.error(f"Error: {svg_file} does not exist")
-            continue
-        pdf_stream = svg_to_pdf_stream(svg_file, dpi)
-        if pdf_stream:
-            merger.append(pdf_stream)
+    Returns:
+        PNG bytes
+    """
+    with span("svg_to_png", page=os.path.basename(svg_path)):
+        return cairosvg.svg2png(url=resolve_template(svg_path), dpi=dpi)
 
-    # Write the merged PDF to disk
-    try:
-        with open(output_pdf, 'wb') as f:
-            merger.write(f)
-        logger.info(f"Merged PDF saved as {output_pdf}")
-    except Exception as e:
-        logger.error(f"Error merging PDFs: {e}")
-    finally:
-        merger.close()
 
-def open_pdf(pdf_path: str) -> None:
+def svg_to_pdf_document(svg_files: list, target, dpi: int = 500, progress=None) -> int:
     """
-    Opens a PDF file using the default PDF viewer on the operating system.
+    Render SVG files as the pages of one PDF through a single cairo surface.
 
-    Parameters:
-        pdf_path (str): The file path to the PDF document to be opened.
+    Each page is drawn onto the same cairo PDF surface, which streams the
+    document into `target`, so there is no per-page PDF and no merge step.
 
-    Behavior:
-        - On macOS, it uses the "open" command to open the PDF.
-        - On Linux, the "xdg-open" command can be used (commented out in the code).
-        - On Windows, it uses the "start" command to open the PDF.
+    Args:
+        svg_files: List of paths to SVG files, one page each
+        target: Writable binary stream receiving the PDF
+        dpi: Resolution in dots per inch (default: 500)
+        progress: Optional `progress(stage, fraction)` callback, called before each page is drawn
 
-    Note:
-        Ensure that the `pdf_path` is a valid file path and that the operating system
-        has a default application configured to open PDF files.
+    Returns:
+        Number of pages rendered
     """
-    if os.name == "posix":  # macOS/Linux
-        os.system(f"open {pdf_path}")  # macOS
-        # Use "xdg-open" for Linux: os.system(f"xdg-open {pdf_path}")
-    elif os.name == "nt":  # Windows
-        os.system(f"start {pdf_path}")
+    from cairosvg.surface import PDFSurface
+
+    document = {}
+
+    class PageSurface(PDFSurface):
+        # cairosvg creates one cairo surface per SVG; hand it the shared one, resized to this page
+        def _create_surface(self, width, height):
+            if "surface" in document:
+                document["surface"].set_size(width, height)
+            else:
+                document["surface"] = self.surface_class(self.output, width, height)
+            return document["surface"], width, height
+
+        def finish(self):
+            self.cairo.show_page()
+
+    pages = 0
+    for i, svg_file in enumerate(svg_files):
+        if progress:
+            progress(f"Convertendo {os.path.basename(svg_file)}", i / len(svg_files))
+        with span("svg_to_pdf_stream", page=os.path.basename(svg_file)):
+            PageSurface.convert(url=resolve_template(svg_file), write_to=target, dpi=dpi)
+        pages += 1
+    if "surface" in document:
+        document["surface"].finish()
+    return pages
+
+
+def generate_pdf(svg_files: list, output, dpi: int = 500, progress=None, filename: str = None,
+                 optimize: bool = False, image_dpi: int = None, single_surface: bool = False) -> Optional[dict]:
+    """
+    Assemble multiple SVG files into a single PDF without saving temporary files.
+
+    Pages are converted one at a time and appended to a `PdfAssembler`, which
+    releases each page's buffer as soon as it is copied.
+
+    Args:
+        svg_files: List of paths to SVG files
+        output: OutputSink receiving the PDF, or a file path (written through a DirectorySink)
+        dpi: Resolution in dots per inch (default: 500)
+        progress: Optional `progress(stage, fraction)` callback, called before each page is converted
+        filename: File name given to the sink (ignored when `output` is a path)
+        optimize: Optimise the document (see `modules.pdf_optimizer`) before writing it
+        image_dpi: Raster resolution used when optimising (None keeps the images as they are)
+        single_surface: Draw every page on one cairo surface (`svg_to_pdf_document`) instead of
+            assembling per-page PDFs; without `optimize` the PDF streams straight into the sink
 
+    Returns:
+        dict: The `optimize_pdf` size report when `optimize` is set, otherwise None
 
+    Pages that do not exist or fail to convert are left out of the PDF and listed
+    in the sink's `missing_pages`. Anything else (a cancelled job raising from
+    `progress`, a failing sink) propagates to the caller.
+    """
+    if isinstance(output, (str, os.PathLike)):
+        sink, filename = DirectorySink(os.path.dirname(output) or "."), os.path.basename(output)
+    else:
+        sink, filename = output, filename or output.filename or "proposta.pdf"
 
+    pages = []
+    sink.missing_pages = []
+    for svg_file in svg_files:
+        if os.path.exists(svg_file):
+            pages.append(svg_file)
+        else:
+            logger.error(f"Error: {svg_file} does not exist")
+            sink.missing_pages.append(svg_file)
+
+    report = None
+    if single_surface:
+        if optimize:
+            rendered = BytesIO()
+            svg_to_pdf_document(pages, rendered, dpi, progress)
+            if progress:
+                progress("Otimizando PDF", 1.0)
+            with sink.open(filename) as f:
+                report = optimize_pdf(rendered, f, image_dpi=image_dpi)
+        else:
+            with sink.open(filename) as f:
+                svg_to_pdf_document(pages, f, dpi, progress)
+    else:
+        assembler = PdfAssembler()
+        try:
+            for i, svg_file in enumerate(pages):
+                if progress:
+                    progress(f"Convertendo {os.path.basename(svg_file)}", i / len(pages))
+                pdf_stream = svg_to_pdf_stream(resolve_template(svg_file), dpi)
+                if pdf_stream:
+                    assembler.append(pdf_stream)
+                else:
+                    sink.missing_pages.append(svg_file)
+            if optimize and progress:
+                progress("Otimizando PDF", 1.0)
+            with sink.open(filename) as f:
+                report = assembler.write(f, optimize=optimize, image_dpi=image_dpi)
+        finally:
+            assembler.close()
+    logger.info(f"Merged PDF written to {sink.location}")
+    return report
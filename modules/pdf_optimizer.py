@@ -0,0 +1,116 @@
+import logging
+from io import BytesIO
+from typing import Optional
+
+from pypdf import PdfReader, PdfWriter
+
+from modules.tracing import span
+
+logger = logging.getLogger("Proposal_Generator")
+
+# Pillow modes that can be re-encoded as JPEG without losing an alpha channel
+_JPEG_MODES = ("L", "RGB", "CMYK")
+
+
+def _downsample_images(writer: PdfWriter, image_dpi: int, image_quality: int) -> int:
+    """
+    Downsample embedded rasters wider than `image_dpi` at the page width.
+
+    The page width is used as the upper bound of an image's displayed size, so an
+    image is never reduced below `image_dpi` where it is actually drawn. Images
+    with transparency (cairo emits them with an SMask) are left untouched.
+
+    Returns:
+        int: Number of images replaced.
+    """
+    replaced = 0
+    seen = set()
+    for page in writer.pages:
+        page_width_in = float(page.mediabox.width) / 72
+        max_width = int(page_width_in * image_dpi)
+        for image_file in page.images:
+            ref = image_file.indirect_reference
+            if ref is None or ref.idnum in seen:
+                continue
+            seen.add(ref.idnum)
+            try:
+                image = image_file.image
+                if image is None or image.mode not in _JPEG_MODES or image.width <= max_width:
+                    continue
+                height = max(1, round(image.height * max_width / image.width))
+                image_file.replace(image.resize((max_width, height)), quality=image_quality)
+                replaced += 1
+            except Exception as e:
+                logger.warning(f"Skipping image {image_file.name} during optimisation: {e}")
+    return replaced
+
+
+def optimize_writer(writer: PdfWriter, image_dpi: Optional[int] = None, image_quality: int = 80) -> int:
+    """
+    Shrink the document held by `writer` in place.
+
+    Content streams are recompressed, identical objects shared by several pages
+    (fonts, logos and photos from the static templates) are stored once and
+    orphaned objects are dropped. When `image_dpi` is given, embedded rasters are
+    also downsampled to that resolution.
+
+    Args:
+        writer (PdfWriter): Document to optimise.
+        image_dpi (int, optional): Target raster resolution; None keeps the images as they are.
+        image_quality (int): JPEG quality for downsampled images (default: 80).
+
+    Returns:
+        int: Number of images downsampled.
+    """
+    images_downsampled = 0
+    if image_dpi:
+        images_downsampled = _downsample_images(writer, image_dpi, image_quality)
+    for page in writer.pages:
+        page.compress_content_streams(level=9)
+    writer.compress_identical_objects()
+    return images_downsampled
+
+
+def size_report(size_before: int, size_after: int, images_downsampled: int) -> dict:
+    """Build (and log) the report returned by `optimize_pdf`."""
+    report = {
+        "size_before": size_before,
+        "size_after": size_after,
+        "saved_pct": round(100 * (1 - size_after / size_before), 1) if size_before else 0.0,
+        "images_downsampled": images_downsampled,
+    }
+    logger.info(
+        f"PDF optimised: {size_before / 1024:.0f} KiB -> {size_after / 1024:.0f} KiB "
+        f"({report['saved_pct']}% smaller, {images_downsampled} images downsampled)"
+    )
+    return report
+
+
+def optimize_pdf(source, target, image_dpi: Optional[int] = None, image_quality: int = 80) -> dict:
+    """
+    Shrink a merged proposal PDF (see `optimize_writer`).
+
+    Args:
+        source: PDF bytes, or a readable binary stream.
+        target: Writable binary stream receiving the optimised PDF.
+        image_dpi (int, optional): Target raster resolution; None keeps the images as they are.
+        image_quality (int): JPEG quality for downsampled images (default: 80).
+
+    Returns:
+        dict: {"size_before", "size_after", "saved_pct", "images_downsampled"}
+    """
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+    source.seek(0, 2)
+    size_before = source.tell()
+    source.seek(0)
+
+    with span("optimize_pdf"):
+        writer = PdfWriter(clone_from=PdfReader(source))
+        images_downsampled = optimize_writer(writer, image_dpi, image_quality)
+
+        buffer = BytesIO()
+        writer.write(buffer)
+        target.write(buffer.getvalue())
+
+    return size_report(size_before, buffer.tell(), images_downsampled)
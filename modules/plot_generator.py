@@ -1,23 +1,54 @@
 import matplotlib.pyplot as plt
 import matplotlib.image as mpimg
 import matplotlib.ticker as ticker
-from matplotlib.patches import FancyBboxPatch, Circle, Rectangle
-from matplotlib.lines import Line2D
-from matplotlib.text import Text
+from matplotlib.patches import Rectangle
 from matplotlib.legend_handler import HandlerPatch
 import matplotlib.patches as mpatches
 from matplotlib.offsetbox import OffsetImage, AnnotationBbox
+from matplotlib.collections import PolyCollection, EllipseCollection, LineCollection
 import numpy as np
 import os
 from PIL import Image
 from pathlib import Path
 from typing import Optional
+import logging
+from functools import lru_cache
 
-def flags_plot(values, categories = ['VERDE', 'AMARELA', 'VERMELHA I', 'VERMELHA II'], output_path = 'images/', filename = 'flags_plot.svg', transparent_background: bool = True):
+logger = logging.getLogger("Proposal_Generator")
+
+# Padding of the bar bodies in `create_historic_graph`, as FancyBboxPatch's "round" boxstyle (data units)
+BAR_PAD = 0.3
+
+@lru_cache(maxsize=32)
+def _read_icon(path: str, mtime_ns: int):
+    image = mpimg.imread(path)
+    image.setflags(write=False)
+    return image
+
+
+def load_icon(path: str):
+    """Read an icon image once per file version; the returned array is read-only."""
+    path = os.path.abspath(path)
+    return _read_icon(path, os.stat(path).st_mtime_ns)
+
+
+def flags_plot(values, categories = ['VERDE', 'AMARELA', 'VERMELHA I', 'VERMELHA II'], output_path = 'images/', filename = 'flags_plot.svg', transparent_background: bool = True, expected=None):
+    """
+    Horizontal bars of the average discount under each flag.
+
+    `expected`, when given, is the (low, median, high) percentile band of the discount
+    over simulated flag sequences (see `modules.bandeira_simulation`); it is drawn as an
+    extra "ESPERADO" bar at the median with the band as its range.
+    """
+    colors = ['#1EFF8C', '#FFCB2A', '#EC3137', '#AE3333']
+    if expected is not None:
+        categories = list(categories) + ['ESPERADO']
+        values = list(values) + [expected[1]]
+        colors = colors + ['#0F7661']
     # Reverse the order of the data
     categories = categories[::-1]
     values = values[::-1]
-    colors = ['#1EFF8C', '#FFCB2A', '#EC3137', '#AE3333']
+    colors = colors[::-1]
 
     # Create the figure and axis objects
     fig, ax = plt.subplots(figsize=(10, 4))
@@ -26,9 +57,15 @@ def flags_plot(values, categories = ['VERDE', 'AMARELA', 'VERMELHA I', 'VERMELHA
     bars = ax.barh(categories, values, color=colors)
 
     # Add data labels on the bars
-    for bar in bars:
+    for i, bar in enumerate(bars):
         width = bar.get_width()
         label_x_pos = width + 9 
+        if expected is not None and i == 0:
+            # The expected bar (first after the reversal) shows the simulated percentile band
+            ax.errorbar(width, bar.get_y() + bar.get_height()/2,
+                        xerr=[[width - expected[0]], [expected[2] - width]],
+                        fmt='none', ecolor='#9ADBC8', elinewidth=3, capsize=10, capthick=3, zorder=3)
+            label_x_pos = max(width, expected[2]) + 9
         ax.text(label_x_pos, bar.get_y() + bar.get_height()/2, f'{width:.1f}%', 
                 va='center', ha='right', color='#0F7661', fontweight='bold', fontsize = 20)
 
@@ -63,6 +100,7 @@ def flags_plot(values, categories = ['VERDE', 'AMARELA', 'VERMELHA I', 'VERMELHA
     plt.tight_layout()
     save_path = os.path.join(output_path, filename)
     plt.savefig(save_path, transparent= transparent_background, bbox_inches='tight', dpi=300)
+    plt.close(fig)  # Close the figure to free memory
 
 # Example usage
 """
@@ -117,7 +155,7 @@ def yearly_economy_plot(years, values, percentages, output_folder = 'images/', o
     # Customize the title and add icon
     ax.set_title('Economia Anual²', fontsize=16, fontweight='bold', loc='center', color = '#0F766E')
     img_path = 'images/money_icon.png'  # Path to your money icon image
-    arr_img = plt.imread(img_path, format='png')
+    arr_img = load_icon(img_path)
     imagebox = OffsetImage(arr_img, zoom=0.4)  # Adjust zoom as needed
     ab = AnnotationBbox(imagebox, xy = (0.4, 1.04), xycoords= 'axes fraction', frameon=False)
     ax.add_artist(ab)
@@ -331,7 +369,7 @@ def flags_pie_plot(categories, values, output_path='images/', filename='flags_pi
 
     # Remove the axes
     ax.axis('off')
-    print(values)
+    logger.debug("flags_pie_plot values: %s", values)
     # Save the plot
     save_path = os.path.join(output_path, filename)
     plt.savefig(save_path, transparent= transparent_background, bbox_inches='tight', dpi=300)
@@ -396,17 +434,17 @@ def energy_cost_plot(total_cost, energia_livre, servicos_distribuicao,economia,
 
     # Load the icon images with error handling
     try:
-        light_bulb_img = mpimg.imread('images/light_bulb.jpg')
-        print("Light bulb image loaded successfully:", light_bulb_img.shape)
+        light_bulb_img = load_icon('images/light_bulb.jpg')
+        logger.debug(f"Light bulb image loaded successfully: {light_bulb_img.shape}")
     except Exception as e:
-        print(f"Error loading light bulb image: {e}")
+        logger.error(f"Error loading light bulb image: {e}")
         light_bulb_img = None
 
     try:
-        power_line_img = mpimg.imread('images/power_line.jpg')
-        print("Power line image loaded successfully:", power_line_img.shape)
+        power_line_img = load_icon('images/power_line.jpg')
+        logger.debug(f"Power line image loaded successfully: {power_line_img.shape}")
     except Exception as e:
-        print(f"Error loading power line image: {e}")
+        logger.error(f"Error loading power line image: {e}")
         power_line_img = None
 
     # Define the positions for the icons
@@ -445,6 +483,7 @@ def energy_cost_plot(total_cost, energia_livre, servicos_distribuicao,economia,
     save_path = os.path.join(output_path, filename)
     plt.savefig(save_path, transparent= transparent_background, bbox_inches='tight', dpi=300)
     plt.show()
+    plt.close(fig)  # Close the figure to free memory
 
 def create_historic_graph(months, actual_values, new_values, reference_values, 
                        show_quota=True, figsize=(12,6), output_path="images/historic_graph.svg",
@@ -477,6 +516,9 @@ def create_historic_graph(months, actual_values, new_values, reference_values,
         """
         Draws rectangles with rounded ends (circles) for a bar-like plot.
         Skips drawing circles if y_ax is null (NaN/None) or zero.
+
+        The bodies of all bars are one `PolyCollection` and their ends one
+        `EllipseCollection`, with the geometry computed on NumPy arrays.
         
         Parameters:
         - x_ax: List of x-axis labels (e.g., months)
@@ -491,72 +533,65 @@ def create_historic_graph(months, actual_values, new_values, reference_values,
         - None
         """
 
-        rectprops = dict(facecolor=face_color, edgecolor='black', linewidth=0)
-        x = spacing * np.arange(len(x_ax))
-        heights = y_ax
-        basis = y0_ax
+        heights = np.asarray(y_ax, dtype=float)
+        basis = np.asarray(y0_ax, dtype=float)
+        drawn = ~(np.isnan(heights) | (heights == 0))
+        x = spacing * np.arange(len(x_ax))[drawn]
+        heights, basis = heights[drawn], basis[drawn]
+        if not len(x):
+            return None
         circle_radius = 0.95 * width / 2
 
-        for i, month in enumerate(x_ax):
-            # Only draw circles if height is non-zero and not NaN
-            if not (np.isnan(heights[i]) or heights[i] == 0): 
-                rect = FancyBboxPatch((x[i] - width + offset, basis[i]), width, 
-                                    heights[i], boxstyle="round", **rectprops)
-                ax.add_patch(rect)
-
-                circle_top = Circle((x[i] - width/2 + offset, basis[i] + heights[i]), 
-                                    radius=circle_radius, color=face_color)
-                circle_bottom = Circle((x[i] - width/2 + offset, basis[i]), 
-                                    radius=circle_radius, color=face_color)
-                ax.add_patch(circle_top)
-                ax.add_patch(circle_bottom)
-
-            # Add percentage difference labels
-            #label_x = x[i] - width/2 + offset
-            #label_y = (actual_values[i] + basis[i] + heights[i])/2 - 4
-            #label = Text(label_x, label_y, f'{percentage_diff[i]:.1f}%', 
-            #            ha='center', va='bottom', rotation=90, 
-            #            color='#0D5F4E', fontsize=11)  # Darker green than #117761
-            #ax.add_artist(label)
+        # Bar bodies, padded like FancyBboxPatch's "round" box (pad 0.3 data units)
+        left = x - width + offset - BAR_PAD
+        right = left + width + 2 * BAR_PAD
+        bottom = basis - BAR_PAD
+        top = basis + heights + BAR_PAD
+        bodies = np.stack([
+            np.column_stack([left, bottom]), np.column_stack([right, bottom]),
+            np.column_stack([right, top]), np.column_stack([left, top]),
+        ], axis=1)
+        ax.add_collection(PolyCollection(bodies, facecolors=face_color, edgecolors='black', linewidths=0))
+
+        # Rounded ends: one circle at the bottom and one at the top of every bar
+        centers_x = np.tile(x - width / 2 + offset, 2)
+        centers_y = np.concatenate([basis + heights, basis])
+        diameters = np.full(len(centers_x), 2 * circle_radius)
+        ax.add_collection(EllipseCollection(
+            diameters, diameters, np.zeros(len(centers_x)), units='xy',
+            offsets=np.column_stack([centers_x, centers_y]), offset_transform=ax.transData,
+            facecolors=face_color, edgecolors=face_color, linewidths=plt.rcParams['patch.linewidth'],
+        ))
         return None
 
     def add_quota(x_ax, actual_values, new_values, reference_values, width=width, circle_radius=width/2):
         x = spacing * np.arange(len(x_ax))  # Use the same spacing as the main plot
-        offset = spacing * 0.35  # Match the offset used in flying_rectangle_graph
-        for i, month in enumerate(x_ax):
-            # Start at top of new_values circle (basis + height + radius)
-            y_start = reference_values[i] + new_values[i] + circle_radius
-            # End at top of actual_values circle (height + radius)
-            y_end = actual_values[i] + circle_radius
-            # X-position centered on the new_values series
-            x_pos = x[i] + width/2
-            # Define text height (approximate, in data units; adjust if needed)
-            # Calculate midpoint and text height before drawing lines
-            mid_y = (y_start + y_end) / 2
-            mid_x = x_pos
-            text_height = (y_end - y_start) * 0.25  # 10% of the total height as buffer
-            # Lower segment: from y_start to just below text
-            quota_line_lower = Line2D([x_pos, x_pos], [y_start + 0.1*width, mid_y - text_height],
-                                    color='lightgrey', linestyle='-')
-            ax.add_line(quota_line_lower)
-            # Upper segment: from just above text to y_end
-            quota_line_upper = Line2D([x_pos, x_pos], [mid_y + text_height, y_end - 0.1*width],
-                                    color='lightgrey', linestyle='-')
-            ax.add_line(quota_line_upper)
-            
-            mid_x = x_pos
-            mid_y = (y_start + y_end) / 2
-            quota_text = Text(mid_x, mid_y, f'{percentage_diff[i]:.1f}%', ha='center', va='center', rotation=90, color='#0D5F4E', fontsize=11)
-            ax.add_artist(quota_text)
-
-            # Horizontal line at bottom (y_start)
-            hline_bottom = Line2D([x_pos - 0.4 * width, x_pos + 0.4 * width], [y_start + 0.1*width, y_start + 0.1*width],
-                                  color='lightgrey', linestyle='-')
-            ax.add_line(hline_bottom)
-            # Horizontal line at top (y_end)
-            hline_top = Line2D([x_pos - 0.4 * width, x_pos + 0.4 * width], [y_end - 0.1*width, y_end- 0.1*width],
-                              color='lightgrey', linestyle='-')
-            ax.add_line(hline_top)
+        actual = np.asarray(actual_values, dtype=float)
+        # Start at top of new_values circle (basis + height + radius)
+        y_start = np.asarray(reference_values, dtype=float) + np.asarray(new_values, dtype=float) + circle_radius
+        # End at top of actual_values circle (height + radius)
+        y_end = actual + circle_radius
+        # X-position centered on the new_values series
+        x_pos = x + width/2
+        # Midpoint and half the gap left for the label (25% of the quota height)
+        mid_y = (y_start + y_end) / 2
+        text_height = (y_end - y_start) * 0.25
+        bottom = y_start + 0.1*width
+        top = y_end - 0.1*width
+        left, right = x_pos - 0.4 * width, x_pos + 0.4 * width
+
+        # Per month: lower and upper vertical segments around the label, horizontal caps at both ends
+        segments = np.stack([
+            np.stack([np.column_stack([x_pos, bottom]), np.column_stack([x_pos, mid_y - text_height])], axis=1),
+            np.stack([np.column_stack([x_pos, mid_y + text_height]), np.column_stack([x_pos, top])], axis=1),
+            np.stack([np.column_stack([left, bottom]), np.column_stack([right, bottom])], axis=1),
+            np.stack([np.column_stack([left, top]), np.column_stack([right, top])], axis=1),
+        ], axis=1).reshape(-1, 2, 2)
+        ax.add_collection(LineCollection(segments, colors='lightgrey', linestyles='-'))
+
+        for i in range(len(x_ax)):
+            ax.text(x_pos[i], mid_y[i], f'{percentage_diff[i]:.1f}%', ha='center', va='center', rotation=90,
+                    color='#0D5F4E', fontsize=11)
 
 
     # Plot setup
@@ -618,3 +653,44 @@ def create_historic_graph(months, actual_values, new_values, reference_values,
     
     fig.savefig(output_path, transparent= transparent_background, bbox_inches='tight')
     plt.close(fig)
+
+
+def portfolio_table_plot(rows, totals, title, output_path, page_size=(11.69, 8.27)):
+    """
+    Draw one page of the installations table of a portfolio proposal as a landscape A4 SVG page.
+
+    Args:
+        rows (list): One list of formatted cells per installation, in the order of the column labels.
+        totals (list): Formatted cells of the totals row, or None on pages without it.
+        title (str): Heading of the page.
+        output_path (str): Path of the SVG file written.
+        page_size (tuple): Page width and height in inches (the templates are A4 landscape).
+    """
+    columns = ['INSTALAÇÃO', 'DISTRIBUIDORA', 'FATURA\nCATIVA', 'FATURA LIVRE\n+ USO', 'ECONOMIA\nMENSAL',
+               'DESCONTO', 'ECONOMIA NO\nCONTRATO']
+    cells = list(rows) + ([totals] if totals is not None else [])
+
+    fig = plt.figure(figsize=page_size)
+    fig.text(0.06, 0.9, title, fontsize=24, color='#0F7661', fontweight='bold', ha='left', va='bottom')
+    ax = fig.add_axes([0.06, 0.08, 0.88, 0.78])
+    ax.axis('off')
+
+    table = ax.table(cellText=cells, colLabels=columns, loc='upper center', cellLoc='center')
+    table.auto_set_font_size(False)
+    table.set_fontsize(10)
+    table.scale(1, 1.5)
+    for (row, col), cell in table.get_celld().items():
+        cell.set_edgecolor('#D3D3D3')
+        if row == 0:
+            cell.set_height(cell.get_height() * 2)
+            cell.set_facecolor('#0F7661')
+            cell.set_text_props(color='white', fontweight='bold')
+        elif totals is not None and row == len(cells):
+            cell.set_facecolor('#1EFF8C')
+            cell.set_text_props(color='#0F7661', fontweight='bold')
+        elif row % 2 == 0:
+            cell.set_facecolor('#F2F2F2')
+
+    # The page keeps its full size, unlike the charts embedded into the templates
+    fig.savefig(output_path, facecolor='white')
+    plt.close(fig)
@@ -0,0 +1,332 @@
+"""
+Consolidated proposals for a grupo econômico with many installations.
+
+A portfolio shares the commercial terms of a proposal (product, prices,
+contract length, client, agent) across its installations. Each installation
+brings its own load profile and may have its own distribuidora, tariff and
+taxes (see `INSTALLATION_INPUTS`). Installations are priced with
+`price_proposal`, one pass per group sharing a tariff (see `price_portfolio`),
+and the invoices are summed. One PDF holds:
+
+- the cover, static and contact pages, once;
+- the product's results page, filled with the consolidated savings;
+- a table of the installations;
+- optionally, one results page per installation as an appendix.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from modules.artifact_store import get_artifact_store, proposal_key
+from modules.calculations import calcular_faturas_bandeiras, gerar_graficos
+from modules.consumption_history import load_history
+from modules.memoize import canonical_key
+from modules.output_sinks import MemorySink, safe_filename
+from modules.pdf_builder import generate_pdf, process_page1, process_page10
+from modules.plot_generator import portfolio_table_plot
+from modules.proposal_api import normalize_inputs
+from modules.proposal_generator import contract_start_month, fill_result_page, price_proposal
+from modules.snapshots import get_snapshot_store, snapshot_probabilities
+from modules.tracing import span, traced, exports_metrics
+
+logger = logging.getLogger("Proposal_Generator")
+
+PORTFOLIO_DIR = "Temp_ppt/portfolio"
+MAX_WORKERS = 8
+ROWS_PER_PAGE = 18
+
+# Inputs that do not change how an installation is priced, only which pages it gets
+_PAGE_INPUTS = ("Instalacao", "IN", "grid_data", "gd", "irrigante")
+
+# Inputs an installation may set for itself; every other input is shared by the portfolio
+INSTALLATION_INPUTS = (
+    "Instalacao", "IN", "grid_data", "gd", "irrigante", "icms", "paseb", "cofins", "bandeira", "icms_hr",
+    "desc_irrig", "distribuidora", "subgrupo", "modalidade", "resolucao",
+)
+
+
+def normalize_portfolio(portfolio: dict) -> list:
+    """
+    Validate a portfolio and expand it into the inputs of each installation.
+
+    Args:
+        portfolio (dict): The shared inputs of `generate_proposal` plus "installations", a list
+            of dicts with each installation's `INSTALLATION_INPUTS` (at least "Instalacao" and
+            "grid_data"). Inputs an installation leaves out are taken from the portfolio.
+
+    Returns:
+        list: One normalized inputs dict (see `normalize_inputs`) per installation.
+
+    Raises:
+        ValueError: If there are no installations, an installation overrides a shared input,
+            or the merged inputs are incomplete.
+    """
+    installations = portfolio.get("installations") or []
+    if not installations:
+        raise ValueError("A portfolio needs at least one installation")
+    shared = {name: value for name, value in portfolio.items() if name != "installations"}
+
+    expanded = []
+    for i, installation in enumerate(installations):
+        shared_only = sorted(set(installation) - set(INSTALLATION_INPUTS))
+        if shared_only:
+            raise ValueError(f"Installation {i} sets {', '.join(shared_only)}, which the portfolio shares")
+        try:
+            expanded.append(normalize_inputs(dict(shared, **installation)))
+        except ValueError as e:
+            raise ValueError(f"Installation {i}: {e}") from None
+    return expanded
+
+
+def _item(value, i: int):
+    """Installation `i`'s value out of a column (or a list of columns) computed for a pricing group."""
+    if isinstance(value, list):
+        return [_item(element, i) for element in value]
+    if isinstance(value, pd.Series):
+        return float(value.iloc[i])
+    return value
+
+
+def _price_group(installations: list) -> list:
+    """
+    Price installations sharing every input but the load profile in one pass.
+
+    The load profiles are laid out as columns, which go through the invoice
+    formulas like scalars (as in `modules.comparison`).
+    """
+    inputs = installations[0]
+    grid_data = pd.DataFrame([installation["grid_data"] for installation in installations]).fillna(0.0)
+    calculo = price_proposal(
+        inputs["produto"], inputs["years"], grid_data, inputs["icms"], inputs["paseb"], inputs["cofins"],
+        inputs["bandeira"], inputs["icms_hr"], inputs["desc_irrig"], inputs["distribuidora"], inputs["subgrupo"],
+        inputs["modalidade"], inputs["resolucao"], inputs["desconto"], inputs["duracao_meses"], inputs["yearly_data"],
+        inputs["snapshot"],
+    )
+    faturas_bandeiras = calcular_faturas_bandeiras(
+        calculo["quantidade"], calculo["tarifa"], calculo["impostos_bandeira"]
+    )
+    return [
+        {
+            "preco": calculo["preco"],
+            "quantidade": {name: _item(value, i) for name, value in calculo["quantidade"].items()},
+            "tarifa": calculo["tarifa"],
+            "impostos_bandeira": calculo["impostos_bandeira"],
+            "results": {name: _item(value, i) for name, value in calculo["results"].items()},
+            "faturas_bandeiras": _item(faturas_bandeiras, i),
+        }
+        for i in range(len(installations))
+    ]
+
+
+def price_portfolio(installations: list, max_workers: int = MAX_WORKERS) -> list:
+    """
+    Price every installation (see `price_proposal`).
+
+    Installations with the same tariff, taxes and prices form one pricing group,
+    computed in a single pass over their load profiles. Groups (e.g. different
+    distribuidoras) are priced in parallel on a thread pool, so their tariff
+    lookups overlap.
+
+    Returns:
+        list: The `price_proposal` result of each installation, in input order, with
+        "faturas_bandeiras" (see `calcular_faturas_bandeiras`) added.
+    """
+    groups = {}
+    for i, inputs in enumerate(installations):
+        key = canonical_key({name: value for name, value in inputs.items() if name not in _PAGE_INPUTS})
+        groups.setdefault(key, []).append(i)
+    logger.debug(f"Pricing {len(installations)} installations in {len(groups)} groups")
+
+    calculos = [None] * len(installations)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(groups))),
+                            thread_name_prefix="portfolio") as executor:
+        priced = executor.map(lambda indices: _price_group([installations[i] for i in indices]), groups.values())
+        for indices, group in zip(groups.values(), priced):
+            for i, calculo in zip(indices, group):
+                calculos[i] = calculo
+    return calculos
+
+
+def aggregate_portfolio(calculos: list) -> dict:
+    """
+    Sum the invoices and savings of the installations.
+
+    Returns:
+        dict: The keys of the `price_proposal` results, summed (yearly free-market invoices
+        element-wise), with the consolidated discount, "faturas_bandeiras" and "instalacoes".
+    """
+    results = [calculo["results"] for calculo in calculos]
+    total = {
+        name: sum(result[name] for result in results)
+        for name in ("fatura_cativa", "fatura_cativa_c_compensacao", "fatura_uso", "economia_mensal",
+                     "economia_anual", "total_contrato")
+    }
+    total["fatura_livre"] = [sum(year) for year in zip(*(result["fatura_livre"] for result in results))]
+    total["faturas_bandeiras"] = [sum(flag) for flag in zip(*(calculo["faturas_bandeiras"] for calculo in calculos))]
+
+    preco = calculos[0]["preco"]
+    # As for one installation: the contracted discount, or the savings over the captive invoices
+    total["desconto"] = (preco["desconto"] if preco["produto"] == "Desconto Garantido"
+                         else total["economia_mensal"] / total["fatura_cativa"])
+    total["instalacoes"] = len(calculos)
+    return total
+
+
+def _brl(value: float) -> str:
+    return f"{value:,.2f}".replace(",", " ").replace(".", ",")
+
+
+def _table_pages(installations: list, calculos: list, total: dict) -> list:
+    rows = []
+    for inputs, calculo in zip(installations, calculos):
+        result = calculo["results"]
+        rows.append([
+            str(inputs["Instalacao"]), inputs["distribuidora"], _brl(result["fatura_cativa"]),
+            _brl(result["fatura_uso"] + result["fatura_livre"][0]), _brl(result["economia_mensal"]),
+            f"{result['desconto']:.1%}".replace(".", ","), _brl(result["total_contrato"]),
+        ])
+    totals = [
+        "TOTAL", "", _brl(total["fatura_cativa"]), _brl(total["fatura_uso"] + total["fatura_livre"][0]),
+        _brl(total["economia_mensal"]), f"{total['desconto']:.1%}".replace(".", ","), _brl(total["total_contrato"]),
+    ]
+
+    pages = []
+    chunks = [rows[i:i + ROWS_PER_PAGE] for i in range(0, len(rows), ROWS_PER_PAGE)]
+    for number, chunk in enumerate(chunks, start=1):
+        title = "INSTALAÇÕES" if len(chunks) == 1 else f"INSTALAÇÕES ({number}/{len(chunks)})"
+        output_svg_path = f"{PORTFOLIO_DIR}/instalacoes {number:03d}.svg"
+        with span("page.portfolio_table"):
+            portfolio_table_plot(chunk, totals if number == len(chunks) else None, title, output_svg_path)
+        pages.append(output_svg_path)
+    return pages
+
+
+@exports_metrics
+@traced("portfolio")
+def generate_portfolio_proposal(portfolio: dict, sink=None, appendix: bool = True, progress=None,
+                                max_workers: int = MAX_WORKERS, reuse_artifact: bool = True):
+    """
+    Render one consolidated proposal for every installation of a portfolio.
+
+    Args:
+        portfolio (dict): See `normalize_portfolio`. A shared "snapshot" pins the dataset snapshot
+            (see `modules.snapshots`); the current one is used otherwise.
+        sink (OutputSink, optional): Where the PDF is written. Defaults to a new `MemorySink`.
+        appendix (bool): Add the results page of each installation after the installations table.
+        progress (callable, optional): `progress(stage, fraction)` callback used by background jobs.
+        max_workers (int): Threads pricing the installations.
+        reuse_artifact (bool): Return the stored PDF when the same portfolio was rendered today
+            (see `modules.artifact_store`), and store newly rendered PDFs.
+
+    Returns:
+        OutputSink: The sink holding the generated PDF.
+
+    Raises:
+        ValueError: If the portfolio is invalid (see `normalize_portfolio`) or its snapshot was removed.
+    """
+    logger.info("Generating portfolio proposal...")
+    if progress is None:
+        progress = lambda stage, fraction: None
+    if sink is None:
+        sink = MemorySink()
+    installations = normalize_portfolio(portfolio)
+    store = get_snapshot_store()
+    snapshot = installations[0]["snapshot"] or store.current()
+    store.path(snapshot)  # A recorded snapshot may have been removed by retention
+    store.touch(snapshot)
+    for inputs in installations:
+        inputs["snapshot"] = snapshot
+    shared = installations[0]
+    label = f"{len(installations)} instalações"
+    filename = safe_filename('Proposta_' + shared["Razao_Social"] + '_Portfolio_'
+                             + shared["produto"].replace("ç", "c") + '.pdf')
+
+    probabilities = snapshot_probabilities(snapshot)
+    first_month = contract_start_month(shared["inicio_operacional"], shared["fat_ref"])
+
+    artifact_key = None
+    if reuse_artifact:
+        with span("artifact_key"):
+            artifact_key = proposal_key({
+                "installations": [
+                    dict(inputs, consumption_history=load_history(inputs["Instalacao"]) if inputs["irrigante"] else None)
+                    for inputs in installations
+                ],
+                "appendix": appendix,
+                "snapshot": snapshot,
+                "bandeira_probabilities": probabilities,
+            })
+        with span("artifact_lookup"):
+            stored = get_artifact_store().get(artifact_key)
+        if stored is not None:
+            with sink.open(filename) as f:
+                f.write(stored)
+            return sink
+
+    progress("Calculando faturas", 0.05)
+    with span("price_portfolio"):
+        calculos = price_portfolio(installations, max_workers)
+    total = aggregate_portfolio(calculos)
+    logger.info(f"Portfolio of {label}: economia mensal {total['economia_mensal']:.2f}")
+
+    os.makedirs(PORTFOLIO_DIR, exist_ok=True)
+    progress("Gerando gráficos", 0.15)
+    with span("gerar_graficos"):
+        gerar_graficos(calculos[0]["preco"], None, None, None, total["fatura_uso"], total["fatura_cativa"],
+                       total["fatura_livre"], probabilities, faturas_bandeiras=total["faturas_bandeiras"],
+                       start_month=first_month)
+
+    progress("Montando páginas", 0.25)
+    with span("page.process_page1"):
+        process_page1(shared["Razao_Social"], label, shared["fat_ref"], output_svg_path=f"{PORTFOLIO_DIR}/page 1.svg")
+    with span("page.process_page10"):
+        process_page10(shared["agente"], output_svg_path=f"{PORTFOLIO_DIR}/page 10.svg", db_path=store.path(snapshot))
+    # The consolidated page has no single consumption history, so irrigante portfolios get the preço fixo page
+    consolidated = {"preco": calculos[0]["preco"], "tarifa": None, "impostos_bandeira": None, "results": total}
+    summary_page = fill_result_page(label, shared["produto"], any(inputs["gd"] for inputs in installations), False,
+                                    None, consolidated, output_dir=PORTFOLIO_DIR, suffix=" - consolidado")
+    table_pages = _table_pages(installations, calculos, total)
+
+    appendix_pages = []
+    if appendix:
+        for i, (inputs, calculo) in enumerate(zip(installations, calculos)):
+            progress("Montando anexos", 0.25 + 0.2 * i / len(installations))
+            result = calculo["results"]
+            with span("gerar_graficos"):
+                gerar_graficos(calculo["preco"], calculo["quantidade"], calculo["tarifa"], calculo["impostos_bandeira"],
+                               result["fatura_uso"], result["fatura_cativa"], result["fatura_livre"], probabilities,
+                               faturas_bandeiras=calculo["faturas_bandeiras"], start_month=first_month)
+            appendix_pages.append(fill_result_page(
+                inputs["IN"], inputs["produto"], inputs["gd"], inputs["irrigante"], inputs["Instalacao"], calculo,
+                output_dir=PORTFOLIO_DIR, suffix=f" - {i:03d}",
+            ))
+
+    svg_list = [
+        f"{PORTFOLIO_DIR}/page 1.svg",
+        'Proposta PPT/page 2.svg',
+        'Proposta PPT/page 3.svg',
+        summary_page,
+        *table_pages,
+        *appendix_pages,
+        'Proposta PPT/page 8.svg',
+        'Proposta PPT/page 9.svg',
+        f"{PORTFOLIO_DIR}/page 10.svg",
+    ]
+
+    rendered = sink if not reuse_artifact or isinstance(sink, MemorySink) else MemorySink()
+    with span("generate_pdf"):
+        generate_pdf(svg_list, rendered, dpi=300, filename=filename, optimize=True, image_dpi=200,
+                     progress=lambda stage, fraction: progress(stage, 0.45 + 0.5 * fraction))
+
+    if rendered.missing_pages:
+        logger.error(f"{filename} is missing {len(rendered.missing_pages)} pages; not storing it")
+    elif reuse_artifact and rendered.size:
+        get_artifact_store().put(artifact_key, rendered.getvalue())
+    if rendered is not sink and rendered.size:
+        with sink.open(filename) as f:
+            f.write(rendered.getvalue())
+        sink.missing_pages = rendered.missing_pages
+    return sink
@@ -0,0 +1,121 @@
+"""
+Streamlit-free entry point for proposal generation.
+
+Scripts, cron jobs, worker processes and the Streamlit UI all describe a
+proposal as one `inputs` dict (the keyword arguments of `generate_proposal`)
+and hand it to `render_proposal` or `build_proposal`. Nothing imported from
+here pulls in Streamlit.
+"""
+
+import json
+import logging
+from datetime import date, datetime
+
+from modules.output_sinks import MemorySink
+from modules.proposal_generator import PREVIEW_DPI, generate_preview, generate_proposal
+
+logger = logging.getLogger("Proposal_Generator")
+
+REQUIRED_INPUTS = (
+    "produto", "years", "grid_data", "icms", "paseb", "cofins", "distribuidora", "subgrupo", "modalidade",
+    "resolucao", "Razao_Social", "Instalacao", "fat_ref", "agente", "duracao_meses", "yearly_data",
+)
+
+DEFAULT_INPUTS = {
+    "gd": False,
+    "irrigante": False,
+    "bandeira": "Verde",
+    "icms_hr": 0.0,
+    "desc_irrig": 0.0,
+    "desconto": 0.0,
+    "snapshot": None,
+    "inicio_operacional": None,
+}
+
+
+def normalize_inputs(inputs: dict) -> dict:
+    """
+    Validate proposal inputs and fill in the optional ones.
+
+    Accepts the JSON spelling of the inputs: `fat_ref` and `inicio_operacional` as
+    "YYYY-MM-DD" and `yearly_data` keyed by year strings. `IN` defaults to
+    `Instalacao`, as in the UI.
+
+    Args:
+        inputs (dict): Keyword arguments of `generate_proposal`.
+
+    Returns:
+        dict: A new dict ready to be passed to `generate_proposal`.
+
+    Raises:
+        ValueError: If required inputs are missing or `yearly_data` lacks a year.
+    """
+    missing = [name for name in REQUIRED_INPUTS if name not in inputs]
+    if missing:
+        raise ValueError(f"Missing proposal inputs: {', '.join(missing)}")
+
+    normalized = dict(DEFAULT_INPUTS, **inputs)
+    normalized.setdefault("IN", normalized["Instalacao"])
+    normalized["years"] = [int(year) for year in normalized["years"]]
+    normalized["yearly_data"] = {int(year): dict(values) for year, values in normalized["yearly_data"].items()}
+    absent_years = [year for year in normalized["years"] if year not in normalized["yearly_data"]]
+    if absent_years:
+        raise ValueError(f"yearly_data has no price for {absent_years}")
+    for name in ("fat_ref", "inicio_operacional"):
+        if isinstance(normalized[name], str):
+            normalized[name] = date.fromisoformat(normalized[name])
+        elif isinstance(normalized[name], datetime):
+            normalized[name] = normalized[name].date()
+    return normalized
+
+
+def load_inputs(path: str) -> list:
+    """
+    Read proposal inputs from a JSON file.
+
+    The file holds one inputs object, a list of them, or one object per line (JSON Lines).
+
+    Returns:
+        list: The inputs dicts, not yet normalized.
+    """
+    with open(path, encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        data = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return data if isinstance(data, list) else [data]
+
+
+def render_proposal(inputs: dict, sink=None, progress=None, reuse_artifact: bool = True, record: bool = True):
+    """
+    Render a proposal into `sink`.
+
+    Args:
+        inputs (dict): Proposal inputs (see `normalize_inputs`).
+        sink (OutputSink, optional): Destination; defaults to a new `MemorySink`.
+        progress (callable, optional): `progress(stage, fraction)` callback.
+        reuse_artifact (bool): Reuse a stored PDF rendered today from identical inputs.
+        record (bool): Record the proposal in the proposals table (see `modules.proposal_store`).
+
+    Returns:
+        OutputSink: The sink holding the PDF.
+    """
+    return generate_proposal(**normalize_inputs(inputs), sink=sink, progress=progress, reuse_artifact=reuse_artifact,
+                             record=record)
+
+
+def build_proposal(inputs: dict, **kwargs) -> bytes:
+    """Render a proposal and return the PDF bytes. Keyword arguments go to `render_proposal`."""
+    sink = render_proposal(inputs, sink=MemorySink(), **kwargs)
+    return sink.getvalue()
+
+
+def render_preview(inputs: dict, dpi: int = PREVIEW_DPI, progress=None) -> list:
+    """
+    Draft preview of a proposal (see `generate_preview`).
+
+    Returns:
+        list: `(page name, PNG bytes)` tuples of the client-specific pages.
+    """
+    return generate_preview(**normalize_inputs(inputs), progress=progress, dpi=dpi)
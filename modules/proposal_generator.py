@@ -1,19 +1,33 @@
 
 from modules.calculations import (
     prepare_quantidade, prepare_impostos_bandeira, calcular_fatura_cativa,
-    calcular_fatura_uso, calcular_fatura_livre, gerar_graficos
+    calcular_fatura_uso, calcular_fatura_livre, gerar_graficos, gerar_grafico_historico
 )
-from modules.pdf_builder import process_page1, process_page4, process_page5, process_page6, process_page7, process_page10, generate_pdf, open_pdf
-from modules.data_utils import get_tariffs
+from modules.consumption_history import load_history
+from modules.pdf_builder import process_page1, process_page4, process_page5, process_page6, process_page7, process_page10, generate_pdf, svg_to_png
+from modules.data_utils import DB_PATH, get_tariffs
+from modules.snapshots import get_snapshot_store, snapshot_probabilities, snapshot_tariffs
+from modules.tracing import span, traced, exports_metrics
+from modules.output_sinks import MemorySink, safe_filename
+from modules.artifact_store import get_artifact_store, proposal_key
+from modules.proposal_store import record_proposal
 import os
-import streamlit as st
 import logging
+import sqlite3
 
 logger = logging.getLogger("Proposal_Generator")
 
+# Positions of the client-specific pages (1, 4/5/6/7 and 10) in the page list
+VARIABLE_PAGES = (0, 3, 6)
+PREVIEW_DPI = 30
+
+@exports_metrics
+@traced("proposal")
 def generate_proposal(IN, produto, years, grid_data, gd, irrigante, icms, paseb, cofins,                    
                      bandeira, icms_hr, desc_irrig, distribuidora, subgrupo, modalidade, 
-                     resolucao, desconto, Razao_Social, Instalacao, fat_ref, agente, duracao_meses):
+                     resolucao, desconto, Razao_Social, Instalacao, fat_ref, agente, duracao_meses,
+                     yearly_data=None, progress=None, sink=None, reuse_artifact=True, record=True, snapshot=None,
+                     inicio_operacional=None):
     
     """
     Generates a proposal document in PDF format based on the provided input parameters.
@@ -40,12 +54,20 @@ def generate_proposal(IN, produto, years, grid_data, gd, irrigante, icms, paseb,
         fat_ref (str): Reference billing period.
         agente (str): Agent responsible for the proposal.
         duracao_meses (int): Duration of the contract in months.
+        yearly_data (dict): {year: {"Preço": float}}, one entry per year in `years`.
+        progress (callable, optional): `progress(stage, fraction)` callback used by background jobs.
+        sink (OutputSink, optional): Where the PDF is written. Defaults to a new `MemorySink`.
+        reuse_artifact (bool): Return the stored PDF when identical inputs were rendered today
+            (see `modules.artifact_store`), and store newly rendered PDFs.
+        record (bool): Record the inputs and computed results of a newly rendered
+            proposal in the proposals table (see `modules.proposal_store`).
+        snapshot (str, optional): Id of the dataset snapshot the tariffs, flags and contacts
+            are read from (see `modules.snapshots`). Defaults to the current snapshot; the id
+            is recorded with the inputs, so the proposal renders identically later.
+        inicio_operacional (date, optional): Start of supply; its month is the first month of the
+            flag simulation. Defaults to the month of `fat_ref`.
     Returns:
-        None: The function generates a PDF file and opens it, but does not return any value.
-    Side Effects:
-        - Generates and saves a PDF file in the user's Downloads folder.
-        - Opens the generated PDF file.
-        - Prints debug information to the console.
+        OutputSink: The sink holding the generated PDF (`getvalue()` for a MemorySink, `location` otherwise).
     Notes:
         - The function calculates various invoices (captive, usage, and free market) and savings.
         - It processes different pages of the proposal based on the product type and client classification.
@@ -53,55 +75,135 @@ def generate_proposal(IN, produto, years, grid_data, gd, irrigante, icms, paseb,
     """
 
     logger.info("Generating proposal...")
-    logging.debug(f"produto: {produto}")
-    #print(f"years: {years}", flush=True)
-    #print(f"st.session_state.yearly_data: {st.session_state.yearly_data}", flush=True)
-    
-    quantidade = prepare_quantidade(grid_data)
-    logging.debug(f"quantidade: {quantidade}")
+    if progress is None:
+        progress = lambda stage, fraction: None
+    if yearly_data is None:
+        raise ValueError("yearly_data is required")
+    if sink is None:
+        sink = MemorySink()
+    filename = safe_filename('Proposta_' + Razao_Social + '_' + Instalacao + '_' + produto.replace("ç","c") + '.pdf')
+    store = get_snapshot_store()
+    if snapshot is None:
+        snapshot = store.current()
+    store.path(snapshot)  # A recorded snapshot may have been removed by retention
+    store.touch(snapshot)
 
-    impostos_bandeira = prepare_impostos_bandeira(icms, paseb, cofins, bandeira, icms_hr, desc_irrig)
-    logging.debug(f"impostos_bandeira: {impostos_bandeira}")
+    inputs = dict(
+        IN=IN, produto=produto, years=years, grid_data=grid_data, gd=gd, irrigante=irrigante, icms=icms,
+        paseb=paseb, cofins=cofins, bandeira=bandeira, icms_hr=icms_hr, desc_irrig=desc_irrig,
+        distribuidora=distribuidora, subgrupo=subgrupo, modalidade=modalidade, resolucao=resolucao,
+        desconto=desconto, Razao_Social=Razao_Social, Instalacao=Instalacao, fat_ref=fat_ref, agente=agente,
+        duracao_meses=duracao_meses, yearly_data={year: yearly_data[year] for year in years}, snapshot=snapshot,
+        inicio_operacional=inicio_operacional,
+        consumption_history=load_history(Instalacao) if irrigante else None,
+        bandeira_probabilities=snapshot_probabilities(snapshot),
+    )
+    artifact_key = None
+    if reuse_artifact or record:
+        with span("artifact_key"):
+            artifact_key = proposal_key(inputs)
+    if reuse_artifact:
+        with span("artifact_lookup"):
+            stored = get_artifact_store().get(artifact_key)
+        if stored is not None:
+            with sink.open(filename) as f:
+                f.write(stored)
+            return sink
 
-    tarifa = get_tariffs(distribuidora, subgrupo, modalidade, resolucao)
-    logging.debug(f"tarifa: {tarifa}")
-    
-    preco = {
-        "preco": [st.session_state.yearly_data[year]["Preço"] for year in years],
-        "produto": produto,
-        "anos": years,
-        "duracao_meses": duracao_meses,
-        "desconto": desconto/100
-    }
-    logging.debug(f"preco: {preco}")
+    svg_list, results = _render_pages(
+        IN, produto, years, grid_data, gd, irrigante, icms, paseb, cofins, bandeira, icms_hr, desc_irrig,
+        distribuidora, subgrupo, modalidade, resolucao, desconto, Razao_Social, Instalacao, fat_ref, agente,
+        duracao_meses, yearly_data, progress, snapshot,
+        probabilities=inputs["bandeira_probabilities"], start_month=contract_start_month(inicio_operacional, fat_ref),
+    )
 
-    # Calculate various invoices
-    fatura_cativa_dict = calcular_fatura_cativa(quantidade, tarifa, impostos_bandeira)
-    fatura_cativa = fatura_cativa_dict["Fatura Cativa s Compensação"]
+    # Render into memory when the result is also stored, then hand the bytes to the sink
+    rendered = sink if not reuse_artifact or isinstance(sink, MemorySink) else MemorySink()
+    with span("generate_pdf"):
+        generate_pdf(svg_list, rendered, dpi=300, filename=filename, optimize=True, image_dpi=200,
+                     progress=lambda stage, fraction: progress(stage, 0.45 + 0.5 * fraction))
 
-    fatura_uso_dict = calcular_fatura_uso(quantidade, tarifa, impostos_bandeira)
-    fatura_uso = fatura_uso_dict["Fatura de Uso"]
+    if rendered.missing_pages:
+        # Still hand the partial PDF to the caller, but never serve it again or record it as rendered
+        logger.error(f"{filename} is missing {len(rendered.missing_pages)} pages; not storing or recording it")
+    elif reuse_artifact and rendered.size:
+        get_artifact_store().put(artifact_key, rendered.getvalue())
+    if rendered is not sink and rendered.size:
+        with sink.open(filename) as f:
+            f.write(rendered.getvalue())
+        sink.missing_pages = rendered.missing_pages
 
-    fatura_livre_dict = calcular_fatura_livre(quantidade, preco, impostos_bandeira, fatura_uso, fatura_cativa)
-    fatura_livre = fatura_livre_dict["Fatura Livre"]
-    
+    if record and sink.size and not sink.missing_pages:
+        try:
+            with span("record_proposal"):
+                record_proposal(inputs, results, artifact_key, sink.filename, sink.location)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not record the proposal: {e}")
 
-    # Calculate savings
-    economia_mensal = fatura_cativa - fatura_uso - fatura_livre[0]
-    economia_anual = economia_mensal * 12
-    
-    total_contrato = economia_mensal * duracao_meses
+    return sink
+
+
+@traced("preview")
+def generate_preview(IN, produto, years, grid_data, gd, irrigante, icms, paseb, cofins,
+                     bandeira, icms_hr, desc_irrig, distribuidora, subgrupo, modalidade,
+                     resolucao, desconto, Razao_Social, Instalacao, fat_ref, agente, duracao_meses,
+                     yearly_data=None, progress=None, dpi=PREVIEW_DPI, snapshot=None, inicio_operacional=None):
+    """
+    Draft preview of a proposal: low-resolution thumbnails of its client-specific pages.
+
+    Runs the same calculations and page filling as `generate_proposal` but
+    rasterizes only pages 1, 4/5/6/7 and 10 at `dpi`, skipping the static pages,
+    the PDF assembly and the artifact store. Arguments are those of `generate_proposal`.
+
+    Returns:
+        list: `(page name, PNG bytes)` tuples, in page order.
+    """
+    if progress is None:
+        progress = lambda stage, fraction: None
+    if yearly_data is None:
+        raise ValueError("yearly_data is required")
+    if snapshot is None:
+        snapshot = get_snapshot_store().current()
+
+    svg_list, _ = _render_pages(
+        IN, produto, years, grid_data, gd, irrigante, icms, paseb, cofins, bandeira, icms_hr, desc_irrig,
+        distribuidora, subgrupo, modalidade, resolucao, desconto, Razao_Social, Instalacao, fat_ref, agente,
+        duracao_meses, yearly_data, progress, snapshot,
+        probabilities=snapshot_probabilities(snapshot), start_month=contract_start_month(inicio_operacional, fat_ref),
+    )
+    thumbnails = []
+    for i in VARIABLE_PAGES:
+        progress("Gerando prévia", 0.45 + 0.5 * len(thumbnails) / len(VARIABLE_PAGES))
+        name = os.path.splitext(os.path.basename(svg_list[i]))[0]
+        thumbnails.append((name, svg_to_png(svg_list[i], dpi)))
+    return thumbnails
 
-    # Debug logs
-    logger.debug(f"fatura_cativa: {fatura_cativa}")
-    logger.debug(f"fatura_uso: {fatura_uso}")
-    logger.debug(f"fatura_livre: {fatura_livre}")
-    logger.debug(f"economia_mensal: {economia_mensal}")
-    logger.debug(f"economia_anual: {economia_anual}")
-    
-    desconto = preco["desconto"] if produto == "Desconto Garantido" else economia_mensal/fatura_cativa
-    
-    
+
+def _render_pages(IN, produto, years, grid_data, gd, irrigante, icms, paseb, cofins, bandeira, icms_hr, desc_irrig,
+                  distribuidora, subgrupo, modalidade, resolucao, desconto, Razao_Social, Instalacao, fat_ref, agente,
+                  duracao_meses, yearly_data, progress, snapshot=None, probabilities=None, start_month=1) -> list:
+    """
+    Calculate the invoices, draw the charts and fill in the variable pages.
+
+    `probabilities` and `start_month` drive the flag simulation (see `gerar_graficos`).
+
+    Returns:
+        tuple: (list of the SVG pages of the proposal in order, see `VARIABLE_PAGES`;
+        dict of the computed invoices and savings, as recorded by `record_proposal`)
+    """
+    progress("Calculando faturas", 0.05)
+    logger.debug("produto: %s", produto)
+    #print(f"years: {years}", flush=True)
+    #print(f"st.session_state.yearly_data: {st.session_state.yearly_data}", flush=True)
+
+    calculo = price_proposal(produto, years, grid_data, icms, paseb, cofins, bandeira, icms_hr, desc_irrig,
+                             distribuidora, subgrupo, modalidade, resolucao, desconto, duracao_meses, yearly_data,
+                             snapshot)
+    preco, quantidade, tarifa, impostos_bandeira = (
+        calculo["preco"], calculo["quantidade"], calculo["tarifa"], calculo["impostos_bandeira"]
+    )
+    results = calculo["results"]
+    fatura_cativa, fatura_uso, fatura_livre = results["fatura_cativa"], results["fatura_uso"], results["fatura_livre"]
 
     # Create PDF from SVGs
     svg_list = [
@@ -115,39 +217,161 @@ def generate_proposal(IN, produto, years, grid_data, gd, irrigante, icms, paseb,
     ]
 
     # Generate graphics and process pages
-    gerar_graficos(preco, quantidade, tarifa, impostos_bandeira, fatura_uso, fatura_cativa, fatura_livre)
-    process_page1(Razao_Social, Instalacao, fat_ref)
-    process_page10(agente)
+    progress("Gerando gráficos", 0.15)
+    with span("gerar_graficos"):
+        simulacao = gerar_graficos(preco, quantidade, tarifa, impostos_bandeira, fatura_uso, fatura_cativa, fatura_livre,
+                                   probabilities, start_month=start_month)
+    progress("Montando páginas", 0.35)
+    with span("page.process_page1"):
+        process_page1(Razao_Social, Instalacao, fat_ref)
+    with span("page.process_page10"):
+        process_page10(agente, db_path=get_snapshot_store().path(snapshot) if snapshot else DB_PATH)
     
+    svg_list[3] = fill_result_page(IN, produto, gd, irrigante, Instalacao, calculo)
+
+    results["simulacao_bandeiras"] = simulacao
+    return svg_list, results
+
+
+def fill_result_page(IN, produto, gd, irrigante, Instalacao, calculo, output_dir="Temp_ppt", suffix="") -> str:
+    """
+    Fill in the results page of the product variant: 4 (Desconto Garantido), 5 (with GD),
+    7 (irrigante) or 6 (preço fixo), embedding the charts currently in `images/`.
+
+    Args:
+        calculo (dict): As returned by `price_proposal`.
+        output_dir (str): Directory receiving the page.
+        suffix (str): Appended to the page name, so several installations can be filled side by side.
+
+    Returns:
+        str: Path of the filled SVG page.
+    """
+    preco, tarifa, impostos_bandeira = calculo["preco"], calculo["tarifa"], calculo["impostos_bandeira"]
+    results = calculo["results"]
+    fatura_uso, fatura_livre = results["fatura_uso"], results["fatura_livre"]
+    economia_mensal, economia_anual = results["economia_mensal"], results["economia_anual"]
+    total_contrato, desconto = results["total_contrato"], results["desconto"]
+
     if(produto == "Desconto Garantido"):
         logger.debug("Desconto Garantido pdf")
         if(gd):
             logger.debug("GD variant")
             #desconto_efetivo = 0.12 #placeholder
-            fatura_cativa_c_compensacao = fatura_cativa_dict["Fatura Cativa"]
+            fatura_cativa_c_compensacao = results["fatura_cativa_c_compensacao"]
             desconto_efetivo = (fatura_cativa_c_compensacao - fatura_uso - fatura_livre[0]) / fatura_cativa_c_compensacao
 
-            process_page5(IN, economia_mensal, total_contrato, desconto, desconto_efetivo)
-            svg_list[3] = 'Temp_PPT/page 5.svg'
+            output_svg_path = f"{output_dir}/page 5{suffix}.svg"
+            with span("page.process_page5"):
+                process_page5(IN, economia_mensal, total_contrato, desconto, desconto_efetivo,
+                              output_svg_path=output_svg_path)
         else:
             logger.debug("No GD variant")
-            process_page4(IN, economia_mensal, total_contrato, desconto)
-            svg_list[3] = 'Temp_PPT/page 4.svg'
+            output_svg_path = f"{output_dir}/page 4{suffix}.svg"
+            with span("page.process_page4"):
+                process_page4(IN, economia_mensal, total_contrato, desconto, output_svg_path=output_svg_path)
 
     elif(irrigante):
             logger.debug("Irrigante variant")         
-            process_page7(IN, economia_mensal, total_contrato, desconto, economia_anual)
-            svg_list[3] = 'Tem_PPT/page 7.svg'
+            gerar_grafico_historico(Instalacao, preco, tarifa, impostos_bandeira)
+            output_svg_path = f"{output_dir}/page 7{suffix}.svg"
+            with span("page.process_page7"):
+                process_page7(IN, economia_mensal, total_contrato, desconto, economia_anual,
+                              output_svg_path=output_svg_path)
 
     else:
         logger.debug("Preco fixo Normal variant")
-        process_page6(IN, economia_mensal, total_contrato, desconto)
-        svg_list[3] = 'Temp_PPT/page 6.svg'
-  
+        output_svg_path = f"{output_dir}/page 6{suffix}.svg"
+        with span("page.process_page6"):
+            process_page6(IN, economia_mensal, total_contrato, desconto, output_svg_path=output_svg_path)
+    return output_svg_path
+
+
+def contract_start_month(inicio_operacional, fat_ref) -> int:
+    """Calendar month (1-12) the contract starts in: that of `inicio_operacional`, else of `fat_ref`."""
+    start = inicio_operacional or fat_ref
+    return start.month if hasattr(start, "month") else 1
+
+
+def price_proposal(produto, years, grid_data, icms, paseb, cofins, bandeira, icms_hr, desc_irrig,
+                   distribuidora, subgrupo, modalidade, resolucao, desconto, duracao_meses, yearly_data,
+                   snapshot=None) -> dict:
+    """
+    Calculate the invoices and savings of a proposal, without drawing or rendering anything.
+
+    Arguments are those of `generate_proposal`; without a `snapshot` the live database is read.
+
+    Returns:
+        dict: {
+            "preco", "quantidade", "tarifa", "impostos_bandeira": the calculation inputs,
+            "results": the computed invoices and savings, as recorded by `record_proposal`
+                (without "simulacao_bandeiras", which comes with the charts),
+        }
+    """
+    quantidade = prepare_quantidade(grid_data)
+    logger.debug("quantidade: %s", quantidade)
+
+    impostos_bandeira = prepare_impostos_bandeira(icms, paseb, cofins, bandeira, icms_hr, desc_irrig, snapshot)
+    logger.debug("impostos_bandeira: %s", impostos_bandeira)
+
+    with span("get_tariffs"):
+        if snapshot:
+            tarifa = snapshot_tariffs(snapshot, distribuidora, subgrupo, modalidade, resolucao)
+        else:
+            tarifa = get_tariffs(distribuidora, subgrupo, modalidade, resolucao)
+    logger.debug("tarifa: %s", tarifa)
+    
+    preco = {
+        "preco": [yearly_data[year]["Preço"] for year in years],
+        "produto": produto,
+        "anos": years,
+        "duracao_meses": duracao_meses,
+        "desconto": desconto/100
+    }
+    logger.debug("preco: %s", preco)
+
+    # Calculate various invoices
+    with span("calcular_fatura_cativa"):
+        fatura_cativa_dict = calcular_fatura_cativa(quantidade, tarifa, impostos_bandeira)
+    fatura_cativa = fatura_cativa_dict["Fatura Cativa s Compensação"]
 
+    with span("calcular_fatura_uso"):
+        fatura_uso_dict = calcular_fatura_uso(quantidade, tarifa, impostos_bandeira)
+    fatura_uso = fatura_uso_dict["Fatura de Uso"]
 
-    download_folder = os.path.join(os.path.expanduser("~"), "Downloads")
-    pdf_path = os.path.join(download_folder, 'Proposta_' + Razao_Social + '_' + Instalacao + '_' + produto.replace(" ","_").replace("ç","c") + '.pdf')
-    generate_pdf(svg_list, pdf_path, dpi=300)
+    with span("calcular_fatura_livre"):
+        fatura_livre_dict = calcular_fatura_livre(quantidade, preco, impostos_bandeira, fatura_uso, fatura_cativa)
+    fatura_livre = fatura_livre_dict["Fatura Livre"]
+    
 
-    open_pdf(pdf_path)
\ No newline at end of file
+    # Calculate savings
+    economia_mensal = fatura_cativa - fatura_uso - fatura_livre[0]
+    economia_anual = economia_mensal * 12
+    
+    total_contrato = economia_mensal * duracao_meses
+
+    # Debug logs
+    logger.debug("fatura_cativa: %s", fatura_cativa)
+    logger.debug("fatura_uso: %s", fatura_uso)
+    logger.debug("fatura_livre: %s", fatura_livre)
+    logger.debug("economia_mensal: %s", economia_mensal)
+    logger.debug("economia_anual: %s", economia_anual)
+    
+    desconto = preco["desconto"] if produto == "Desconto Garantido" else economia_mensal/fatura_cativa
+
+    results = {
+        "fatura_cativa": fatura_cativa,
+        "fatura_cativa_c_compensacao": fatura_cativa_dict["Fatura Cativa"],
+        "fatura_uso": fatura_uso,
+        "fatura_livre": list(fatura_livre),
+        "economia_mensal": economia_mensal,
+        "economia_anual": economia_anual,
+        "total_contrato": total_contrato,
+        "desconto": desconto,
+    }
+    return {
+        "preco": preco,
+        "quantidade": quantidade,
+        "tarifa": tarifa,
+        "impostos_bandeira": impostos_bandeira,
+        "results": results,
+    }
@@ -0,0 +1,225 @@
+"""
+Local store of generated proposals.
+
+Every proposal rendered by `generate_proposal` is recorded in the `proposals`
+table of `DataBase.db`, next to `ANEEL_DB`. Each row holds the inputs, the
+tariff resolution used, the computed results (invoices, savings, discount)
+and the artifact key of the PDF. Listing is indexed by agent, distribuidora
+and date and paginated. `get_proposal` returns inputs ready for
+`render_proposal`, so a proposal can be reopened or re-priced without typing
+it again.
+"""
+
+import json
+import logging
+import sqlite3
+from datetime import date, datetime
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from modules.data_utils import DB_PATH, connect_db
+
+logger = logging.getLogger("Proposal_Generator")
+
+TABLE = "proposals"
+PAGE_SIZE = 25
+
+# Inputs that are derived from other tables and never stored with the proposal
+_DERIVED_INPUTS = ("consumption_history", "bandeira_probabilities")
+
+_LIST_COLUMNS = ("id", "created_at", "agente", "distribuidora", "produto", "razao_social", "instalacao",
+                 "resolucao", "economia_mensal", "desconto")
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, default=_json_default, ensure_ascii=False)
+
+
+def _connect(db_path: str) -> sqlite3.Connection:
+    # Worker processes record concurrently into the same database
+    conn = connect_db(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+
+def _ensure_table(conn: sqlite3.Connection) -> None:
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {TABLE} (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at TEXT NOT NULL,
+            agente TEXT,
+            distribuidora TEXT,
+            subgrupo TEXT,
+            modalidade TEXT,
+            resolucao TEXT,
+            produto TEXT,
+            razao_social TEXT,
+            instalacao TEXT,
+            economia_mensal REAL,
+            desconto REAL,
+            inputs TEXT NOT NULL,
+            results TEXT NOT NULL,
+            artifact_key TEXT,
+            filename TEXT,
+            location TEXT
+        )
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_agente ON {TABLE} (agente, created_at)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_distribuidora ON {TABLE} (distribuidora, created_at)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_created_at ON {TABLE} (created_at)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{TABLE}_artifact_key ON {TABLE} (artifact_key)")
+
+
+def record_proposal(inputs: dict, results: dict, artifact_key: Optional[str] = None, filename: Optional[str] = None,
+                    location: Optional[str] = None, db_path: str = DB_PATH) -> int:
+    """
+    Record a generated proposal.
+
+    Args:
+        inputs (dict): Keyword arguments of `generate_proposal`.
+        results (dict): Computed results (see `_render_pages`).
+        artifact_key (str, optional): Key of the PDF in the artifact store.
+        filename (str, optional): File name of the PDF.
+        location (str, optional): Where the sink wrote the PDF.
+        db_path (str): Path to the SQLite database.
+
+    Returns:
+        int: Id of the new row.
+    """
+    stored_inputs = {name: value for name, value in inputs.items() if name not in _DERIVED_INPUTS}
+    conn = _connect(db_path)
+    try:
+        with conn:
+            _ensure_table(conn)
+            cursor = conn.execute(
+                f"INSERT INTO {TABLE} (created_at, agente, distribuidora, subgrupo, modalidade, resolucao, produto, "
+                "razao_social, instalacao, economia_mensal, desconto, inputs, results, artifact_key, filename, location) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    datetime.now().isoformat(timespec="seconds"), inputs.get("agente"), inputs.get("distribuidora"),
+                    inputs.get("subgrupo"), inputs.get("modalidade"), inputs.get("resolucao"), inputs.get("produto"),
+                    inputs.get("Razao_Social"), str(inputs.get("Instalacao")),
+                    float(results.get("economia_mensal", 0.0)), float(results.get("desconto", 0.0)),
+                    _dumps(stored_inputs), _dumps(results), artifact_key, filename, location,
+                ),
+            )
+        proposal_id = cursor.lastrowid
+    finally:
+        conn.close()
+    logger.info(f"Proposal {proposal_id} recorded for '{inputs.get('Razao_Social')}'")
+    return proposal_id
+
+
+def list_proposals(agente: Optional[str] = None, distribuidora: Optional[str] = None,
+                   since: Optional[date] = None, until: Optional[date] = None,
+                   page: int = 0, page_size: int = PAGE_SIZE, db_path: str = DB_PATH) -> tuple:
+    """
+    One page of recorded proposals, newest first.
+
+    Args:
+        agente (str, optional): Only proposals of this agent.
+        distribuidora (str, optional): Only proposals for this distribuidora.
+        since (date, optional): Only proposals created on or after this day.
+        until (date, optional): Only proposals created on or before this day.
+        page (int): Zero-based page number.
+        page_size (int): Rows per page.
+        db_path (str): Path to the SQLite database.
+
+    Returns:
+        tuple: (pd.DataFrame with the summary columns, total number of matching proposals)
+    """
+    conditions, params = [], []
+    if agente:
+        conditions.append("agente = ?")
+        params.append(agente)
+    if distribuidora:
+        conditions.append("distribuidora = ?")
+        params.append(distribuidora)
+    if since:
+        conditions.append("created_at >= ?")
+        params.append(since.isoformat())
+    if until:
+        # created_at holds a time as well, so compare against the start of the next day
+        conditions.append("created_at < date(?, '+1 day')")
+        params.append(until.isoformat())
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    conn = _connect(db_path)
+    try:
+        _ensure_table(conn)
+        total = conn.execute(f"SELECT COUNT(*) FROM {TABLE} {where}", params).fetchone()[0]
+        df = pd.read_sql_query(
+            f"SELECT {', '.join(_LIST_COLUMNS)} FROM {TABLE} {where} ORDER BY created_at DESC, id DESC LIMIT ? OFFSET ?",
+            conn, params=[*params, page_size, page * page_size],
+        )
+    finally:
+        conn.close()
+    return df, total
+
+
+def get_proposal(proposal_id: int, db_path: str = DB_PATH) -> Optional[dict]:
+    """
+    Load a recorded proposal.
+
+    Returns:
+        dict: The row's columns, with "inputs" (in the JSON spelling accepted by
+        `normalize_inputs`) and "results" decoded; None if there is no such proposal.
+    """
+    conn = _connect(db_path)
+    try:
+        _ensure_table(conn)
+        row = conn.execute(f"SELECT * FROM {TABLE} WHERE id = ?", (int(proposal_id),)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    proposal = dict(row)
+    proposal["inputs"] = json.loads(proposal["inputs"])
+    proposal["results"] = json.loads(proposal["results"])
+    return proposal
+
+
+def find_by_artifact(artifact_key: str, db_path: str = DB_PATH) -> Optional[int]:
+    """Id of the latest proposal recorded with `artifact_key`, or None."""
+    conn = _connect(db_path)
+    try:
+        _ensure_table(conn)
+        row = conn.execute(
+            f"SELECT id FROM {TABLE} WHERE artifact_key = ? ORDER BY id DESC LIMIT 1", (artifact_key,)
+        ).fetchone()
+    finally:
+        conn.close()
+    return row[0] if row else None
+
+
+def reprice_inputs(proposal: dict, prices: Optional[dict] = None, **overrides) -> dict:
+    """
+    Inputs of a recorded proposal with new prices (or other inputs) applied.
+
+    Args:
+        proposal (dict): As returned by `get_proposal`.
+        prices (dict, optional): {year: price} replacing the stored yearly prices.
+        **overrides: Other `generate_proposal` arguments to replace, e.g. `desconto` or `resolucao`.
+
+    Returns:
+        dict: Inputs for `render_proposal`.
+    """
+    inputs = dict(proposal["inputs"], **overrides)
+    if prices:
+        yearly_data = {str(year): dict(values) for year, values in inputs["yearly_data"].items()}
+        for year, price in prices.items():
+            yearly_data.setdefault(str(year), {})["Preço"] = float(price)
+        inputs["yearly_data"] = yearly_data
+    return inputs
@@ -0,0 +1,192 @@
+"""
+HTTP service mode for proposal rendering.
+
+Endpoints:
+    POST /proposals   JSON proposal inputs -> application/pdf
+                      (`?reuse=0` forces a fresh render)
+    GET  /healthz     pool and queue status as JSON
+    GET  /metrics     Prometheus text metrics of the service process
+
+Requests are rendered by a `ProposalWorkerPool`. At most `workers` proposals
+render at once and at most `max_queue` more wait for a worker; beyond that the
+service answers 503 with `Retry-After` instead of queueing without bound. A
+request that times out (504) keeps its slot until its render actually finishes.
+
+`/metrics` only covers the service process itself, i.e. the `http.render`
+request durations. The pipeline stages and the memoization caches run inside
+the worker processes and are not aggregated here; each worker has its own.
+Run it with `proposal serve` (see `modules.cli`).
+"""
+
+import json
+import logging
+import threading
+from concurrent.futures import TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, urlsplit, parse_qs
+
+from modules.proposal_api import normalize_inputs
+from modules.tracing import span, render_prometheus
+from modules.worker_pool import ProposalWorkerPool
+
+logger = logging.getLogger("Proposal_Generator")
+
+MAX_BODY_BYTES = 1024 * 1024
+
+
+class Backpressure:
+    """
+    Admission control in front of the worker pool.
+
+    Args:
+        capacity (int): Requests admitted at once (rendering plus waiting).
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self.rejected = 0
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self._admitted >= self.capacity:
+                self.rejected += 1
+                return False
+            self._admitted += 1
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self._admitted -= 1
+
+    @property
+    def admitted(self) -> int:
+        with self._lock:
+            return self._admitted
+
+
+class ProposalRequestHandler(BaseHTTPRequestHandler):
+    server_version = "ProposalService/1.0"
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.address_string()} - {format % args}")
+
+    def _send(self, status: int, body: bytes, content_type: str, headers: dict = None) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None) -> None:
+        self._send(status, json.dumps(payload, ensure_ascii=False).encode("utf-8"), "application/json", headers)
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        if path == "/healthz":
+            service = self.server.service
+            self._send_json(200, {
+                "status": "ok",
+                "workers": service.pool.workers,
+                "capacity": service.backpressure.capacity,
+                "admitted": service.backpressure.admitted,
+                "rejected": service.backpressure.rejected,
+            })
+        elif path == "/metrics":
+            self._send(200, render_prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path != "/proposals":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            if length < 0:
+                raise ValueError(f"invalid Content-Length: {length}")
+            if length > MAX_BODY_BYTES:
+                self._send_json(413, {"error": f"body larger than {MAX_BODY_BYTES} bytes"})
+                return
+            inputs = normalize_inputs(json.loads(self.rfile.read(length) or b"{}"))
+        except (ValueError, TypeError, AttributeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        reuse = parse_qs(url.query).get("reuse", ["1"])[0] != "0"
+
+        service = self.server.service
+        if not service.backpressure.try_acquire():
+            self._send_json(503, {"error": "too many proposals in progress, retry later"},
+                            {"Retry-After": str(service.retry_after)})
+            return
+        try:
+            future = service.pool.submit(inputs, reuse_artifact=reuse)
+        except Exception as e:
+            service.backpressure.release()
+            logger.error(f"Proposal request failed: {e}")
+            self._send_json(500, {"error": str(e)})
+            return
+        # The slot is held until the worker is done, not until this request gives up waiting
+        future.add_done_callback(lambda _: service.backpressure.release())
+        try:
+            with span("http.render"):
+                filename, data = future.result(service.timeout)
+        except FutureTimeout:
+            future.cancel()
+            self._send_json(504, {"error": f"rendering took longer than {service.timeout}s"})
+            return
+        except Exception as e:
+            logger.error(f"Proposal request failed: {e}")
+            self._send_json(500, {"error": str(e)})
+            return
+
+        self._send(200, data, "application/pdf",
+                   {"Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}"})
+
+
+class ProposalService:
+    """
+    HTTP front end of a `ProposalWorkerPool`.
+
+    Args:
+        host (str): Bind address.
+        port (int): Bind port (0 picks a free port, see `address`).
+        workers (int): Worker processes, i.e. concurrent renders.
+        max_queue (int): Requests allowed to wait for a worker before answering 503.
+        timeout (float): Seconds a request waits for its PDF before answering 504.
+        base_dir (str): Directory holding `Proposta PPT/`, `images/` and `DataBase.db`.
+        pool (ProposalWorkerPool, optional): Serve from an existing pool instead of creating one.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 8080, workers: int = 2, max_queue: int = 8,
+                 timeout: float = 120.0, base_dir: str = ".", pool: ProposalWorkerPool = None):
+        self.pool = pool or ProposalWorkerPool(workers=workers, base_dir=base_dir)
+        self.backpressure = Backpressure(self.pool.workers + max_queue)
+        self.timeout = timeout
+        self.retry_after = 5
+        self.httpd = ThreadingHTTPServer((host, port), ProposalRequestHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.service = self
+
+    @property
+    def address(self) -> tuple:
+        return self.httpd.server_address
+
+    def serve_forever(self) -> None:
+        """Start the workers, then serve until `shutdown()` (or Ctrl+C)."""
+        self.pool.start()
+        host, port = self.address[:2]
+        logger.info(f"Proposal service listening on http://{host}:{port} with {self.pool.workers} workers")
+        try:
+            self.httpd.serve_forever()
+        finally:
+            self.httpd.server_close()
+            self.pool.shutdown()
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
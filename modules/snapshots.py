@@ -0,0 +1,294 @@
+"""
+Immutable, content-addressed snapshots of the datasets a proposal reads.
+
+The updater replaces `ANEEL_DB` daily and the agents edit `Contatos_Agentes`,
+`tariff_flags` and `bandeira_history` in place. If proposals read those tables live, rendering the
+same proposal again could give different numbers. Instead, `SnapshotStore.create`
+copies `SNAPSHOT_TABLES` into a read-only SQLite file `<root>/<id>.db`, where the
+id is the hash of the tables' contents, so identical data is stored once.
+`generate_proposal` pins the current snapshot and records its id with the
+inputs. The lookups below are keyed on `(snapshot id, key)`; a snapshot never
+changes, so they are cached without expiry.
+
+Snapshots are registered in the `dataset_snapshots` table of `DataBase.db`.
+`SnapshotStore.gc` removes the ones that fall outside the retention policy.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+import pandas as pd
+
+from modules.bandeira_simulation import calibrate_probabilities
+from modules.data_utils import DB_PATH, connect_db, get_tariffs
+from modules.memoize import canonical_key, memoize
+
+logger = logging.getLogger("Proposal_Generator")
+
+SNAPSHOT_DIR = "snapshots"
+TABLE = "dataset_snapshots"
+SNAPSHOT_TABLES = ("ANEEL_DB", "tariff_flags", "Contatos_Agentes", "bandeira_history")
+
+# Small tables edited in place, compared against the current snapshot on every `current()`.
+# `ANEEL_DB` only changes through the updater, which creates a snapshot right after writing it.
+_WATCHED_TABLES = ("tariff_flags", "Contatos_Agentes", "bandeira_history")
+
+_TARIFF_INDEX = ("SigAgente", "DscSubGrupo", "DscModalidadeTarifaria", "DscREH")
+
+
+def _read_table(conn: sqlite3.Connection, table: str) -> Optional[pd.DataFrame]:
+    try:
+        return pd.read_sql_query(f'SELECT * FROM "{table}" ORDER BY rowid', conn)
+    except pd.errors.DatabaseError as e:
+        if "no such table" not in str(e):
+            raise
+        return None
+
+
+def _digest(df: Optional[pd.DataFrame]) -> Optional[str]:
+    return None if df is None else canonical_key(list(df.columns), df)
+
+
+class SnapshotStore:
+    """
+    Dataset snapshots on local disk.
+
+    Args:
+        root (str): Directory holding the snapshot files, created if missing.
+        db_path (str): Live database the snapshots are taken from and registered in.
+        keep_days (int): `gc` keeps snapshots created or pinned by a proposal within this many days.
+        keep_last (int): `gc` always keeps this many of the newest snapshots.
+    """
+
+    def __init__(self, root: str = SNAPSHOT_DIR, db_path: str = DB_PATH, keep_days: int = 90,
+                 keep_last: int = 3):
+        self.root = root
+        self.db_path = db_path
+        self.keep_days = keep_days
+        self.keep_last = keep_last
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Worker processes pin snapshots concurrently
+        conn = connect_db(self.db_path, timeout=30)
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS {TABLE} (
+                id TEXT PRIMARY KEY,
+                created_at TEXT NOT NULL,
+                activated_at TEXT NOT NULL,
+                last_used TEXT,
+                digests TEXT NOT NULL,
+                rows INTEGER NOT NULL
+            )
+        """)
+        return conn
+
+    def _file(self, snapshot_id: str) -> str:
+        return os.path.join(self.root, snapshot_id + ".db")
+
+    def path(self, snapshot_id: str) -> str:
+        """
+        Path of a snapshot's SQLite file.
+
+        Raises:
+            ValueError: If there is no such snapshot (e.g. it was garbage-collected).
+        """
+        path = self._file(snapshot_id)
+        if not os.path.exists(path):
+            raise ValueError(f"Dataset snapshot {snapshot_id} does not exist (removed by retention?)")
+        return path
+
+    def create(self) -> str:
+        """
+        Snapshot `SNAPSHOT_TABLES` of the live database and make it the current snapshot.
+
+        Data identical to an existing snapshot reuses its file.
+
+        Returns:
+            str: The snapshot id.
+        """
+        with self._lock:
+            conn = connect_db(self.db_path, timeout=30)
+            try:
+                tables = {table: _read_table(conn, table) for table in SNAPSHOT_TABLES}
+            finally:
+                conn.close()
+            digests = {table: _digest(df) for table, df in tables.items()}
+            snapshot_id = canonical_key(digests)[:16]
+            rows = sum(len(df) for df in tables.values() if df is not None)
+
+            path = self._file(snapshot_id)
+            if not os.path.exists(path):
+                self._write(path, tables)
+                logger.info(f"Dataset snapshot {snapshot_id} created ({rows} rows)")
+            else:
+                logger.info(f"Dataset snapshot {snapshot_id} already stored")
+
+            now = datetime.now().isoformat()
+            conn = self._connect()
+            try:
+                with conn:
+                    conn.execute(
+                        f"INSERT INTO {TABLE} (id, created_at, activated_at, digests, rows) VALUES (?, ?, ?, ?, ?) "
+                        "ON CONFLICT(id) DO UPDATE SET activated_at = excluded.activated_at",
+                        (snapshot_id, now, now, json.dumps(digests), rows),
+                    )
+            finally:
+                conn.close()
+            return snapshot_id
+
+    def _write(self, path: str, tables: dict) -> None:
+        """Write the snapshot file under a temporary name and move it into place, read-only."""
+        os.makedirs(self.root, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".part")
+        os.close(fd)
+        try:
+            conn = sqlite3.connect(tmp_path)
+            try:
+                for table, df in tables.items():
+                    if df is not None:
+                        df.to_sql(table, conn, index=False)
+                if tables["ANEEL_DB"] is not None:
+                    conn.execute(f"CREATE INDEX idx_tariffs ON ANEEL_DB ({', '.join(_TARIFF_INDEX)})")
+                conn.commit()
+            finally:
+                conn.close()
+            os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def current(self) -> str:
+        """
+        Id of the current snapshot.
+
+        A new snapshot is created when there is none yet, its file is missing, or
+        one of `_WATCHED_TABLES` changed since it was taken.
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                f"SELECT id, digests FROM {TABLE} ORDER BY activated_at DESC, created_at DESC LIMIT 1"
+            ).fetchone()
+            watched = {table: _digest(_read_table(conn, table)) for table in _WATCHED_TABLES}
+        finally:
+            conn.close()
+        if row is not None and os.path.exists(self._file(row[0])):
+            digests = json.loads(row[1])
+            if all(digests.get(table) == digest for table, digest in watched.items()):
+                return row[0]
+            logger.info(f"{', '.join(_WATCHED_TABLES)} changed since snapshot {row[0]}")
+        return self.create()
+
+    def touch(self, snapshot_id: str) -> None:
+        """Mark a snapshot as pinned by a proposal now, which keeps it through `gc` for `keep_days`."""
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(f"UPDATE {TABLE} SET last_used = ? WHERE id = ?",
+                             (datetime.now().isoformat(timespec="seconds"), snapshot_id))
+        finally:
+            conn.close()
+
+    def list(self) -> pd.DataFrame:
+        """The registered snapshots, newest first, with "current" marking the current one."""
+        conn = self._connect()
+        try:
+            df = pd.read_sql_query(
+                f"SELECT id, created_at, activated_at, last_used, rows FROM {TABLE} "
+                "ORDER BY activated_at DESC, created_at DESC", conn,
+            )
+        finally:
+            conn.close()
+        df["current"] = df.index == 0
+        df["stored"] = [os.path.exists(self._file(snapshot_id)) for snapshot_id in df["id"]]
+        return df
+
+    def gc(self, now: Optional[datetime] = None) -> int:
+        """
+        Remove snapshots outside the retention policy.
+
+        Keeps the current snapshot, the `keep_last` newest ones and any created or
+        pinned within `keep_days`. Unregistered snapshot files left in `root` are removed too.
+
+        Returns:
+            int: Number of snapshots removed.
+        """
+        cutoff = ((now or datetime.now()) - timedelta(days=self.keep_days)).isoformat(timespec="seconds")
+        with self._lock:
+            conn = self._connect()
+            try:
+                rows = conn.execute(
+                    f"SELECT id, activated_at, last_used FROM {TABLE} ORDER BY activated_at DESC, created_at DESC"
+                ).fetchall()
+                expired = [
+                    snapshot_id for i, (snapshot_id, activated_at, last_used) in enumerate(rows)
+                    if i >= max(1, self.keep_last) and max(activated_at, last_used or "") < cutoff
+                ]
+                with conn:
+                    conn.executemany(f"DELETE FROM {TABLE} WHERE id = ?", [(snapshot_id,) for snapshot_id in expired])
+            finally:
+                conn.close()
+
+            kept = {snapshot_id + ".db" for snapshot_id, _, _ in rows if snapshot_id not in expired}
+            removed = 0
+            if os.path.isdir(self.root):
+                for name in os.listdir(self.root):
+                    if name in kept or not name.endswith(".db"):
+                        continue
+                    try:
+                        os.remove(os.path.join(self.root, name))
+                    except OSError:
+                        continue
+                    removed += 1
+        if removed:
+            logger.info(f"Removed {removed} dataset snapshots")
+        return removed
+
+
+_store: Optional[SnapshotStore] = None
+_store_lock = threading.Lock()
+
+
+def get_snapshot_store(**kwargs) -> SnapshotStore:
+    """
+    Return the process-wide snapshot store, creating it on first use.
+
+    Keyword arguments are only applied when the store is created.
+    """
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = SnapshotStore(**kwargs)
+        return _store
+
+
+@memoize(maxsize=1024, ttl=None)
+def snapshot_tariffs(snapshot_id: str, distribuidora: str, subgrupo: str, modalidade: str, resolucao: str) -> dict:
+    """`get_tariffs` read from a snapshot."""
+    return get_tariffs(distribuidora, subgrupo, modalidade, resolucao,
+                       db_path=get_snapshot_store().path(snapshot_id))
+
+
+@memoize(maxsize=64, ttl=None)
+def snapshot_flag(snapshot_id: str, flag: str) -> float:
+    """Surcharge of `flag` (a `tariff_flags` column, matched case-insensitively) in a snapshot."""
+    conn = sqlite3.connect(get_snapshot_store().path(snapshot_id))
+    try:
+        return float(conn.execute(f'SELECT "{flag}" FROM tariff_flags').fetchone()[0])
+    finally:
+        conn.close()
+
+
+@memoize(maxsize=64, ttl=None)
+def snapshot_probabilities(snapshot_id: str) -> Optional[list]:
+    """`calibrate_probabilities` from the `bandeira_history` of a snapshot."""
+    return calibrate_probabilities(db_path=get_snapshot_store().path(snapshot_id))
@@ -0,0 +1,154 @@
+"""
+Tariff history analytics.
+
+`ANEEL_DB` keeps every homologated resolution. At ingest time,
+`build_tariff_history` condenses it into the `tariff_history` summary table.
+That table has one row per distribuidora, subgroup, modality, posto, unit and
+resolution. Each row holds the TE, TUSD and total values and their percentage
+change from the distribuidora's previous resolution. Trends and the last
+adjustment are read from the summary table through its lookup index, never by
+scanning `ANEEL_DB`.
+"""
+
+import logging
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from modules.data_utils import DB_PATH, connect_db, write_tarifas
+from modules.memoize import memoize
+
+logger = logging.getLogger("Proposal_Generator")
+
+TABLE = "tariff_history"
+
+# A tariff component: one value per resolution along each of these
+SERIES_KEYS = ["SigAgente", "DscSubGrupo", "DscModalidadeTarifaria", "NomPostoTarifario", "DscUnidadeTerciaria"]
+VALUES = ("VlrTE", "VlrTUSD", "VlrTotal")
+
+
+def compute_tariff_history(df_tarifas: pd.DataFrame) -> pd.DataFrame:
+    """
+    Per-component time series of the tariffs, with the change between consecutive resolutions.
+
+    Args:
+        df_tarifas (pd.DataFrame): Output of `preprocess_tarifas` (or the `ANEEL_DB` table).
+
+    Returns:
+        pd.DataFrame: `SERIES_KEYS`, "DscREH", "DatInicioVigencia", `VALUES`, "DscREHAnterior"
+        and the percentage changes "VarTE", "VarTUSD", "VarTotal" (NaN for the first
+        resolution or when the previous value was 0).
+    """
+    df = df_tarifas[SERIES_KEYS + ["DscREH", "DatInicioVigencia", "VlrTE", "VlrTUSD"]]
+    # One value per resolution: the first matching row, as `get_tariffs` reads it
+    df = df.drop_duplicates(SERIES_KEYS + ["DscREH"])
+    df = df.assign(DatInicioVigencia=pd.to_datetime(df["DatInicioVigencia"]))
+    df = df.sort_values(SERIES_KEYS + ["DatInicioVigencia"], kind="stable").reset_index(drop=True)
+    df["VlrTotal"] = df["VlrTE"] + df["VlrTUSD"]
+
+    previous = df.groupby(SERIES_KEYS, sort=False)[["DscREH", *VALUES]].shift()
+    df["DscREHAnterior"] = previous["DscREH"]
+    for column in VALUES:
+        before = previous[column].where(previous[column] != 0)
+        df[f"Var{column[3:]}"] = (df[column] / before - 1) * 100
+    return df.replace([np.inf, -np.inf], np.nan)
+
+
+def build_tariff_history(df_tarifas: Optional[pd.DataFrame] = None, db_path: str = DB_PATH) -> int:
+    """
+    Replace the `tariff_history` table, atomically (see `write_tarifas`).
+
+    Args:
+        df_tarifas (pd.DataFrame, optional): Tariffs just ingested; read from `ANEEL_DB` when omitted.
+        db_path (str): Path to the SQLite database.
+
+    Returns:
+        int: Number of rows written.
+    """
+    if df_tarifas is None:
+        conn = connect_db(db_path)
+        try:
+            df_tarifas = pd.read_sql_query("SELECT * FROM ANEEL_DB ORDER BY rowid", conn)
+        finally:
+            conn.close()
+    history = compute_tariff_history(df_tarifas)
+    write_tarifas(history, db_path, table=TABLE)
+    return len(history)
+
+
+def _query(query: str, params: tuple, db_path: str) -> pd.DataFrame:
+    """Run `query` on the summary table, building the table first for databases ingested before it existed."""
+    conn = connect_db(db_path)
+    try:
+        try:
+            return pd.read_sql_query(query, conn, params=params, parse_dates=["DatInicioVigencia"])
+        except pd.errors.DatabaseError as e:
+            if "no such table" not in str(e):
+                raise
+    finally:
+        conn.close()
+    logger.info(f"No {TABLE} table in {db_path}, building it from ANEEL_DB")
+    build_tariff_history(db_path=db_path)
+    return _query(query, params, db_path)
+
+
+@memoize()
+def tariff_trend(distribuidora: str, subgrupo: str, modalidade: str, db_path: str = DB_PATH) -> pd.DataFrame:
+    """
+    Every resolution of a distribuidora for `subgrupo`/`modalidade`, oldest first.
+
+    Returns:
+        pd.DataFrame: The `tariff_history` rows, one per posto, unit and resolution.
+    """
+    return _query(
+        f"SELECT * FROM {TABLE} WHERE SigAgente = ? AND DscSubGrupo = ? AND DscModalidadeTarifaria = ? "
+        "ORDER BY DatInicioVigencia",
+        (distribuidora, subgrupo, modalidade), db_path,
+    )
+
+
+@memoize()
+def last_adjustment(distribuidora: str, subgrupo: str, modalidade: str, resolucao: Optional[str] = None,
+                    db_path: str = DB_PATH) -> pd.DataFrame:
+    """
+    Change of each tariff component in one resolution against the previous one.
+
+    Args:
+        distribuidora (str): The distributor.
+        subgrupo (str): Subgroup, e.g. "A4".
+        modalidade (str): Tariff modality, e.g. "Verde".
+        resolucao (str, optional): The resolution; None takes the latest one.
+        db_path (str): Path to the SQLite database.
+
+    Returns:
+        pd.DataFrame: One row per posto and unit, with `VALUES`, "DscREHAnterior" and the "Var*"
+        percentages; empty if the resolution is unknown.
+    """
+    trend = tariff_trend(distribuidora, subgrupo, modalidade, db_path)
+    if trend.empty:
+        return trend
+    if resolucao is None:
+        resolucao = trend.iloc[-1]["DscREH"]
+    return trend[trend["DscREH"] == resolucao].reset_index(drop=True)
+
+
+def describe_adjustment(adjustment: pd.DataFrame) -> list:
+    """
+    Short Portuguese sentences for `last_adjustment`, e.g. "Energia Fora ponta subiu 4,2% no reajuste de 2024".
+
+    Returns:
+        list: One sentence per posto and unit with a known change.
+    """
+    sentences = []
+    for _, row in adjustment.iterrows():
+        change = row["VarTotal"]
+        if pd.isna(change):
+            continue
+        component = "Energia" if row["DscUnidadeTerciaria"] == "MWh" else "Demanda"
+        direction = "subiu" if change >= 0 else "caiu"
+        sentences.append(
+            f"{component} {row['NomPostoTarifario']} {direction} {abs(change):.1f}% ".replace(".", ",")
+            + f"no reajuste de {row['DatInicioVigencia'].year}"
+        )
+    return sentences
@@ -0,0 +1,332 @@
+"""
+Offline build step turning the Inkscape exports in `Proposta PPT/` into compact
+production templates.
+
+Run it after editing a template:
+
+    proposal compile-templates
+
+Every page is written to `Proposta PPT/compiled/` without editor metadata
+(`sodipodi:*`, `inkscape:*`, `<metadata>`, comments), without `<defs>` nothing
+references, and with its embedded rasters re-encoded at `image_dpi` over the page
+width. The placeholder ids filled in by `process_page*` are checked to survive
+with their text unchanged. `resolve_template` makes the pipeline read a
+compiled page for as long as it matches its source, and the source otherwise.
+"""
+
+import base64
+import json
+import logging
+import os
+import re
+import statistics
+import threading
+import time
+from io import BytesIO
+
+from lxml import etree
+from PIL import Image
+
+from modules.artifact_store import TEMPLATE_DIR
+from modules.memoize import file_digest
+
+logger = logging.getLogger("Proposal_Generator")
+
+COMPILED_DIR = os.path.join(TEMPLATE_DIR, "compiled")
+MANIFEST = "manifest.json"
+
+# Element ids whose text `process_page*` replaces (see `replace_text` calls in `modules.pdf_builder`)
+PLACEHOLDER_IDS = {
+    "page 1.svg": ("tspan4", "tspan5", "tspan6"),
+    "page 4.svg": ("tspan520-74-4-0-6", "tspan520-7", "tspan520-7-1", "tspan12", "tspan6"),
+    "page 5.svg": ("tspan520-74-4-0-6", "tspan520-7", "tspan520-7-1", "tspan1", "tspan2", "tspan6"),
+    "page 6.svg": ("tspan520-74-4-0-6", "tspan520-7", "tspan520-7-1", "tspan1", "tspan12"),
+    "page 7.svg": ("tspan520-74-4-0-6", "tspan520-7", "tspan520-7-1", "tspan5", "tspan1", "tspan12"),
+    "page 10.svg": ("tspan520-7", "tspan524", "tspan2"),
+}
+
+_EDITOR_NAMESPACES = (
+    "http://www.inkscape.org/namespaces/inkscape",
+    "http://sodipodi.sourceforge.net/DTD/sodipodi-0.dtd",
+)
+_SVG = "{http://www.w3.org/2000/svg}"
+_XLINK_HREF = "{http://www.w3.org/1999/xlink}href"
+_REFERENCE_PATTERN = re.compile(r"url\(\s*#([^)\s]+)\s*\)|^#(.+)$")
+_DATA_URI_PATTERN = re.compile(r"^data:image/(png|jpeg|jpg);base64,(.*)$", re.S)
+_UNITS_PER_INCH = {"mm": 25.4, "cm": 2.54, "in": 1.0, "pt": 72.0, "px": 96.0, "": 96.0}
+
+
+class TemplateError(ValueError):
+    """A compiled template lost a placeholder `process_page*` depends on."""
+
+
+def _is_editor_name(name: str) -> bool:
+    return name.startswith("{") and name[1:].split("}", 1)[0] in _EDITOR_NAMESPACES
+
+
+def _remove(element) -> None:
+    """Remove `element`, keeping its tail text (the templates use `xml:space="preserve"`)."""
+    parent = element.getparent()
+    if element.tail:
+        previous = element.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or "") + element.tail
+        else:
+            parent.text = (parent.text or "") + element.tail
+    parent.remove(element)
+
+
+def _strip_editor_data(root) -> None:
+    """Remove Inkscape/Sodipodi elements and attributes, `<metadata>`, comments and `-inkscape-*` style properties."""
+    for element in list(root.iter()):
+        if element.getparent() is None:
+            continue
+        if not isinstance(element.tag, str) or _is_editor_name(element.tag) or element.tag == f"{_SVG}metadata":
+            _remove(element)
+    for element in root.iter(tag=etree.Element):
+        for name in [name for name in element.attrib if _is_editor_name(name)]:
+            del element.attrib[name]
+        style = element.get("style")
+        if style and "-inkscape-" in style:
+            declarations = [d for d in style.split(";") if d.strip() and not d.strip().startswith("-inkscape-")]
+            element.set("style", ";".join(declarations))
+    etree.cleanup_namespaces(root)
+
+
+def _references(root) -> set:
+    """Ids referenced through `url(#id)` or `href="#id"` anywhere in the document."""
+    referenced = set()
+    for element in root.iter(tag=etree.Element):
+        for value in element.attrib.values():
+            if "#" not in value:
+                continue
+            for match in _REFERENCE_PATTERN.finditer(value):
+                referenced.add(match.group(1) or match.group(2))
+    return referenced
+
+
+def _remove_unused_defs(root) -> int:
+    """Drop `<defs>` children nothing references, repeating until no more can go (defs may reference each other)."""
+    removed = 0
+    while True:
+        referenced = _references(root)
+        unused = [child for defs in root.iter(f"{_SVG}defs") for child in defs
+                  if child.get("id") is not None and child.get("id") not in referenced]
+        if not unused:
+            return removed
+        for child in unused:
+            _remove(child)
+        removed += len(unused)
+
+
+def _page_width_inches(root) -> float:
+    match = re.match(r"^\s*([\d.]+)\s*([a-z]*)\s*$", root.get("width", ""))
+    if not match or match.group(2) not in _UNITS_PER_INCH:
+        return 297 / 25.4  # A4 landscape
+    return float(match.group(1)) / _UNITS_PER_INCH[match.group(2)]
+
+
+def _recompress_images(root, image_dpi: int, image_quality: int) -> tuple:
+    """
+    Re-encode embedded base64 rasters, downsampled to `image_dpi` over the page width.
+
+    As in `modules.pdf_optimizer`, the page width bounds an image's displayed
+    size, so no image drops below `image_dpi` where it is drawn. An image keeps
+    its original encoding unless the new one is smaller.
+
+    Returns:
+        tuple: (images replaced, bytes saved in the decoded rasters)
+    """
+    max_width = int(_page_width_inches(root) * image_dpi)
+    replaced = saved = 0
+    for element in root.iter(f"{_SVG}image"):
+        href_name = _XLINK_HREF if element.get(_XLINK_HREF) is not None else "href"
+        match = _DATA_URI_PATTERN.match(element.get(href_name) or "")
+        if not match:
+            continue
+        original = base64.b64decode(match.group(2))
+        try:
+            image = Image.open(BytesIO(original))
+            image.load()
+        except Exception as e:
+            logger.warning(f"Skipping unreadable embedded image {element.get('id')}: {e}")
+            continue
+        if image.width > max_width:
+            height = max(1, round(image.height * max_width / image.width))
+            image = image.resize((max_width, height), Image.LANCZOS)
+
+        buffer = BytesIO()
+        if match.group(1) in ("jpeg", "jpg") and image.mode in ("L", "RGB", "CMYK"):
+            image.save(buffer, "JPEG", quality=image_quality, optimize=True)
+            mime = "jpeg"
+        else:
+            image.save(buffer, "PNG", optimize=True)
+            mime = "png"
+        encoded = buffer.getvalue()
+        if len(encoded) >= len(original):
+            continue
+        element.set(href_name, f"data:image/{mime};base64,{base64.b64encode(encoded).decode('ascii')}")
+        replaced += 1
+        saved += len(original) - len(encoded)
+    return replaced, saved
+
+
+def _verify_placeholders(name: str, source_root, compiled_root) -> list:
+    """
+    Check that every placeholder id of page `name` kept its text.
+
+    Returns:
+        list: Placeholder ids absent from the source itself (those `replace_text` calls are no-ops).
+
+    Raises:
+        TemplateError: If a placeholder present in the source is missing or changed in the compiled page.
+    """
+    absent = []
+    for element_id in PLACEHOLDER_IDS.get(name, ()):
+        source = source_root.find(f".//*[@id='{element_id}']")
+        if source is None:
+            absent.append(element_id)
+            continue
+        compiled = compiled_root.find(f".//*[@id='{element_id}']")
+        if compiled is None or compiled.text != source.text:
+            raise TemplateError(f"{name}: placeholder '{element_id}' was not preserved")
+    return absent
+
+
+def _parse_seconds(path: str, repeat: int = 3) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        etree.parse(path)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def compile_template(source_path: str, target_path: str, image_dpi: int = 200, image_quality: int = 85) -> dict:
+    """
+    Compile one template page.
+
+    Args:
+        source_path (str): Inkscape SVG.
+        target_path (str): Compiled SVG to write.
+        image_dpi (int): Raster resolution over the page width.
+        image_quality (int): JPEG quality of re-encoded JPEG rasters.
+
+    Returns:
+        dict: Report with sizes, parse times, images re-encoded, defs removed and absent placeholders.
+
+    Raises:
+        TemplateError: If a placeholder would be lost; nothing is written then.
+    """
+    name = os.path.basename(source_path)
+    source_root = etree.parse(source_path).getroot()
+    tree = etree.parse(source_path)
+    root = tree.getroot()
+
+    _strip_editor_data(root)
+    defs_removed = _remove_unused_defs(root)
+    images, image_bytes_saved = _recompress_images(root, image_dpi, image_quality)
+    absent = _verify_placeholders(name, source_root, root)
+
+    os.makedirs(os.path.dirname(target_path) or ".", exist_ok=True)
+    tmp_path = target_path + ".part"
+    tree.write(tmp_path, xml_declaration=True, encoding="utf-8")
+    os.replace(tmp_path, target_path)
+
+    report = {
+        "source_sha256": file_digest(source_path),
+        "size_before": os.path.getsize(source_path),
+        "size_after": os.path.getsize(target_path),
+        "parse_before_ms": _parse_seconds(source_path) * 1000,
+        "parse_after_ms": _parse_seconds(target_path) * 1000,
+        "images_recompressed": images,
+        "image_bytes_saved": image_bytes_saved,
+        "defs_removed": defs_removed,
+        "absent_placeholders": absent,
+    }
+    for element_id in absent:
+        logger.warning(f"{name}: placeholder '{element_id}' does not exist in the source template")
+    logger.info(f"Compiled '{source_path}': {report['size_before'] / 1024:.0f} KiB -> {report['size_after'] / 1024:.0f} KiB")
+    return report
+
+
+def compile_templates(source_dir: str = TEMPLATE_DIR, target_dir: str = COMPILED_DIR, image_dpi: int = 200,
+                      image_quality: int = 85) -> dict:
+    """
+    Compile every `.svg` page of `source_dir` into `target_dir` and write its manifest.
+
+    Returns:
+        dict: Per-page reports (see `compile_template`), keyed by file name.
+    """
+    reports = {}
+    for name in sorted(os.listdir(source_dir)):
+        if name.endswith(".svg"):
+            reports[name] = compile_template(os.path.join(source_dir, name), os.path.join(target_dir, name),
+                                             image_dpi=image_dpi, image_quality=image_quality)
+    with open(os.path.join(target_dir, MANIFEST), "w", encoding="utf-8") as f:
+        json.dump(reports, f, indent=2)
+    with _manifest_lock:
+        _manifests.clear()
+    return reports
+
+
+def format_report(reports: dict) -> str:
+    """Render `compile_templates` reports as a text table."""
+    lines = [f"{'template':<14}{'before':>10}{'after':>10}{'saved':>8}{'parse before':>15}{'parse after':>14}{'images':>8}"]
+    total_before = total_after = 0
+    for name, report in reports.items():
+        total_before += report["size_before"]
+        total_after += report["size_after"]
+        saved = 1 - report["size_after"] / report["size_before"]
+        lines.append(
+            f"{name:<14}{report['size_before'] / 1024:>7.0f}KiB{report['size_after'] / 1024:>7.0f}KiB{saved:>8.0%}"
+            f"{report['parse_before_ms']:>13.1f}ms{report['parse_after_ms']:>12.1f}ms{report['images_recompressed']:>8}"
+        )
+    if total_before:
+        lines.append(f"{'total':<14}{total_before / 1024:>7.0f}KiB{total_after / 1024:>7.0f}KiB"
+                     f"{1 - total_after / total_before:>8.0%}")
+    return "\n".join(lines)
+
+
+_manifests = {}
+_manifest_lock = threading.Lock()
+
+
+def _load_manifest(compiled_dir: str) -> dict:
+    """Read a compiled directory's manifest, cached per mtime."""
+    path = os.path.join(compiled_dir, MANIFEST)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}
+    with _manifest_lock:
+        cached = _manifests.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    try:
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable template manifest '{path}': {e}")
+        manifest = {}
+    with _manifest_lock:
+        _manifests[path] = (mtime, manifest)
+    return manifest
+
+
+def resolve_template(path: str) -> str:
+    """
+    Return the compiled counterpart of template `path` when one is up to date, else `path`.
+
+    A compiled page is used only if the manifest records the current digest of
+    its source, so an edited template is never shadowed by a stale build.
+    """
+    directory, name = os.path.split(path)
+    compiled_dir = os.path.join(directory, "compiled")
+    entry = _load_manifest(compiled_dir).get(name)
+    if entry is None:
+        return path
+    compiled = os.path.join(compiled_dir, name)
+    if os.path.exists(compiled) and entry.get("source_sha256") == file_digest(path):
+        return compiled
+    return path
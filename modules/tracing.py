@@ -0,0 +1,210 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Optional
+
+from modules.memoize import cache_stats, render_prometheus as render_cache_prometheus
+
+logger = logging.getLogger("Proposal_Generator")
+
+# Histogram buckets in seconds, from quick lookups up to full 300 dpi renders
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Absolute, so worker processes rendering inside a temporary workspace still write here
+METRICS_DIR = os.path.abspath("logs")
+
+_lock = threading.Lock()
+_stages = {}
+_current_span: ContextVar[Optional[str]] = ContextVar("current_span", default=None)
+
+
+def _record(stage: str, duration: float, status: str) -> None:
+    with _lock:
+        stats = _stages.get(stage)
+        if stats is None:
+            stats = _stages[stage] = {"count": 0, "errors": 0, "sum": 0.0, "max": 0.0, "buckets": [0] * len(BUCKETS)}
+        stats["count"] += 1
+        stats["sum"] += duration
+        stats["max"] = max(stats["max"], duration)
+        if status != "ok":
+            stats["errors"] += 1
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                stats["buckets"][i] += 1
+
+
+@contextmanager
+def span(stage: str, **attributes):
+    """
+    Time a block of code as a pipeline stage.
+
+    Each span is recorded in the process-wide stage histograms and emitted as a
+    structured (JSON) debug record with its duration, status and parent span.
+
+    Args:
+        stage (str): Stage name, e.g. "get_tariffs" or "page.process_page6".
+        **attributes: Extra fields added to the structured log record.
+
+    Example:
+        with span("svg_to_pdf_stream", page="page 2.svg"):
+            ...
+    """
+    parent = _current_span.get()
+    token = _current_span.set(stage)
+    status = "ok"
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _current_span.reset(token)
+        _record(stage, duration, status)
+        if logger.isEnabledFor(logging.DEBUG):
+            record = {"stage": stage, "parent": parent, "duration_ms": round(duration * 1000, 3), "status": status}
+            record.update(attributes)
+            logger.debug("span %s", stage, extra={"event": "span", "span": record})
+
+
+def traced(stage: Optional[str] = None):
+    """Decorator form of `span`; the stage defaults to the function name."""
+    def decorator(func):
+        name = stage or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _quantile(stats: dict, q: float) -> float:
+    """Estimate a quantile from the histogram buckets (upper bound of the matching bucket)."""
+    target = q * stats["count"]
+    for bound, count in zip(BUCKETS, stats["buckets"]):
+        if count >= target:
+            return min(bound, stats["max"])
+    return stats["max"]
+
+
+def stage_stats() -> dict:
+    """
+    Return a snapshot of per-stage timings.
+
+    Returns:
+        dict: {stage: {"count", "errors", "total_s", "mean_s", "p50_s", "p95_s", "max_s"}}
+    """
+    with _lock:
+        snapshot = {stage: dict(stats, buckets=list(stats["buckets"])) for stage, stats in _stages.items()}
+    return {
+        stage: {
+            "count": stats["count"],
+            "errors": stats["errors"],
+            "total_s": stats["sum"],
+            "mean_s": stats["sum"] / stats["count"],
+            "p50_s": _quantile(stats, 0.50),
+            "p95_s": _quantile(stats, 0.95),
+            "max_s": stats["max"],
+        }
+        for stage, stats in snapshot.items()
+    }
+
+
+def reset_stats() -> None:
+    """Clear all recorded stages."""
+    with _lock:
+        _stages.clear()
+
+
+def render_prometheus() -> str:
+    """Render the stage histograms in the Prometheus text exposition format."""
+    with _lock:
+        snapshot = {stage: dict(stats, buckets=list(stats["buckets"])) for stage, stats in _stages.items()}
+
+    lines = [
+        "# HELP proposal_stage_duration_seconds Duration of proposal pipeline stages.",
+        "# TYPE proposal_stage_duration_seconds histogram",
+    ]
+    for stage in sorted(snapshot):
+        stats = snapshot[stage]
+        for bound, count in zip(BUCKETS, stats["buckets"]):
+            lines.append(f'proposal_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'proposal_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {stats["count"]}')
+        lines.append(f'proposal_stage_duration_seconds_sum{{stage="{stage}"}} {stats["sum"]:.6f}')
+        lines.append(f'proposal_stage_duration_seconds_count{{stage="{stage}"}} {stats["count"]}')
+
+    lines.append("# HELP proposal_stage_errors_total Stages that raised an exception.")
+    lines.append("# TYPE proposal_stage_errors_total counter")
+    for stage in sorted(snapshot):
+        lines.append(f'proposal_stage_errors_total{{stage="{stage}"}} {snapshot[stage]["errors"]}')
+    return "\n".join(lines) + "\n"
+
+
+def set_metrics_dir(directory: str) -> None:
+    """Write this process's metrics file into `directory` from now on."""
+    global METRICS_DIR
+    METRICS_DIR = os.path.abspath(directory)
+
+
+def metrics_path() -> str:
+    """
+    Path of this process's Prometheus metrics file.
+
+    Each process (the Streamlit app, the service, every pool worker) keeps its
+    own histograms, so each writes `proposal_metrics-<pid>.prom` instead of
+    overwriting a shared file; the textfile collector picks them all up.
+    """
+    return os.path.join(METRICS_DIR, f"proposal_metrics-{os.getpid()}.prom")
+
+
+def write_prometheus(path: Optional[str] = None) -> None:
+    """
+    Write the Prometheus text metrics to `path` (e.g. for node_exporter's textfile collector).
+
+    The file is written to a temporary name and renamed, so scrapers never read a partial file.
+
+    Args:
+        path (str, optional): Target file; defaults to `metrics_path()`.
+    """
+    path = path or metrics_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render_prometheus())
+        f.write(render_cache_prometheus())
+    os.replace(tmp_path, path)
+
+
+def remove_metrics_file() -> None:
+    """Delete this process's metrics file, e.g. when a recycled worker exits."""
+    try:
+        os.remove(metrics_path())
+    except FileNotFoundError:
+        pass
+
+
+def log_stage_stats() -> None:
+    """Emit the current per-stage counts and durations, and the cache counters, as one structured INFO record."""
+    logger.info("stage_stats", extra={"event": "stage_stats", "stages": stage_stats(), "caches": cache_stats()})
+
+
+def exports_metrics(func):
+    """Decorator that logs the stage stats and refreshes the Prometheus file after each call."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            log_stage_stats()
+            try:
+                write_prometheus()
+            except OSError as e:
+                logger.warning(f"Could not write metrics file: {e}")
+    return wrapper
@@ -1,5 +1,11 @@
 import streamlit as st
 import pandas as pd
+from modules.jobs import get_job_manager, ACTIVE_STATES, DONE, FAILED, CANCELLED
+from modules.consumption_history import import_history, load_history, store_history
+from modules.proposal_store import PAGE_SIZE, get_proposal, list_proposals, reprice_inputs
+from modules.artifact_store import get_artifact_store
+from modules.snapshots import get_snapshot_store
+from modules.tariff_history import describe_adjustment, last_adjustment, tariff_trend
 
 def render_logos():
     """Render the logo section at the top of the page."""
@@ -175,28 +181,62 @@ def render_yearly_prices(produto, years):
             st.write([st.session_state.yearly_data[year]["Preço"] for year in st.session_state.yearly_data if year in years])
 
 
-def render_consumption_history():
-    """Render the consumption history section."""
+def render_consumption_history(instalacao):
+    """Render the consumption history section: file import, manual editing and the stored months of `instalacao`."""
     st.markdown("### Histórico de Consumo")
-    with st.expander("Editar Histórico de Consumo", expanded=False):
-        # Display the editable table
-        edited_df = st.data_editor(
-            st.session_state.consumption_history,
-            num_rows="dynamic",  # Allow adding/removing rows
-            column_config={
-                "Month/Year": st.column_config.TextColumn("Mês/Ano", width="medium"),
-                "Demanda Ponta": st.column_config.NumberColumn("Demanda Ponta", min_value=0.0, format="%.1f"),
-                "Demanda Fora Ponta": st.column_config.NumberColumn("Demanda Fora Ponta", min_value=0.0, format="%.1f"),
-                "Demanda Horário Reservado": st.column_config.NumberColumn("Demanda Horário Reservado", min_value=0.0, format="%.1f"),
-                "Energia Ponta": st.column_config.NumberColumn("Energia Ponta", min_value=0.0, format="%.1f"),
-                "Energia Fora Ponta": st.column_config.NumberColumn("Energia Fora Ponta", min_value=0.0, format="%.1f"),
-            },
-            use_container_width=True,
-            key="consumption_editor"
+
+    # The editor shows the stored history of the current installation
+    if st.session_state.get("history_instalacao") != instalacao:
+        stored = load_history(instalacao) if instalacao else pd.DataFrame()
+        if not stored.empty:
+            st.session_state.consumption_history = stored
+        st.session_state.history_instalacao = instalacao
+
+    with st.expander("Importar Histórico (CSV / Excel)", expanded=False):
+        uploads = st.file_uploader(
+            "Arquivos exportados da distribuidora", type=["csv", "xlsx"], accept_multiple_files=True,
+            key="history_uploads"
         )
-        if st.button("Salvar Histórico", key="save_history"):
-            st.session_state.consumption_history = edited_df
-            st.success("Histórico de consumo salvo com sucesso!")
+        if uploads and st.button("Importar", key="import_history"):
+            for upload in uploads:
+                try:
+                    report = import_history(upload, upload.name)
+                except Exception as e:
+                    st.error(f"{upload.name}: {e}")
+                    continue
+                st.success(
+                    f"{upload.name}: {report['rows_imported']} meses importados para "
+                    f"{report['installations']} instalações ({report['rows_rejected']} linhas rejeitadas)"
+                )
+                for error in report["errors"]:
+                    st.caption(error)
+            st.session_state.history_instalacao = None  # Reload the stored history on the next run
+
+    with st.expander("Editar Histórico de Consumo", expanded=False):
+        # A form so that editing cells does not rerun the whole page
+        with st.form("consumption_history_form", border=False):
+            edited_df = st.data_editor(
+                st.session_state.consumption_history,
+                num_rows="dynamic",  # Allow adding/removing rows
+                column_config={
+                    "Month/Year": st.column_config.TextColumn("Mês/Ano", width="medium"),
+                    "Demanda Ponta": st.column_config.NumberColumn("Demanda Ponta", min_value=0.0, format="%.1f"),
+                    "Demanda Fora Ponta": st.column_config.NumberColumn("Demanda Fora Ponta", min_value=0.0, format="%.1f"),
+                    "Demanda Horário Reservado": st.column_config.NumberColumn("Demanda Horário Reservado", min_value=0.0, format="%.1f"),
+                    "Energia Ponta": st.column_config.NumberColumn("Energia Ponta", min_value=0.0, format="%.1f"),
+                    "Energia Fora Ponta": st.column_config.NumberColumn("Energia Fora Ponta", min_value=0.0, format="%.1f"),
+                    "Energia Horário Reservado": st.column_config.NumberColumn("Energia Horário Reservado", min_value=0.0, format="%.1f"),
+                },
+                use_container_width=True,
+                key="consumption_editor"
+            )
+            if st.form_submit_button("Salvar Histórico"):
+                st.session_state.consumption_history = edited_df
+                if instalacao:
+                    stored = store_history(instalacao, edited_df)
+                    st.success(f"Histórico de consumo salvo com sucesso! ({stored} meses)")
+                else:
+                    st.warning("Informe a instalação para salvar o histórico.")
 
     # Display the saved consumption history (optional, for debugging)
     if not st.session_state.consumption_history.empty and st.checkbox("Mostrar Histórico de Consumo"):
@@ -204,6 +244,250 @@ def render_consumption_history():
         st.dataframe(st.session_state.consumption_history)
 
 
+def render_portfolio(irrigante, gd, shared_inputs, submit_job):
+    """
+    Render the consolidated proposal section of a grupo econômico.
+
+    Each row of the editor is one installation with its own load profile; every
+    other input comes from the form (`shared_inputs()`, the keyword arguments of
+    `generate_proposal`). `submit_job(portfolio, appendix)` queues the render and
+    returns the id of the background job.
+    """
+    st.markdown("### Proposta Consolidada (Grupo Econômico)")
+    columns = ["Demanda - Ponta", "Demanda - Fora Ponta", "Demanda s/ ICMS - Ponta", "Demanda s/ ICMS - Fora Ponta",
+               "Energia Ativa - Ponta", "Energia Ativa - Fora Ponta"]
+    if irrigante:
+        columns += ["Demanda - Horário Reservado", "Demanda s/ ICMS - Horário Reservado",
+                    "Energia Ativa - Horário Reservado"]
+    if gd:
+        columns += ["Energia Compensada - Ponta", "Energia Compensada - Fora Ponta"]
+    installations = st.session_state.get("portfolio_installations")
+    if installations is None or list(installations.columns) != ["Instalação"] + columns:
+        installations = pd.DataFrame([[""] + [0.0] * len(columns)], columns=["Instalação"] + columns)
+
+    with st.expander("Instalações do Grupo", expanded=False):
+        st.caption("Uma linha por instalação; linhas copiadas de uma planilha podem ser coladas na tabela.")
+        with st.form("portfolio_form", border=False):
+            edited_df = st.data_editor(
+                installations,
+                num_rows="dynamic",
+                column_config={
+                    "Instalação": st.column_config.TextColumn("Instalação", width="medium"),
+                    **{column: st.column_config.NumberColumn(column, min_value=0.0, format="%.1f") for column in columns},
+                },
+                use_container_width=True,
+                key="portfolio_editor"
+            )
+            appendix = st.checkbox("Incluir uma página por instalação (anexo)", value=True)
+            if st.form_submit_button("Gerar Proposta Consolidada"):
+                st.session_state.portfolio_installations = edited_df
+                rows = edited_df[edited_df["Instalação"].fillna("").astype(str).str.strip() != ""]
+                if rows.empty:
+                    st.warning("Informe ao menos uma instalação.")
+                    return
+                portfolio = {name: value for name, value in shared_inputs().items()
+                             if name not in ("IN", "Instalacao", "grid_data")}
+                portfolio["installations"] = [
+                    {
+                        "Instalacao": str(row["Instalação"]).strip(),
+                        "grid_data": {column: float(row[column] or 0.0) for column in columns},
+                    }
+                    for _, row in rows.iterrows()
+                ]
+                st.session_state.proposal_job_id = submit_job(portfolio, appendix)
+                st.rerun()
+
+
+def render_proposal_job():
+    """
+    Show the session's proposal job: progress and cancel button while running, download button when done.
+
+    The status is polled every second only while the job is queued or running.
+    """
+    job_id = st.session_state.get("proposal_job_id")
+    job = get_job_manager().get(job_id) if job_id is not None else None
+    polling = job is not None and job["state"] in ACTIVE_STATES
+    st.fragment(_proposal_job_status, run_every=1.0 if polling else None)(polling)
+
+
+def _proposal_job_status(polling: bool):
+    job_id = st.session_state.get("proposal_job_id")
+    if job_id is None:
+        return
+
+    job = get_job_manager().get(job_id)
+    if job is None:
+        st.session_state.proposal_job_id = None
+        return
+
+    if job["state"] in ACTIVE_STATES:
+        st.progress(job["progress"], text=job["stage"])
+        if st.button("Cancelar", key="cancel_proposal"):
+            get_job_manager().cancel(job_id)
+    elif polling:
+        # The job just finished: rerun the app so the status stops polling
+        st.rerun()
+    elif job["state"] == DONE and job["result_expired"]:
+        st.info("O PDF gerado não está mais disponível; gere a proposta novamente.")
+    elif job["state"] == DONE:
+        sink = job["result"]
+        st.download_button(
+            "Baixar Proposta", data=sink.getvalue(), file_name=sink.filename,
+            mime="application/pdf", key=f"download_{job_id}"
+        )
+    elif job["state"] == FAILED:
+        st.error(f"Erro ao gerar a proposta: {job['error']}")
+    elif job["state"] == CANCELLED:
+        st.warning("Geração da proposta cancelada.")
+
+
+def render_proposal_history(Agentes=None, Distribuidoras=None, submit_job=None):
+    """
+    Render the list of recorded proposals with filters and pagination.
+
+    A selected proposal can be downloaded again from the artifact store, or
+    re-priced: its stored inputs are rendered with the new yearly prices by
+    `submit_job(inputs)`, which returns the id of the background job. Re-pricing
+    uses the proposal's dataset snapshot, or the current data when asked to or
+    when retention has removed the snapshot.
+    """
+    st.markdown("### Propostas Geradas")
+    with st.expander("Consultar Propostas", expanded=False):
+        col1, col2, col3, col4 = st.columns([2, 2, 1, 1])
+        with col1:
+            agente = st.selectbox("Agente", options=["Todos"] + list(Agentes or []), key="history_agente")
+        with col2:
+            distribuidora = st.selectbox("Distribuidora", options=["Todas"] + list(Distribuidoras or []),
+                                         key="history_distribuidora")
+        with col3:
+            since = st.date_input("De", value=None, format="DD/MM/YYYY", key="history_since")
+        with col4:
+            until = st.date_input("Até", value=None, format="DD/MM/YYYY", key="history_until")
+
+        page = st.session_state.get("proposals_page", 0)
+        df, total = list_proposals(
+            agente=None if agente == "Todos" else agente,
+            distribuidora=None if distribuidora == "Todas" else distribuidora,
+            since=since, until=until, page=page,
+        )
+        pages = max(1, -(-total // PAGE_SIZE))
+        if page >= pages:
+            st.session_state.proposals_page = page = 0
+            st.rerun()
+        if df.empty:
+            st.info("Nenhuma proposta encontrada.")
+            return
+
+        st.dataframe(df, hide_index=True, use_container_width=True)
+        prev_col, info_col, next_col = st.columns([1, 4, 1])
+        if prev_col.button("Anterior", disabled=page == 0, key="proposals_prev"):
+            st.session_state.proposals_page = page - 1
+            st.rerun()
+        info_col.caption(f"Página {page + 1} de {pages} ({total} propostas)")
+        if next_col.button("Próxima", disabled=page + 1 >= pages, key="proposals_next"):
+            st.session_state.proposals_page = page + 1
+            st.rerun()
+
+        proposal_id = st.selectbox("Proposta", options=list(df["id"]), key="history_proposal",
+                                   format_func=lambda i: f"#{i} - {df.loc[df['id'] == i, 'razao_social'].iloc[0]}")
+        proposal = get_proposal(proposal_id)
+        if proposal is None:
+            return
+
+        results = proposal["results"]
+        col1, col2, col3 = st.columns(3)
+        col1.metric("Economia Mensal", f"R$ {results['economia_mensal']:,.2f}")
+        col2.metric("Total do Contrato", f"R$ {results['total_contrato']:,.2f}")
+        col3.metric("Desconto", f"{results['desconto'] * 100:.1f}%")
+
+        stored = get_artifact_store().get(proposal["artifact_key"]) if proposal["artifact_key"] else None
+        if stored is not None:
+            st.download_button("Baixar PDF", data=stored, file_name=proposal["filename"], mime="application/pdf",
+                               key=f"download_stored_{proposal_id}")
+        else:
+            st.caption("O PDF desta proposta não está mais armazenado; reprecifique para gerá-lo novamente.")
+
+        snapshot = proposal["inputs"].get("snapshot")
+        snapshot_stored = True
+        if snapshot:
+            try:
+                get_snapshot_store().path(snapshot)
+            except ValueError:
+                snapshot_stored = False
+                st.warning("Os dados usados nesta proposta (tarifas, bandeiras e contatos) não estão mais "
+                           "armazenados; a reprecificação usará os dados atuais.")
+
+        # Re-price: the stored inputs with new yearly prices, no re-typing
+        with st.form(f"reprice_{proposal_id}", border=False):
+            yearly_data = proposal["inputs"]["yearly_data"]
+            price_cols = st.columns(len(yearly_data))
+            prices = {
+                year: col.number_input(str(year), value=float(values["Preço"]), format="%.2f")
+                for col, (year, values) in zip(price_cols, yearly_data.items())
+            }
+            current_data = st.checkbox("Usar dados atuais", value=not snapshot_stored, disabled=not snapshot_stored,
+                                       help="Reprecificar com as tarifas, bandeiras e contatos de hoje em vez "
+                                            "dos dados usados na proposta original")
+            if st.form_submit_button("Reprecificar") and submit_job is not None:
+                # Recorded proposals are priced with the dataset snapshot they pinned, unless asked otherwise
+                overrides = {"snapshot": None} if current_data or not snapshot_stored else {}
+                st.session_state.proposal_job_id = submit_job(reprice_inputs(proposal, prices, **overrides))
+                st.rerun()
+
+
+def render_preview_thumbnails(thumbnails):
+    """Show the draft preview thumbnails (`(page name, PNG bytes)` tuples) side by side."""
+    if not thumbnails:
+        return
+    st.caption("Prévia em baixa resolução. Gere a proposta final para obter o PDF.")
+    for col, (name, png) in zip(st.columns(len(thumbnails)), thumbnails):
+        col.image(png, caption=name, use_container_width=True)
+
+
+def render_tariff_adjustment(distribuidora, subgrupo, modalidade, resolucao):
+    """Show how the selected resolution changed the tariffs, and the distribuidora's tariff history."""
+    if not (distribuidora and subgrupo and modalidade):
+        return
+    adjustment = last_adjustment(distribuidora, subgrupo, modalidade, resolucao or None)
+    sentences = describe_adjustment(adjustment)
+    if sentences:
+        st.caption(" · ".join(sentences))
+    with st.expander("Histórico de Tarifas", expanded=False):
+        trend = tariff_trend(distribuidora, subgrupo, modalidade)
+        if trend.empty:
+            st.info("Nenhuma tarifa encontrada para o subgrupo e a modalidade selecionados.")
+            return
+        series = trend.assign(Componente=trend["NomPostoTarifario"] + " (" + trend["DscUnidadeTerciaria"] + ")")
+        st.line_chart(series.pivot_table(index="DatInicioVigencia", columns="Componente", values="VlrTotal"))
+        st.dataframe(
+            series[["DatInicioVigencia", "DscREH", "Componente", "VlrTE", "VlrTUSD", "VlrTotal", "VarTotal"]]
+            .sort_values("DatInicioVigencia", ascending=False),
+            hide_index=True, use_container_width=True,
+            column_config={"VarTotal": st.column_config.NumberColumn("Variação (%)", format="%.1f%%")},
+        )
+
+
+def render_distribuidora_comparison(ranking, distribuidora=None):
+    """Show the cross-distribuidora ranking (see `compare_distribuidoras`), highlighting the selected distribuidora."""
+    if ranking is None:
+        return
+    st.markdown("#### Comparação entre Distribuidoras")
+    if ranking.empty:
+        st.info("Nenhuma tarifa encontrada para o subgrupo e a modalidade selecionados.")
+        return
+    if distribuidora in set(ranking["Distribuidora"]):
+        position = ranking.index[ranking["Distribuidora"] == distribuidora][0] + 1
+        st.caption(f"{distribuidora} está em {position}º de {len(ranking)} distribuidoras.")
+    money = st.column_config.NumberColumn(format="R$ %.2f")
+    st.dataframe(
+        ranking, hide_index=True, use_container_width=True,
+        column_config={
+            "Fatura Cativa": money, "Fatura de Uso": money, "Fatura Livre": money, "Economia Mensal": money,
+            "Economia (%)": st.column_config.NumberColumn(format="%.1f%%"),
+        },
+    )
+
+
 def apply_css_spacing():
     # Inject CSS to reduce vertical spacing
     st.markdown("""
@@ -0,0 +1,228 @@
+import threading
+import time
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor, Future
+from datetime import datetime, date, timedelta
+from io import BytesIO
+from typing import Optional
+
+import pandas as pd
+import requests
+
+from modules.data_utils import DB_PATH, preprocess_tarifas, read_last_updated, write_last_updated, write_tarifas
+from modules.tariff_history import build_tariff_history
+from modules.memoize import clear_caches
+from modules.snapshots import get_snapshot_store
+
+logger = logging.getLogger("Proposal_Generator")
+
+ANEEL_TARIFAS_URL = "https://dadosabertos.aneel.gov.br/dataset/5a583f3e-1646-4f67-bf0f-69db4203e89e/resource/fcf2906c-7c32-4b9b-a637-054e7a5234f4/download/tarifas-homologadas-distribuidoras-energia-eletrica.csv"
+
+# Update states exposed through TariffUpdateService.status()
+IDLE = "idle"
+RUNNING = "running"
+RETRYING = "retrying"
+UP_TO_DATE = "up_to_date"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class TariffUpdateService:
+    """
+    Process-wide updater for the `ANEEL_DB` table.
+
+    A single worker thread performs the download, so concurrent Streamlit sessions
+    calling `start()` share the same run instead of spawning their own downloads.
+    The UI polls `status()`, which never blocks on the download.
+
+    Args:
+        db_path (str): Path to the SQLite database.
+        url (str): CSV endpoint to download from (point it to a local HTTP server in tests).
+        max_retries (int): Number of retries after the first failed attempt.
+        backoff_base (float): Delay in seconds before the first retry; doubled on each retry.
+        backoff_max (float): Upper bound for the retry delay in seconds.
+        timeout (float): Connect/read timeout in seconds for each request.
+        chunk_size (int): Size in bytes of each streamed chunk.
+        retry_cooldown (float): Seconds after a failed run before `start()` runs the update again;
+            doubled after each consecutive failed run.
+        retry_cooldown_max (float): Upper bound for the cooldown in seconds.
+    """
+
+    def __init__(self, db_path: str = DB_PATH, url: str = ANEEL_TARIFAS_URL, max_retries: int = 4,
+                 backoff_base: float = 2.0, backoff_max: float = 60.0, timeout: float = 60.0,
+                 chunk_size: int = 1024 * 1024, retry_cooldown: float = 300.0, retry_cooldown_max: float = 3600.0):
+        self.db_path = db_path
+        self.url = url
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self.chunk_size = chunk_size
+        self.retry_cooldown = retry_cooldown
+        self.retry_cooldown_max = retry_cooldown_max
+
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="aneel-update")
+        self._future: Optional[Future] = None
+        self._run_date: Optional[date] = None
+        self._failed_runs = 0
+        self._next_retry_at = 0.0  # time.monotonic() before which a failed run is not retried
+        self._done = threading.Event()
+        self._status = {
+            "state": IDLE,
+            "attempt": 0,
+            "bytes_downloaded": 0,
+            "bytes_total": None,
+            "error": None,
+            "started_at": None,
+            "finished_at": None,
+            "last_updated": None,
+            "next_retry_at": None,
+        }
+
+    def start(self) -> Future:
+        """
+        Start an update unless one is already running or already succeeded today.
+
+        A failed run is retried by the first call after its cooldown (see `retry_cooldown`);
+        until then the failed run's future is returned, so sessions rerunning the page do
+        not start a download each.
+
+        Returns:
+            Future: The future of the current (or today's) update run.
+        """
+        with self._lock:
+            if self._future is not None and (
+                not self._future.done()
+                or (self._status["state"] == FAILED and time.monotonic() < self._next_retry_at)
+                or (self._run_date == date.today() and self._status["state"] != FAILED)
+            ):
+                return self._future
+            self._done.clear()
+            self._run_date = date.today()
+            self._set_status(state=RUNNING, attempt=0, bytes_downloaded=0, bytes_total=None, error=None,
+                             started_at=datetime.now(), finished_at=None)
+            self._future = self._executor.submit(self._run)
+            return self._future
+
+    def status(self) -> dict:
+        """Return a snapshot of the update state, including a `progress` fraction between 0 and 1."""
+        with self._lock:
+            status = dict(self._status)
+        if status["state"] in (UP_TO_DATE, SUCCEEDED):
+            status["progress"] = 1.0
+        elif status["bytes_total"]:
+            status["progress"] = min(1.0, status["bytes_downloaded"] / status["bytes_total"])
+        else:
+            status["progress"] = 0.0
+        return status
+
+    def is_done(self) -> bool:
+        """True once the current run finished, successfully or not."""
+        return self._done.is_set()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """Block until the current run finishes. Intended for scripts and tests, not the UI thread."""
+        return self._done.wait(timeout)
+
+    def _set_status(self, **values) -> None:
+        # Caller must hold self._lock
+        self._status.update(values)
+
+    def _update(self, **values) -> None:
+        with self._lock:
+            self._set_status(**values)
+
+    def _run(self) -> None:
+        logger.info("Tariff update started...")
+        try:
+            last_updated = read_last_updated(self.db_path)
+            self._update(last_updated=last_updated)
+            if last_updated is not None and last_updated >= date.today():
+                logger.info(f"Tariffs already up to date ({last_updated})")
+                self._update(state=UP_TO_DATE, finished_at=datetime.now())
+                return
+
+            content = self._download_with_retry()
+            df_tarifas = pd.read_csv(BytesIO(content), delimiter=";", encoding="windows-1252")
+            df_tarifas = preprocess_tarifas(df_tarifas)
+            write_tarifas(df_tarifas, self.db_path)
+            build_tariff_history(df_tarifas, self.db_path)
+            write_last_updated(self.db_path, date.today())
+            snapshots = get_snapshot_store(db_path=self.db_path)
+            snapshots.create()
+            snapshots.gc()
+
+            clear_caches()
+            with self._lock:
+                self._failed_runs = 0
+                self._set_status(state=SUCCEEDED, error=None, last_updated=date.today(), finished_at=datetime.now(),
+                                 next_retry_at=None)
+            logger.info("Tariff update finished")
+        except Exception as e:
+            with self._lock:
+                self._failed_runs += 1
+                cooldown = min(self.retry_cooldown_max, self.retry_cooldown * 2 ** (self._failed_runs - 1))
+                self._next_retry_at = time.monotonic() + cooldown
+                self._set_status(state=FAILED, error=str(e), finished_at=datetime.now(),
+                                 next_retry_at=datetime.now() + timedelta(seconds=cooldown))
+            logger.error(f"Update failed: {e}; retrying in {cooldown:.0f}s at the earliest")
+        finally:
+            self._done.set()
+
+    def _download_with_retry(self) -> bytes:
+        attempt = 0
+        while True:
+            attempt += 1
+            self._update(attempt=attempt, bytes_downloaded=0, bytes_total=None)
+            try:
+                return self._download()
+            except requests.RequestException as e:
+                if attempt > self.max_retries or not _is_retryable(e):
+                    raise
+                delay = min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1))
+                delay *= random.uniform(0.5, 1.0)  # Jitter so restarted processes don't retry in lockstep
+                logger.warning(f"Download attempt {attempt} failed ({e}); retrying in {delay:.1f}s")
+                self._update(state=RETRYING, error=str(e))
+                time.sleep(delay)
+                self._update(state=RUNNING)
+
+    def _download(self) -> bytes:
+        with requests.get(self.url, stream=True, timeout=self.timeout) as response:
+            response.raise_for_status()
+            total = response.headers.get("Content-Length")
+            self._update(bytes_total=int(total) if total and total.isdigit() else None)
+
+            buffer = BytesIO()
+            downloaded = 0
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                buffer.write(chunk)
+                downloaded += len(chunk)
+                self._update(bytes_downloaded=downloaded)
+            return buffer.getvalue()
+
+
+def _is_retryable(error: requests.RequestException) -> bool:
+    """Retry network errors, timeouts, 429 and 5xx; other HTTP errors are permanent."""
+    response = getattr(error, "response", None)
+    if isinstance(error, requests.HTTPError) and response is not None:
+        return response.status_code == 429 or response.status_code >= 500
+    return True
+
+
+_service: Optional[TariffUpdateService] = None
+_service_lock = threading.Lock()
+
+
+def get_update_service(**kwargs) -> TariffUpdateService:
+    """
+    Return the process-wide update service, creating it on first use.
+
+    Keyword arguments are only applied when the service is created.
+    """
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TariffUpdateService(**kwargs)
+        return _service
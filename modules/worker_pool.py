@@ -0,0 +1,320 @@
+import os
+import sys
+import shutil
+import logging
+import sqlite3
+import tempfile
+import threading
+import time
+import multiprocessing
+import multiprocessing.util
+from concurrent.futures import ProcessPoolExecutor, Future, TimeoutError as FutureTimeout
+from datetime import date
+from typing import Optional
+
+logger = logging.getLogger("Proposal_Generator")
+
+# Per-process state of a worker, set by `_init_worker`
+_worker = {}
+
+
+def _prepare_workspace(base_dir: str) -> str:
+    """
+    Create a private working directory for one worker process.
+
+    The pipeline writes charts and pages to fixed relative paths (`images/`,
+    `Temp_ppt/`), so concurrent workers must not share a directory. Templates and
+    the database (with its dataset snapshots) are symlinked; `images/` is copied
+    because the charts overwrite it.
+    """
+    from modules.data_utils import DB_PATH
+    from modules.snapshots import SNAPSHOT_DIR
+
+    workspace = tempfile.mkdtemp(prefix="proposal-worker-")
+    os.symlink(os.path.join(base_dir, "Proposta PPT"), os.path.join(workspace, "Proposta PPT"))
+    os.symlink(os.path.join(base_dir, DB_PATH), os.path.join(workspace, DB_PATH))
+    os.makedirs(os.path.join(base_dir, SNAPSHOT_DIR), exist_ok=True)
+    os.symlink(os.path.join(base_dir, SNAPSHOT_DIR), os.path.join(workspace, SNAPSHOT_DIR))
+    shutil.copytree(os.path.join(base_dir, "images"), os.path.join(workspace, "images"))
+    os.makedirs(os.path.join(workspace, "Temp_ppt"))
+    return workspace
+
+
+def _warmup_inputs(db_path: Optional[str] = None) -> Optional[dict]:
+    """Inputs of a throw-away proposal for warming a worker, built from whatever the database holds."""
+    from modules.data_utils import DB_PATH, connect_db
+
+    try:
+        conn = connect_db(db_path or DB_PATH)
+    except sqlite3.Error:
+        return None
+    try:
+        tariff = conn.execute(
+            "SELECT SigAgente, DscSubGrupo, DscModalidadeTarifaria, DscREH FROM ANEEL_DB "
+            "WHERE DscSubGrupo = 'A4' AND DscModalidadeTarifaria = 'Verde' ORDER BY DatInicioVigencia DESC LIMIT 1"
+        ).fetchone()
+        agent = conn.execute("SELECT Agente FROM Contatos_Agentes LIMIT 1").fetchone()
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+    if tariff is None or agent is None:
+        return None
+
+    year = date.today().year
+    years = [year, year + 1]
+    return {
+        "produto": "Curva de Preço", "years": years, "yearly_data": {y: {"Preço": 250.0} for y in years},
+        "grid_data": {
+            "Demanda - Ponta": 100.0, "Demanda - Fora Ponta": 300.0,
+            "Demanda s/ ICMS - Ponta": 0.0, "Demanda s/ ICMS - Fora Ponta": 0.0,
+            "Energia Ativa - Ponta": 10000.0, "Energia Ativa - Fora Ponta": 100000.0,
+        },
+        "icms": 18.0, "paseb": 0.83, "cofins": 3.82,
+        "distribuidora": tariff[0], "subgrupo": tariff[1], "modalidade": tariff[2], "resolucao": tariff[3],
+        "Razao_Social": "Warm-up", "Instalacao": "0", "fat_ref": date.today(),
+        "agente": agent[0], "duracao_meses": 12,
+    }
+
+
+def _warm_up() -> None:
+    """
+    Pay the first-use costs before the worker takes real jobs.
+
+    Builds matplotlib's font cache, loads cairo, parses every template into the
+    `load_svg` cache and renders one throw-away proposal, which also warms the
+    chart icons and the tariff queries.
+    """
+    import matplotlib
+    matplotlib.use("Agg")
+    from matplotlib import font_manager
+    import cairosvg  # noqa: F401
+    from modules.pdf_builder import load_svg
+    from modules.artifact_store import TEMPLATE_DIR
+    from modules.proposal_api import build_proposal
+
+    font_manager.findfont("DejaVu Sans")
+    for name in sorted(os.listdir(TEMPLATE_DIR)):
+        if name.endswith(".svg"):
+            load_svg(os.path.join(TEMPLATE_DIR, name))
+
+    inputs = _warmup_inputs()
+    if inputs is None:
+        logger.warning("No tariffs or agents in the database, skipping the warm-up proposal")
+        return
+    try:
+        build_proposal(inputs, reuse_artifact=False, record=False)
+    except Exception as e:
+        logger.warning(f"Warm-up proposal failed: {e}")
+
+
+def _init_worker(base_dir: str, warm_up: bool = True) -> None:
+    """Process initializer: move into a private workspace, share the base directory's artifact store and warm up."""
+    from modules.data_utils import setup_logger
+    from modules.artifact_store import get_artifact_store
+    from modules.async_logging import stop_logging
+    from modules.tracing import set_metrics_dir, remove_metrics_file
+
+    workspace = _prepare_workspace(base_dir)
+    multiprocessing.util.Finalize(None, shutil.rmtree, args=(workspace,), kwargs={"ignore_errors": True}, exitpriority=10)
+    os.chdir(workspace)
+    setup_logger("Proposal_Generator", log_dir=os.path.join(base_dir, "logs"), log_file=f"worker-{os.getpid()}.log")
+    # Worker processes skip atexit; flush the queued log records when the process ends
+    multiprocessing.util.Finalize(None, stop_logging, exitpriority=1)
+    get_artifact_store(root=os.path.join(base_dir, "artifacts"))
+    set_metrics_dir(os.path.join(base_dir, "logs"))
+    multiprocessing.util.Finalize(None, remove_metrics_file, exitpriority=5)
+
+    # Importing the pipeline here keeps it out of the request path
+    import modules.proposal_api  # noqa: F401
+
+    _worker.update(base_dir=base_dir, workspace=workspace)
+    if warm_up:
+        start = time.perf_counter()
+        _warm_up()
+        logger.info(f"Worker {os.getpid()} warmed up in {time.perf_counter() - start:.2f}s")
+    logger.info(f"Worker {os.getpid()} ready in {workspace}")
+
+
+def _render_job(inputs: dict, reuse_artifact: bool) -> tuple:
+    """Render one proposal inside a worker. Returns `(filename, pdf bytes)`."""
+    from modules.proposal_api import render_proposal
+
+    sink = render_proposal(inputs, reuse_artifact=reuse_artifact)
+    if not sink.size:
+        raise RuntimeError("Proposal generation failed, no PDF was written")
+    return sink.filename, sink.getvalue()
+
+
+def _portfolio_job(portfolio: dict, appendix: bool, reuse_artifact: bool) -> tuple:
+    """Render one portfolio proposal inside a worker. Returns `(filename, pdf bytes)`."""
+    from modules.portfolio import generate_portfolio_proposal
+
+    sink = generate_portfolio_proposal(portfolio, appendix=appendix, reuse_artifact=reuse_artifact)
+    if not sink.size:
+        raise RuntimeError("Portfolio proposal generation failed, no PDF was written")
+    return sink.filename, sink.getvalue()
+
+
+def _preview_job(inputs: dict, dpi: int) -> list:
+    """Render draft preview thumbnails inside a worker. Returns `(page name, PNG bytes)` tuples."""
+    from modules.proposal_api import render_preview
+
+    return render_preview(inputs, dpi=dpi)
+
+
+def _ping() -> int:
+    return os.getpid()
+
+
+class ProposalWorkerPool:
+    """
+    Pool of warm worker processes rendering proposals in parallel.
+
+    Each worker renders in its own workspace (see `_prepare_workspace`), so
+    workers never overwrite each other's charts and pages, and warms itself up
+    before taking jobs (see `_warm_up`). Workers are replaced after
+    `max_jobs_per_worker` jobs to bound memory growth; the replacement is
+    started and warmed as soon as the old worker exits, so requests never pay
+    for a cold process. The processes start from a fork server (or by spawning
+    on platforms without one), never by forking a threaded parent.
+
+    Args:
+        workers (int): Number of worker processes.
+        base_dir (str): Directory holding `Proposta PPT/`, `images/` and `DataBase.db`.
+        max_jobs_per_worker (int, optional): Jobs before a worker is recycled; None never recycles.
+        warm_up (bool): Render a throw-away proposal in each new worker.
+    """
+
+    def __init__(self, workers: int = 2, base_dir: str = ".", max_jobs_per_worker: Optional[int] = 50,
+                 warm_up: bool = True):
+        self.workers = workers
+        self.base_dir = os.path.abspath(base_dir)
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.warm_up = warm_up
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+
+    def _context(self):
+        method = "forkserver" if sys.platform != "win32" else "spawn"
+        return multiprocessing.get_context(method)
+
+    def start(self, wait: bool = True) -> "ProposalWorkerPool":
+        """
+        Start (and warm) the worker processes.
+
+        Args:
+            wait (bool): Block until every worker is warm. With False the workers
+                warm up in the background, e.g. while the Streamlit page renders.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=self._context(),
+                    initializer=_init_worker, initargs=(self.base_dir, self.warm_up),
+                    max_tasks_per_child=self.max_jobs_per_worker,
+                )
+                pings = [self._executor.submit(_ping) for _ in range(self.workers)]
+                threading.Thread(target=self._wait_ready, args=(pings,), daemon=True).start()
+        if wait:
+            self._ready.wait()
+        return self
+
+    def _wait_ready(self, pings: list) -> None:
+        for future in pings:
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Worker failed to start: {e}")
+        logger.info(f"Worker pool ready with {self.workers} processes")
+        self._ready.set()
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def submit(self, inputs: dict, reuse_artifact: bool = True) -> Future:
+        """Queue a render and return a Future of `(filename, pdf bytes)`."""
+        self.start(wait=False)
+        return self._executor.submit(_render_job, inputs, reuse_artifact)
+
+    def submit_portfolio(self, portfolio: dict, appendix: bool = True, reuse_artifact: bool = True) -> Future:
+        """Queue a portfolio render (see `generate_portfolio_proposal`) and return a Future of `(filename, pdf bytes)`."""
+        self.start(wait=False)
+        return self._executor.submit(_portfolio_job, portfolio, appendix, reuse_artifact)
+
+    def render(self, inputs: dict, reuse_artifact: bool = True, timeout: Optional[float] = None) -> tuple:
+        """Render a proposal and wait for `(filename, pdf bytes)`."""
+        return self.submit(inputs, reuse_artifact).result(timeout)
+
+    def preview(self, inputs: dict, dpi: Optional[int] = None, timeout: Optional[float] = None) -> list:
+        """Render draft preview thumbnails (see `render_preview`) and wait for `(page name, PNG bytes)` tuples."""
+        from modules.proposal_generator import PREVIEW_DPI
+
+        self.start(wait=False)
+        return self._executor.submit(_preview_job, inputs, dpi or PREVIEW_DPI).result(timeout)
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=wait, cancel_futures=True)
+                self._executor = None
+                self._ready.clear()
+
+
+_pool: Optional[ProposalWorkerPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_worker_pool(**kwargs) -> ProposalWorkerPool:
+    """
+    Return the process-wide worker pool, creating it on first use.
+
+    Keyword arguments are only applied when the pool is created.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProposalWorkerPool(**kwargs)
+        return _pool
+
+
+def render_in_pool(inputs: dict, progress=None, reuse_artifact: bool = True):
+    """
+    `JobManager` job rendering `inputs` on the process-wide pool.
+
+    Polls the worker's Future so that `progress` can raise `JobCancelled`; a job
+    cancelled while still queued never reaches a worker.
+
+    Returns:
+        MemorySink: The rendered PDF.
+    """
+    return _wait_for_pdf(get_worker_pool().submit(inputs, reuse_artifact), progress)
+
+
+def render_portfolio_in_pool(portfolio: dict, progress=None, appendix: bool = True, reuse_artifact: bool = True):
+    """`JobManager` job rendering a portfolio proposal on the process-wide pool (see `render_in_pool`)."""
+    return _wait_for_pdf(get_worker_pool().submit_portfolio(portfolio, appendix, reuse_artifact), progress)
+
+
+def _wait_for_pdf(future: Future, progress=None):
+    from modules.output_sinks import MemorySink
+
+    if progress is None:
+        progress = lambda stage, fraction: None
+    try:
+        while True:
+            progress("Gerando proposta" if future.running() else "Aguardando processo livre", 0.5 if future.running() else 0.1)
+            try:
+                filename, data = future.result(timeout=0.5)
+                break
+            except FutureTimeout:
+                continue
+    except BaseException:
+        future.cancel()
+        raise
+
+    sink = MemorySink()
+    with sink.open(filename) as f:
+        f.write(data)
+    return sink
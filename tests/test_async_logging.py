@@ -0,0 +1,48 @@
+import io
+import json
+import logging
+
+import pytest
+
+from modules.async_logging import JsonFormatter, attach_queue, stop_logging
+
+
+@pytest.fixture
+def logged():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter())
+    logger = logging.getLogger("test_async_logging")
+    logger.setLevel(logging.DEBUG)
+    logger.propagate = False
+    attach_queue(logger, [handler])
+
+    def entries():
+        stop_logging()
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    yield logger, entries
+    logger.handlers.clear()
+
+
+def test_arguments_are_rendered_when_logged(logged):
+    logger, entries = logged
+    quantidade = {"Energia HP": 100}
+    logger.info("quantidade: %s", quantidade, extra={"stage": "calc"})
+    quantidade["Energia HP"] = 200
+
+    (entry,) = entries()
+    assert entry["message"] == "quantidade: {'Energia HP': 100}"
+    assert entry["stage"] == "calc"
+
+
+def test_traceback_is_kept_apart_from_the_message(logged):
+    logger, entries = logged
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception("failed %d", 3)
+
+    (entry,) = entries()
+    assert entry["message"] == "failed 3"
+    assert entry["exc"].endswith("ZeroDivisionError: division by zero")
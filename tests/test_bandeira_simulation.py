@@ -0,0 +1,56 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+from modules.bandeira_simulation import FLAGS, calibrate_probabilities, simulate_savings, store_bandeira_history
+from modules.proposal_generator import contract_start_month
+from modules.snapshots import SnapshotStore
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / "DataBase.db")
+    sqlite3.connect(path).close()
+    return path
+
+
+def test_calibrate_without_history_returns_none(db_path):
+    assert calibrate_probabilities(db_path) is None
+
+
+def test_calibrate_with_history(db_path):
+    store_bandeira_history({f"{year}-01": "Vermelha 2" for year in range(2020, 2025)}
+                           | {f"{year}-07": "Verde" for year in range(2020, 2025)}, db_path)
+    probabilities = calibrate_probabilities(db_path)
+    assert len(probabilities) == 12
+    assert max(probabilities[0]) == probabilities[0][FLAGS.index("Vermelha 2")]
+    assert max(probabilities[6]) == probabilities[6][FLAGS.index("Verde")]
+    assert all(sum(month) == pytest.approx(1.0) for month in probabilities)
+
+
+def test_snapshot_pins_flag_history(db_path, tmp_path):
+    store = SnapshotStore(root=str(tmp_path / "snapshots"), db_path=db_path)
+    before = store.current()
+    assert calibrate_probabilities(store.path(before)) is None
+
+    store_bandeira_history({"2024-01": "Vermelha 2"}, db_path)
+    after = store.current()
+    assert after != before
+    assert calibrate_probabilities(store.path(before)) is None
+    assert calibrate_probabilities(store.path(after)) == calibrate_probabilities(db_path)
+
+
+def test_simulation_starts_in_start_month():
+    # Always green, except always red 2 in January
+    probabilities = [[1.0, 0.0, 0.0, 0.0] for _ in range(12)]
+    probabilities[0] = [0.0, 0.0, 0.0, 1.0]
+    args = ([100.0, 110.0, 120.0, 130.0], 20.0, [50.0], 1, probabilities)
+
+    assert simulate_savings(*args, start_month=1)["economia_media"] == pytest.approx(60.0)
+    assert simulate_savings(*args, start_month=2)["economia_media"] == pytest.approx(30.0)
+
+
+def test_contract_start_month():
+    assert contract_start_month(date(2026, 3, 1), date(2025, 11, 1)) == 3
+    assert contract_start_month(None, date(2025, 11, 1)) == 11
@@ -0,0 +1,46 @@
+import io
+import sqlite3
+
+import pytest
+
+from modules.consumption_history import _parse_number, import_history, load_history
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("1.234,56", 1234.56),
+    ("1234,5", 1234.5),
+    ("1234.56", 1234.56),
+    ("150.000", 150000.0),
+    ("1.234.567", 1234567.0),
+    ("-2.500", -2500.0),
+    ("12.5", 12.5),
+    ("1.2345", 1.2345),
+    ("0.500", 0.5),
+    ("", 0.0),
+    ("-", 0.0),
+    (None, 0.0),
+    (42, 42.0),
+    ("12a", None),
+    ("1.23.456", None),
+])
+def test_parse_number(text, expected):
+    assert _parse_number(text) == expected
+
+
+def test_import_history_reads_thousands_separators(tmp_path):
+    db_path = str(tmp_path / "DataBase.db")
+    sqlite3.connect(db_path).close()
+    export = (
+        "Instalação;Mês;Consumo Ponta (kWh);Consumo Fora Ponta (kWh);Demanda Ponta (kW)\n"
+        "3001234567;01/2026;12.500;150.000;1.234,5\n"
+        "3001234567;02/2026;1.234.567;98765.4;800\n"
+    ).encode("utf-8")
+
+    report = import_history(io.BytesIO(export), "faturas.csv", db_path=db_path)
+
+    assert report["rows_imported"] == 2
+    assert report["rows_rejected"] == 0
+    history = load_history("3001234567", db_path=db_path)
+    assert list(history["Energia Ponta"]) == [12500.0, 1234567.0]
+    assert list(history["Energia Fora Ponta"]) == [150000.0, 98765.4]
+    assert list(history["Demanda Ponta"]) == [1234.5, 800.0]
@@ -0,0 +1,22 @@
+import sqlite3
+
+import pytest
+
+from modules.data_utils import connect_db
+
+
+def test_connect_db_does_not_create_missing_database(tmp_path):
+    db_path = tmp_path / "DataBase.db"
+    with pytest.raises(sqlite3.OperationalError, match="DataBase.db"):
+        connect_db(str(db_path))
+    assert not db_path.exists()
+
+
+def test_connect_db_opens_existing_database(tmp_path):
+    db_path = tmp_path / "Data Base #1.db"
+    sqlite3.connect(db_path).close()
+    conn = connect_db(str(db_path))
+    try:
+        conn.execute("CREATE TABLE t (x)")
+    finally:
+        conn.close()
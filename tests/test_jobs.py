@@ -0,0 +1,33 @@
+import time
+
+from modules.jobs import DONE, JobManager
+
+
+def _wait(manager, job_id):
+    for _ in range(200):
+        job = manager.get(job_id)
+        if job["state"] == DONE:
+            return job
+        time.sleep(0.01)
+    raise AssertionError("job did not finish")
+
+
+def test_finished_job_result_expires():
+    manager = JobManager(result_ttl=0.1)
+    job = _wait(manager, manager.submit(lambda progress: b"%PDF-1.7"))
+    assert job["result"] == b"%PDF-1.7"
+    assert not job["result_expired"]
+
+    time.sleep(0.15)
+    job = manager.get(job["id"])
+    assert job["state"] == DONE
+    assert job["result"] is None
+    assert job["result_expired"]
+
+
+def test_result_kept_without_ttl():
+    manager = JobManager(result_ttl=None)
+    job_id = manager.submit(lambda progress: b"%PDF-1.7")
+    _wait(manager, job_id)
+    time.sleep(0.05)
+    assert manager.get(job_id)["result"] == b"%PDF-1.7"
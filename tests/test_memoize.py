@@ -0,0 +1,39 @@
+from modules.memoize import memoize_files
+
+
+def test_memoize_files_does_not_cache_untouched_output(tmp_path):
+    output = tmp_path / "page.svg"
+    output.write_text("previous customer")
+    calls = []
+
+    @memoize_files(outputs=("path",), ttl=None)
+    def render(customer, path, fail=False):
+        calls.append(customer)
+        if fail:
+            return False
+        with open(path, "w") as f:
+            f.write(customer)
+        return True
+
+    assert render("acme", str(output), fail=True) is False
+    assert render("acme", str(output), fail=True) is False
+    assert calls == ["acme", "acme"]
+    assert output.read_text() == "previous customer"
+
+    assert render("acme", str(output)) is True
+    output.write_text("previous customer")
+    assert render("acme", str(output)) is True
+    assert calls == ["acme", "acme", "acme"]
+    assert output.read_text() == "acme"
+
+
+def test_memoize_files_does_not_cache_missing_output(tmp_path):
+    calls = []
+
+    @memoize_files(outputs=("path",), ttl=None)
+    def render(path):
+        calls.append(path)
+
+    render(str(tmp_path / "missing.svg"))
+    render(str(tmp_path / "missing.svg"))
+    assert len(calls) == 2
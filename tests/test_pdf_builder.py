@@ -0,0 +1,28 @@
+import os
+
+import pytest
+
+from modules.jobs import JobCancelled
+from modules.output_sinks import DirectorySink, OutputSink
+from modules.pdf_builder import generate_pdf
+
+
+SVG = '<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"></svg>'
+
+
+def test_cancellation_propagates_and_leaves_no_partial_file(tmp_path):
+    page = tmp_path / "page 1.svg"
+    page.write_text(SVG)
+    out_dir = tmp_path / "out"
+
+    def progress(stage, fraction):
+        raise JobCancelled()
+
+    with pytest.raises(JobCancelled):
+        generate_pdf([str(page)], DirectorySink(str(out_dir)), progress=progress, filename="proposta.pdf")
+    assert not out_dir.exists() or os.listdir(out_dir) == []
+
+
+def test_output_sink_requires_open():
+    with pytest.raises(TypeError):
+        OutputSink()
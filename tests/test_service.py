@@ -0,0 +1,105 @@
+import http.client
+import json
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from modules.service import ProposalService
+
+INPUTS = {
+    "produto": "Preço Fixo", "years": [2026], "grid_data": {}, "icms": 0.18, "paseb": 0.01, "cofins": 0.05,
+    "distribuidora": "CEMIG-D", "subgrupo": "A4", "modalidade": "Verde", "resolucao": "REH 3.000",
+    "Razao_Social": "ACME", "Instalacao": "123", "fat_ref": "2026-01-01", "agente": "Ana",
+    "duracao_meses": 12, "yearly_data": {"2026": {"Preço": 250.0}},
+}
+
+
+class _StubPool:
+    """Stands in for `ProposalWorkerPool`; the test decides when and how each render finishes."""
+
+    workers = 1
+
+    def __init__(self):
+        self.futures = []
+
+    def start(self):
+        return self
+
+    def shutdown(self, wait=True):
+        pass
+
+    def submit(self, inputs, reuse_artifact=True):
+        future = Future()
+        future.set_running_or_notify_cancel()  # Picked up by a worker at once
+        self.futures.append(future)
+        return future
+
+
+@pytest.fixture
+def service():
+    pool = _StubPool()
+    service = ProposalService(port=0, max_queue=0, timeout=0.2, pool=pool)
+    thread = threading.Thread(target=service.serve_forever, daemon=True)
+    thread.start()
+    yield service
+    service.shutdown()
+    thread.join(5)
+
+
+def _post(service, body, headers=None):
+    host, port = service.address[:2]
+    conn = http.client.HTTPConnection(host, port, timeout=5)
+    try:
+        conn.putrequest("POST", "/proposals")
+        for name, value in (headers or {"Content-Length": str(len(body))}).items():
+            conn.putheader(name, value)
+        conn.endheaders(body)
+        response = conn.getresponse()
+        return response.status, response.read(), response
+    finally:
+        conn.close()
+
+
+def _render_in_background(service, result):
+    # Complete the next submitted render once the request is waiting on it
+    def complete():
+        while not service.pool.futures:
+            threading.Event().wait(0.01)
+        service.pool.futures[-1].set_result(result)
+    threading.Thread(target=complete, daemon=True).start()
+
+
+def test_render_returns_pdf(service):
+    _render_in_background(service, ("Proposta_ACME.pdf", b"%PDF-1.7"))
+    status, body, response = _post(service, json.dumps(INPUTS).encode())
+    assert status == 200
+    assert body == b"%PDF-1.7"
+    assert response.getheader("Content-Type") == "application/pdf"
+    assert service.backpressure.admitted == 0
+
+
+def test_timeout_keeps_slot_until_render_finishes(service):
+    status, _, _ = _post(service, json.dumps(INPUTS).encode())
+    assert status == 504
+    # The worker is still rendering, so the next request is turned away
+    assert service.backpressure.admitted == 1
+    status, _, response = _post(service, json.dumps(INPUTS).encode())
+    assert status == 503
+    assert response.getheader("Retry-After") == str(service.retry_after)
+
+    service.pool.futures[0].set_result(("Proposta_ACME.pdf", b"%PDF-1.7"))
+    assert service.backpressure.admitted == 0
+
+
+@pytest.mark.parametrize("body, headers", [
+    (b"{}", None),
+    (b"not json", None),
+    (b"{}", {"Content-Length": "abc"}),
+    (b"{}", {"Content-Length": "-1"}),
+])
+def test_bad_request(service, body, headers):
+    status, payload, _ = _post(service, body, headers)
+    assert status == 400
+    assert "error" in json.loads(payload)
+    assert service.pool.futures == []
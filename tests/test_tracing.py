@@ -0,0 +1,19 @@
+import os
+
+from modules import tracing
+
+
+def test_metrics_file_is_per_process(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(tracing, "METRICS_DIR", tracing.METRICS_DIR)
+    tracing.set_metrics_dir("logs")
+    with tracing.span("test.stage"):
+        pass
+
+    os.chdir(tmp_path.parent)  # like a worker moving into its workspace
+    tracing.write_prometheus()
+    path = tmp_path / "logs" / f"proposal_metrics-{os.getpid()}.prom"
+    assert 'stage="test.stage"' in path.read_text()
+
+    tracing.remove_metrics_file()
+    assert not path.exists()
@@ -0,0 +1,110 @@
+import http.server
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import modules.snapshots
+from modules.update_service import FAILED, SUCCEEDED, TariffUpdateService
+
+HEADER = ("DatGeracaoConjuntoDados;DscREH;SigAgente;NumCNPJDistribuidora;DatInicioVigencia;DatFimVigencia;"
+          "DscBaseTarifaria;DscSubGrupo;DscModalidadeTarifaria;DscClasse;DscSubClasse;DscDetalhe;"
+          "NomPostoTarifario;DscUnidadeTerciaria;SigAgenteAcessante;VlrTUSD;VlrTE")
+ROWS = [
+    "2025-03-17;REH 3.000;CEMIG-D;6981180000116;2024-05-28;2025-05-27;Tarifa de Aplicação;A4;Verde;"
+    "Não se aplica;Não se aplica;Não se aplica;{posto};{unidade};Não se aplica;{tusd};{te}".format(**row)
+    for row in (
+        {"posto": "Não se aplica", "unidade": "kW", "tusd": "20,50", "te": ",00"},
+        {"posto": "Ponta", "unidade": "MWh", "tusd": "1500,10", "te": "450,20"},
+        {"posto": "Fora ponta", "unidade": "MWh", "tusd": "120,30", "te": "280,40"},
+    )
+]
+CSV = "\n".join([HEADER, *ROWS]).encode("windows-1252")
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    # Status codes answered before the CSV, one per request
+    failures = []
+    requests = 0
+
+    def do_GET(self):
+        type(self).requests += 1
+        if self.failures:
+            self.send_error(self.failures.pop(0))
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(CSV)))
+        self.end_headers()
+        self.wfile.write(CSV)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    _Handler.failures, _Handler.requests = [], 0
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def service(server, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(modules.snapshots, "_store", None)
+    return TariffUpdateService(db_path=str(tmp_path / "DataBase.db"),
+                               url=f"http://127.0.0.1:{server.server_address[1]}/tarifas.csv",
+                               max_retries=2, backoff_base=0.01, backoff_max=0.02, timeout=5, chunk_size=64,
+                               retry_cooldown=0.2)
+
+
+def test_update_retries_transient_errors_and_reports_progress(service):
+    _Handler.failures = [503]
+    service.start().result(timeout=30)
+
+    status = service.status()
+    assert status["state"] == SUCCEEDED, status["error"]
+    assert status["attempt"] == 2
+    assert status["bytes_downloaded"] == status["bytes_total"] == len(CSV)
+    assert status["progress"] == 1.0
+    conn = sqlite3.connect(service.db_path)
+    try:
+        assert conn.execute("SELECT COUNT(*) FROM ANEEL_DB").fetchone()[0] == len(ROWS)
+    finally:
+        conn.close()
+
+
+def test_update_gives_up_on_permanent_errors(service):
+    _Handler.failures = [404]
+    service.start().result(timeout=30)
+
+    status = service.status()
+    assert status["state"] == FAILED
+    assert status["attempt"] == 1
+    assert _Handler.requests == 1
+
+
+def test_failed_update_is_retried_on_next_start(service):
+    _Handler.failures = [500, 500, 500]
+    first = service.start()
+    first.result(timeout=30)
+    assert service.status()["state"] == FAILED
+    assert _Handler.requests == 3
+
+    # Within the cooldown every caller gets the failed run back, without a new download
+    assert service.start() is first
+    assert _Handler.requests == 3
+    assert service.status()["next_retry_at"] is not None
+
+    time.sleep(0.25)
+    second = service.start()
+    assert second is not first
+    second.result(timeout=30)
+    assert service.status()["state"] == SUCCEEDED
+    # A successful run is reused for the rest of the day
+    assert service.start() is second